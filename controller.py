@@ -5,7 +5,8 @@
 # This file is internal, confidential source code and is protected by
 # trade secret and copyright laws.
 
-import select, struct, time, math, heapq, sys
+import select, struct, time, math, heapq, sys, os, fcntl, errno, threading, collections
+import ctypes, ctypes.util
 import usb1, libusb1
 
 from twisted.internet import defer
@@ -27,13 +28,66 @@ class _patched_Poller(object):
 
   def poll(self, timeout_in_seconds):
     if timeout_in_seconds is not None:
-      self._poller.poll(int(math.ceil(timeout_in_seconds * 1000)))
+      return self._poller.poll(int(math.ceil(timeout_in_seconds * 1000)))
     else:
-      self._poller.poll(None)
+      return self._poller.poll(None)
+
+# Python 2 has no monotonic clock, so timers read CLOCK_MONOTONIC through
+# ctypes - unlike time.time(), it doesn't jump when the system clock is
+# stepped (eg by NTP). Falls back to time.time() if it's not available:
+class _timespec(ctypes.Structure):
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+_CLOCK_MONOTONIC = 1
+
+try:
+  _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+  _clock_gettime = _libc.clock_gettime
+  _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+except (OSError, AttributeError):
+  _clock_gettime = None
+
+def monotonic_time():
+  """Returns the time in seconds from a clock that never goes backwards, for
+  measuring intervals. The starting point is arbitrary."""
+  if _clock_gettime is None:
+    return time.time()
+
+  t = _timespec()
+
+  if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+    return time.time()
+
+  return t.tv_sec + t.tv_nsec * 1e-9
 
 assert getattr(usb1.USBTransfer, "getUserData") is not None, \
   "A newer version of the python-libusb1 library is required."
 
+# Precompiled packers for the structures sent or received with every frame:
+_ENQUEUE_STRUCT = struct.Struct("<Lhh")
+_INTERRUPT_STRUCT = struct.Struct("<BBHLQLL")
+
+_CONTROL_WRITE_TYPE = \
+  libusb1.LIBUSB_TYPE_VENDOR | \
+  libusb1.LIBUSB_ENDPOINT_OUT | \
+  libusb1.LIBUSB_RECIPIENT_DEVICE
+_CONTROL_READ_TYPE = \
+  libusb1.LIBUSB_TYPE_VENDOR | \
+  libusb1.LIBUSB_ENDPOINT_IN | \
+  libusb1.LIBUSB_RECIPIENT_DEVICE
+
+# Number of completed USB transfers kept for reuse, instead of allocating
+# (and freeing) a libusb transfer for every control request:
+TRANSFER_POOL_SIZE = 8
+
+# Maximum number of TC_ENQUEUE transfers that can be in flight at once:
+MAX_ENQUEUE_WINDOW = 16
+
+# Cancelled timers are left in the timer heap (so cancelling is O(1)) until
+# they reach the top, or until there are at least this many and they make up
+# more than half the heap, when the heap is rebuilt without them:
+TIMER_COMPACT_MINIMUM = 64
+
 TC_ISSUE_STATE_COMMAND = 0x00
 TC_GET_VERSION = 0x01
 TC_MC_CONFIGURE = 0x02
@@ -279,6 +333,48 @@ class ControllerException(Exception):
 class ControllerUsageException(Exception):
   pass
 
+class ControllerTimeoutException(ControllerException):
+  pass
+
+class ControllerFuture(object):
+  """The result of an operation posted to the event loop with Controller.call_in_loop.
+  If the operation returns a Deferred, the future is done when the Deferred fires."""
+  def __init__(self):
+    self._event = threading.Event()
+    self._result = None
+    self._failure = None
+
+  def __repr__(self):
+    if not self.done():
+      return "<ControllerFuture: pending>"
+    elif self._failure is not None:
+      return "<ControllerFuture: failed, %s>" % self._failure.getErrorMessage()
+    else:
+      return "<ControllerFuture: %r>" % (self._result,)
+
+  def done(self):
+    return self._event.is_set()
+
+  def result(self, timeout = None):
+    """Waits up to timeout seconds (forever, if None) for the operation to finish,
+    and returns its result, or raises its exception."""
+    if not self._event.wait(timeout):
+      raise ControllerTimeoutException( \
+        "The operation did not finish within %s seconds." % timeout)
+
+    if self._failure is not None:
+      self._failure.raiseException()
+
+    return self._result
+
+  def _set_result(self, result):
+    self._result = result
+    self._event.set()
+
+  def _set_failure(self, run_failure):
+    self._failure = run_failure
+    self._event.set()
+
 class ControllerVersionException(Exception):
   pass
 
@@ -460,7 +556,12 @@ class UsbTransferError(object):
       (libusb1.libusb_transfer_status(self.status), self.status, self.command)
 
 class EnqueueDetails(object):
+  """The controller keeps one of these and updates it before each call to
+  enqueue_frame_available, so drivers must not keep a reference to it."""
   def __init__(self, controller):
+    self.update(controller)
+
+  def update(self, controller):
     self.last_transmitted_frame = controller._last_transmitted_frame
     self.last_enqueued_frame = controller._last_enqueued_frame
     self.last_dequeued_frame = controller._last_dequeued_frame
@@ -474,13 +575,14 @@ class ExceptionDetails(object):
     self.exception = exception
     self.properties = properties
 
-  def __repr__(self):
-    if 0 <= self.exception <= len(exception_descriptions):
-      description = exception_descriptions[self.exception]
+  def description(self):
+    if 0 <= self.exception < len(exception_descriptions):
+      return exception_descriptions[self.exception]
     else:
-      description = "(Unknown Exception Code %s)" % self.exception
+      return "(Unknown Exception Code %s)" % self.exception
 
-    return "<ExceptionDetails %s %s>" % (description, self.properties)
+  def __repr__(self):
+    return "<ExceptionDetails %s %s>" % (self.description(), self.properties)
 
 class StateDetails(object):
   def __init__(self, controller, state, exception):
@@ -520,24 +622,63 @@ class CounterDetails(object):
 class GuiderResult(object):
   pass
 
+class TimerStatistics(object):
+  """How late timer callbacks were run by the event loop, in seconds after
+  their expiry time."""
+  def __init__(self):
+    self.count = 0
+    self.total_lateness = 0.0
+    self.max_lateness = 0.0
+    self.last_lateness = 0.0
+
+  def __repr__(self):
+    return "<TimerStatistics: %d timers, lateness mean %.1f ms, max %.1f ms>" % \
+      (self.count, self.mean_lateness() * 1000, self.max_lateness * 1000)
+
+  def add(self, lateness):
+    self.count += 1
+    self.total_lateness += lateness
+    self.last_lateness = lateness
+
+    if lateness > self.max_lateness:
+      self.max_lateness = lateness
+
+  def mean_lateness(self):
+    if self.count == 0:
+      return 0.0
+
+    return self.total_lateness / self.count
+
 class ControllerTimer(object):
-  def __init__(self, controller, expiry_time, callback):
+  def __init__(self, controller, expiry_time, callback, interval = None):
     self._controller = controller
     self._expiry_time = expiry_time
     self._callback = callback
+    self._interval = interval
     self._cancelled = False
 
   def __cmp__(self, rhs):
     return cmp(self._expiry_time, rhs._expiry_time)
 
 class Controller(object):
-  def __init__(self, driver):
+  def __init__(self, driver, device = None, device_handle = None, backend = None):
     # Keep a reference to the driver:
     self._driver = driver
 
-    # Open and set the USB configuration of the controller:
-    self._context = usb1.LibUSBContext()
-    self._device_handle = self._find_and_open_device()
+    # The USB library - the usb1 module, or a replacement with the same
+    # LibUSBContext and USBPoller interface, like fakeusb.Backend:
+    if backend is None:
+      backend = usb1
+    self._backend = backend
+
+    # Open and set the USB configuration of the controller, unless an open
+    # device handle was given:
+    if device_handle is None:
+      self._context = self._backend.LibUSBContext()
+      self._device_handle = self._find_and_open_device(device)
+    else:
+      self._context = None
+      self._device_handle = device_handle
     self._device = self._device_handle.getDevice()
 
     self._configuration = self._device[0]
@@ -554,7 +695,13 @@ class Controller(object):
     self._last_enqueued_frame = 0xffffffffL
     self._last_dequeued_frame = 0xffffffffL
 
-    self._enqueue_in_progress = False
+    # Enqueue transfers in flight, the number allowed at once, the frame
+    # number of the last one acknowledged by the controller, and whether
+    # one has failed (after which no more frames are sent):
+    self._enqueues_in_flight = 0
+    self._enqueue_window = 1
+    self._last_acknowledged_frame = 0xffffffffL
+    self._enqueue_failed = False
 
     self._last_inputs = 0L
     self._last_outputs = 0L
@@ -565,49 +712,95 @@ class Controller(object):
     self._running = True
     self._run_failure = None
 
+    # Timers ordered by expiry time (on the monotonic_time clock), the number
+    # of cancelled timers still in the heap, and how late they've run:
     self._timers_heap = []
+    self._cancelled_timers = 0
+    self.timer_statistics = TimerStatistics()
+
+    # Operations posted by other threads with call_in_loop, and a pipe used to
+    # wake up the event loop when one is posted:
+    self._mailbox = collections.deque()
+    self._mailbox_lock = threading.Lock()
+    self._loop_thread = None
+    self._closed = False
+    self._wakeup_read, self._wakeup_write = os.pipe()
+    for fd in (self._wakeup_read, self._wakeup_write):
+      fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
 
     self._driver_initialised = False
 
-  def _find_and_open_device(self):
-    device_handles = []
-
-    vendor_id = 0x1bad
-    product_id = 0xbeef
-
-    # Build a list of the connected controllers:
-    for device_handle in self._context.getDeviceList():
-      if device_handle.getVendorID() == vendor_id and \
-        device_handle.getProductID() == product_id:
-        device_handles.append(device_handle)
-        break
-
-    # Complain if we don't have exactly one:
-    if len(device_handles) == 0:
-      raise ControllerNotConnectedException( \
-        "No controllers were found.")
-    elif len(device_handles) > 1:
-      raise MultipleControllersConnectedException( \
-        "More than one controller was found, and using multiple " \
-        "controllers is not currently supported.")
-
-    # Open and return it:
-    return device_handle.open()
+    # Reusable USB transfers, and the details object passed to every call
+    # to enqueue_frame_available (created on the first call):
+    self._transfer_pool = [self._device_handle.getTransfer() \
+      for i in range(TRANSFER_POOL_SIZE)]
+    self._enqueue_details = None
+
+  def _find_and_open_device(self, device = None):
+    """Find and open a controller. If 'device' is None, exactly one controller must be
+    connected. Otherwise it selects one of several connected controllers - an integer is
+    an index into the list of connected controllers (see find_devices), and a string is
+    either a USB serial number, or the bus number and device address as "bus:address"."""
+    device_handles = find_devices(self._context)
+
+    if device is None:
+      # Complain if we don't have exactly one:
+      if len(device_handles) == 0:
+        raise ControllerNotConnectedException( \
+          "No controllers were found.")
+      elif len(device_handles) > 1:
+        raise MultipleControllersConnectedException( \
+          "More than one controller was found, and no device was selected.")
+      return device_handles[0].open()
+
+    if type(device) in (int, long):
+      if not (0 <= device < len(device_handles)):
+        raise ControllerNotConnectedException( \
+          "Controller %d not found, %d controllers connected." % (device, len(device_handles)))
+      return device_handles[device].open()
+
+    for device_handle in device_handles:
+      address = "%d:%d" % (device_handle.getBusNumber(), device_handle.getDeviceAddress())
+      try:
+        serial = device_handle.getSerialNumber()
+      except usb1.USBError:
+        serial = None
+      if device in (address, serial):
+        return device_handle.open()
+
+    raise ControllerNotConnectedException( \
+      "No controller found matching device '%s'." % device)
 
   def _close(self):
+    for transfer in self._transfer_pool:
+      transfer.close()
+    self._transfer_pool = []
+
     self._device_handle.close()
     self._device_handle = None
 
-    self._context.exit()
+    if self._context is not None:
+      self._context.exit()
+
+  def _get_transfer(self):
+    """Return a USB transfer from the pool, or a new one if the pool is empty."""
+    if self._transfer_pool:
+      return self._transfer_pool.pop()
+    return self._device_handle.getTransfer()
+
+  def _release_transfer(self, transfer):
+    """Return a completed USB transfer to the pool, or free it if the pool is full."""
+    if len(self._transfer_pool) < TRANSFER_POOL_SIZE + self._enqueue_window and \
+      self._device_handle is not None:
+      self._transfer_pool.append(transfer)
+    else:
+      transfer.close()
 
   def _control_write(self, command, data = ""):
     d = defer.Deferred()
 
-    transfer = self._device_handle.getTransfer()
-    transfer.setControl( \
-      libusb1.LIBUSB_TYPE_VENDOR | \
-      libusb1.LIBUSB_ENDPOINT_OUT | \
-      libusb1.LIBUSB_RECIPIENT_DEVICE, \
+    transfer = self._get_transfer()
+    transfer.setControl(_CONTROL_WRITE_TYPE, \
       command, 0, 0, data, self._complete_control_write, (d, command))
     transfer.submit()
 
@@ -621,22 +814,19 @@ class Controller(object):
     if status == libusb1.LIBUSB_TRANSFER_COMPLETED:
       written = transfer.getActualLength()
 
-      transfer.close()
+      self._release_transfer(transfer)
 
       deferred.callback(written)
     else:
-      transfer.close()
+      self._release_transfer(transfer)
 
       deferred.errback(UsbTransferError(command, status))
 
   def _control_read(self, command, data_length = 0):
     d = defer.Deferred()
 
-    transfer = self._device_handle.getTransfer()
-    transfer.setControl( \
-      libusb1.LIBUSB_TYPE_VENDOR | \
-      libusb1.LIBUSB_ENDPOINT_IN | \
-      libusb1.LIBUSB_RECIPIENT_DEVICE, \
+    transfer = self._get_transfer()
+    transfer.setControl(_CONTROL_READ_TYPE, \
       command, 0, 0, data_length, self._complete_control_read, (d, command))
     transfer.submit()
 
@@ -650,16 +840,16 @@ class Controller(object):
     if status == libusb1.LIBUSB_TRANSFER_COMPLETED:
       read = transfer.getBuffer()
 
-      transfer.close()
+      self._release_transfer(transfer)
 
       deferred.callback(read)
     else:
-      transfer.close()
+      self._release_transfer(transfer)
 
       deferred.errback(UsbTransferError(command, status))
 
   def _initiate_interrupt_read(self):
-    transfer = self._device_handle.getTransfer()
+    transfer = self._get_transfer()
     transfer.setInterrupt(
       0x81, 24, self._complete_interrupt_read)
     transfer.submit()
@@ -671,7 +861,7 @@ class Controller(object):
 
         changed, state, flags, exception, inputs, \
           last_enqueued_frame, last_dequeued_frame = \
-          struct.unpack("<BBHLQLL", buffer)
+          _INTERRUPT_STRUCT.unpack(buffer)
 
         self._last_enqueued_frame = last_enqueued_frame
         self._last_dequeued_frame = last_dequeued_frame
@@ -698,7 +888,7 @@ class Controller(object):
 
         self._initiate_interrupt_read()
 
-        if not self._enqueue_in_progress:
+        if self._enqueues_in_flight < self._enqueue_window:
           self._call_enqueue_available()
 
       else:
@@ -709,7 +899,7 @@ class Controller(object):
           self._driver.runtime_error(failure.Failure(InterruptTransferFailedException( \
             "The USB interrupt transfer to the controller failed.", transfer.getStatus())))
     finally:
-      transfer.close()
+      self._release_transfer(transfer)
 
   def shutdown(self):
     """Raises a controller exception that causes the controller to start a ramped shutdown.
@@ -942,37 +1132,167 @@ class Controller(object):
 
     The returned handle can be passed to cancel_timer to cancel the callback before
     it has occurred."""
-    timer = ControllerTimer(self, time.time() + seconds, callback)
+    timer = ControllerTimer(self, monotonic_time() + seconds, callback)
+
+    heapq.heappush(self._timers_heap, timer)
+
+    return timer
+
+  def add_periodic_timer(self, seconds, callback):
+    """Schedules a call to the callback function every 'seconds' seconds, until
+    the returned handle is passed to cancel_timer.
+
+    Calls are scheduled at a fixed rate, so a late call doesn't delay the ones
+    after it. If the event loop falls more than a whole period behind, the
+    missed calls are skipped rather than run back to back."""
+    if seconds <= 0.0:
+      raise ControllerUsageException("The period of a timer must be positive.")
+
+    timer = ControllerTimer(self, monotonic_time() + seconds, callback, seconds)
 
     heapq.heappush(self._timers_heap, timer)
 
     return timer
 
   def cancel_timer(self, timer):
-    """Cancels a callback."""
+    """Cancels a callback. The timer is removed from the heap later, when it
+    reaches the top or the heap is compacted."""
+    if timer._cancelled:
+      return
+
     timer._cancelled = True
 
-  def _run_timer_callbacks(self):
-    now = time.time()
+    self._cancelled_timers += 1
+
+    if self._cancelled_timers >= TIMER_COMPACT_MINIMUM and \
+      self._cancelled_timers * 2 > len(self._timers_heap):
+      self._compact_timers()
+
+  def _compact_timers(self):
+    self._timers_heap = [timer for timer in self._timers_heap if not timer._cancelled]
+
+    heapq.heapify(self._timers_heap)
+
+    self._cancelled_timers = 0
 
-    while len(self._timers_heap) >= 1:
+  def _next_timer(self):
+    """Returns the first timer due to expire, discarding cancelled timers from
+    the top of the heap, or None if there are no timers."""
+    while self._timers_heap:
       timer = self._timers_heap[0]
 
-      if now > timer._expiry_time:
-        heapq.heappop(self._timers_heap)
+      if not timer._cancelled:
+        return timer
+
+      heapq.heappop(self._timers_heap)
 
-        if not timer._cancelled:
-          timer._callback()
+      self._cancelled_timers -= 1
+
+    return None
+
+  def call_in_loop(self, function, *args, **kwargs):
+    """Calls function(*args, **kwargs) on the event loop thread, and returns a
+    ControllerFuture for the result.
+
+    This is the only Controller method that's safe to call from other threads.
+    The operation is added to a mailbox, and the event loop is woken up through a
+    pipe registered with its poller, so it runs without waiting for the next USB
+    event or timer. If this is called from the event loop thread itself, or before
+    the event loop has started, the function is called immediately."""
+    future = ControllerFuture()
+
+    with self._mailbox_lock:
+      if self._closed:
+        future._set_failure(failure.Failure(ControllerNotConnectedException( \
+          "The controller event loop has finished.")))
+        return future
+
+      loop_thread = self._loop_thread
+      if loop_thread is not None and loop_thread is not threading.current_thread():
+        self._mailbox.append((future, function, args, kwargs))
+        try:
+          os.write(self._wakeup_write, "x")
+        except OSError, error:
+          if error.errno != errno.EAGAIN:   # The pipe is already full of wakeups
+            raise
+        return future
+
+    self._call_posted(future, function, args, kwargs)
+    return future
+
+  def _call_posted(self, future, function, args, kwargs):
+    try:
+      result = function(*args, **kwargs)
+    except:
+      future._set_failure(failure.Failure())
+    else:
+      if isinstance(result, defer.Deferred):
+        result.addCallbacks(future._set_result, future._set_failure)
       else:
+        future._set_result(result)
+
+  def _run_mailbox(self):
+    """Runs the operations posted by other threads, in the order they were posted."""
+    try:
+      while os.read(self._wakeup_read, 4096):
+        pass
+    except OSError, error:
+      if error.errno != errno.EAGAIN:
+        raise
+
+    mailbox = self._mailbox
+    while mailbox:
+      self._call_posted(*mailbox.popleft())
+
+  def _close_mailbox(self):
+    """Fails any operations still waiting in the mailbox, once the event loop has finished."""
+    with self._mailbox_lock:
+      self._closed = True
+      self._loop_thread = None
+
+    while self._mailbox:
+      future = self._mailbox.popleft()[0]
+      future._set_failure(failure.Failure(ControllerNotConnectedException( \
+        "The controller event loop finished before the operation could run.")))
+
+    os.close(self._wakeup_read)
+    os.close(self._wakeup_write)
+
+  def _run_timer_callbacks(self):
+    now = monotonic_time()
+
+    while True:
+      timer = self._next_timer()
+
+      if timer is None or now < timer._expiry_time:
         break
 
+      self.timer_statistics.add(now - timer._expiry_time)
+
+      if timer._interval is None:
+        heapq.heappop(self._timers_heap)
+      else:
+        # Reschedule a periodic timer in place, skipping any whole periods
+        # that have already been missed:
+        missed = int((now - timer._expiry_time) / timer._interval)
+
+        timer._expiry_time += (missed + 1) * timer._interval
+
+        heapq.heapreplace(self._timers_heap, timer)
+
+      timer._callback()
+
   def run(self, system_poller):
     """Runs the event loop, after calling the driver initialisation method.
 
     Driver event handlers and timers are handled by the event loop. Optionally, a
     user supplied poller can be passed in. The poller must implement the interface
     described in the python-libusb1 library."""
-    poller = usb1.USBPoller(self._context, system_poller)
+    poller = self._backend.USBPoller(self._context, system_poller)
+    poller.register(self._wakeup_read, select.POLLIN)
+
+    with self._mailbox_lock:
+      self._loop_thread = threading.current_thread()
 
     self._initiate_interrupt_read()
 
@@ -981,21 +1301,29 @@ class Controller(object):
     self._running = True
 
     while self._running:
-      if len(self._timers_heap) >= 1:
-        # There are timers to eventually call:
-        next_timer = self._timers_heap[0]
+      next_timer = self._next_timer()
 
-        next_timer_time = next_timer._expiry_time - time.time()
+      if next_timer is not None:
+        # There are timers to eventually call:
+        next_timer_time = next_timer._expiry_time - monotonic_time()
 
         if next_timer_time < 0.0: next_timer_time = 0.0
 
         poller.poll(next_timer_time)
 
+        self._run_mailbox()
+
         self._run_timer_callbacks()
       else:
         # No timers, just wait for file events:
         poller.poll()
 
+        self._run_mailbox()
+
+    poller.unregister(self._wakeup_read)
+
+    self._close_mailbox()
+
     self._close()
 
     # If stop was called with an exception (wrapped in a twisted
@@ -1045,16 +1373,36 @@ class Controller(object):
 
     return failure
 
+  def set_enqueue_window(self, window):
+    """Sets the number of enqueue transfers that can be in flight at once.
+
+    With a window of one (the default), each frame is only sent after the last one
+    has been acknowledged, so refilling the queue takes a full USB round trip for
+    every frame. With a larger window, enqueue_frame_available is called again as
+    soon as each frame is submitted, until the window is full. Control transfers
+    are carried out in the order they were submitted, so frames still reach the
+    controller in frame number order."""
+    if not (1 <= window <= MAX_ENQUEUE_WINDOW):
+      raise ControllerUsageException( \
+        "The enqueue window must be between 1 and %d." % MAX_ENQUEUE_WINDOW)
+
+    self._enqueue_window = window
+
   def enqueue_frame(self, a_steps, b_steps):
     """Enqueues a frame and returns the frame number of the enqueued frame.
 
     This method should only be called from within the enqueue_frame_available driver
     event, and should only be called once per call to enqueue_frame_available. Once
-    the frame has been successfully enqueued another call to enqueue_frame_available is
-    made, allowing more frames to be enqueued if required."""
-    assert not self._enqueue_in_progress
+    the frame has been submitted (or acknowledged, if the enqueue window is full)
+    another call to enqueue_frame_available is made, allowing more frames to be
+    enqueued if required."""
+    assert self._enqueues_in_flight < self._enqueue_window
 
-    self._enqueue_in_progress = True
+    if self._enqueue_failed:
+      raise ControllerUsageException( \
+        "An earlier enqueue failed, no more frames can be sent.")
+
+    self._enqueues_in_flight += 1
 
     self._last_transmitted_frame = \
       (self._last_transmitted_frame + 1) % 0x100000000L
@@ -1064,28 +1412,65 @@ class Controller(object):
     assert -32768 <= a_steps <= 32767
     assert -32768 <= b_steps <= 32767
 
-    control_data = struct.pack("<Lhh", frame_number, a_steps, b_steps)
-
-    d = self._control_write(TC_ENQUEUE, control_data)
-    d.addCallback(self._handle_enqueue_completed)
-    d.addErrback(self._handle_error)
+    # The enqueue path doesn't use a Deferred, to avoid allocating one (and
+    # its callback chain) for every frame:
+    transfer = self._get_transfer()
+    transfer.setControl(_CONTROL_WRITE_TYPE, TC_ENQUEUE, 0, 0, \
+      _ENQUEUE_STRUCT.pack(frame_number, a_steps, b_steps), \
+      self._complete_enqueue, frame_number)
+    transfer.submit()
 
     return frame_number
 
-  def _handle_enqueue_completed(self, bytes_written):
-    self._enqueue_in_progress = False
+  def _complete_enqueue(self, transfer):
+    status = transfer.getStatus()
+    frame_number = transfer.getUserData()
+
+    self._release_transfer(transfer)
 
-    self._call_enqueue_available()
+    self._enqueues_in_flight -= 1
+
+    if status != libusb1.LIBUSB_TRANSFER_COMPLETED:
+      self._handle_enqueue_error(failure.Failure(UsbTransferError(TC_ENQUEUE, status)))
+    elif frame_number != (self._last_acknowledged_frame + 1) % 0x100000000L:
+      self._handle_enqueue_error(failure.Failure(ControllerException( \
+        "Enqueue of frame %d completed out of order, expected frame %d." % \
+        (frame_number, (self._last_acknowledged_frame + 1) % 0x100000000L))))
+    else:
+      self._last_acknowledged_frame = frame_number
+
+      self._handle_enqueue_completed(None)
+
+  def _handle_enqueue_completed(self, bytes_written):
+    if not self._enqueue_failed:
+      self._call_enqueue_available()
 
   def _handle_enqueue_error(self, failure):
-    self._enqueue_in_progress = False
+    # Frames already in flight can't be recalled, but nothing more is sent. The
+    # controller queue then underflows, and the driver handles that exception
+    # in the usual way:
+    if not self._enqueue_failed:
+      self._enqueue_failed = True
 
-    failure.printTraceback()
+      failure.printTraceback()
 
   def _call_enqueue_available(self):
-    details = EnqueueDetails(self)
+    # Keep calling the driver while there's room in the enqueue window, and it
+    # keeps sending frames:
+    while self._enqueues_in_flight < self._enqueue_window and \
+      not self._enqueue_failed:
+      transmitted = self._last_transmitted_frame
+
+      details = self._enqueue_details
+      if details is None:
+        details = self._enqueue_details = EnqueueDetails(self)
+      else:
+        details.update(self)
 
-    self._driver.enqueue_frame_available(details)
+      self._driver.enqueue_frame_available(details)
+
+      if self._last_transmitted_frame == transmitted:
+        break
 
   def get_counters(self):
     d = self._control_read(TC_GET_COUNTERS, 28)
@@ -1345,8 +1730,23 @@ class Driver(object):
     """
     pass
 
-def run(driver, system_poller = None):
-  instance = Controller(driver)
+def find_devices(context):
+  """Return a list of the connected controllers (libusb1 device objects), sorted by bus
+  number and device address, so that the order is the same each time."""
+  vendor_id = 0x1bad
+  product_id = 0xbeef
+
+  devices = []
+  for device in context.getDeviceList():
+    if device.getVendorID() == vendor_id and \
+      device.getProductID() == product_id:
+      devices.append(device)
+
+  devices.sort(key = lambda d: (d.getBusNumber(), d.getDeviceAddress()))
+  return devices
+
+def run(driver, system_poller = None, device = None, backend = None):
+  instance = Controller(driver, device, backend = backend)
 
   driver.internal_attach_host(instance)
 
@@ -65,6 +65,10 @@ class EventLoop(object):
      'runloop' will loop forever at the specified loop interval, until
      shutdown() is called. It may take some time, up to the specified
      loop interval or 1 second, whichever is longer, to exit.
+
+     Functions registered as non-critical are skipped while a controller
+     queue underflow is predicted (see Shedding()), to leave the CPU to
+     the frame thread.
   """
   def __init__(self, name='', looptime=1.0):
     """Create a new eventloop object.
@@ -73,21 +77,29 @@ class EventLoop(object):
     self.looptime = looptime
     self.Functions = {}
     self.Errors = {}
+    self.NonCritical = set()   # Names of functions skipped while shedding load
+    self.shed = 0              # Number of function calls skipped while shedding load
     self.exit = False
     self._Tlast = 0
     self.runtime = 0
 
-  def register(self, name, function):
-    """Register a new function to be called in the loop.
+  def register(self, name, function, critical=True):
+    """Register a new function to be called in the loop. If 'critical' is False, the function is skipped
+       while a controller queue underflow is predicted.
     """
     self.Functions[name] = function
     self.Errors[name] = {}
+    if critical:
+      self.NonCritical.discard(name)
+    else:
+      self.NonCritical.add(name)
 
   def remove(self, name):
     """Remove a function from the call list.
     """
     if name in self.Functions:
       del self.Functions[name]
+    self.NonCritical.discard(name)
 
   def shutdown(self):
     """Flag an exit at the next available opportunity (at most around 1 second delay).
@@ -97,7 +109,11 @@ class EventLoop(object):
   def runall(self):
     """Run all functions once, catching any errors.
     """
+    shedding = bool(self.NonCritical) and Shedding()
     for name, function in self.Functions.iteritems():
+      if shedding and (name in self.NonCritical):
+        self.shed += 1
+        continue
       try:
         function()
       except:
@@ -138,15 +154,41 @@ class CurrentPosition(correct.CalcPosition):
   """A special position object that's used only to store the current telescope coordinates, and defines methods
      that allow you to reset this position, jump from this position to a new one, etc.
 
-     Only one instance of this class can ever exist.
+     There is one instance of this class for each mount - detevent.current for the main mount, and the 'current'
+     attribute of each extra motion.Mount object.
   """
+  mount = None       # The motion.Mount object for this position, or None for the main mount
+  calerror = False   # True if the position of an extra mount hasn't been set yet (errors.CalError is for the main mount)
+
+  @property
+  def main(self):
+    """True if this is the position of the main mount.
+    """
+    return (self.mount is None) or (self.mount is motion.mount)
+
+  @property
+  def motors(self):
+    """The motion.MotorControl object for this mount.
+    """
+    if self.mount is None:
+      return motion.motors
+    return self.mount.motors
+
+  @property
+  def limits(self):
+    """The usbcon.LimitStatus object for this mount.
+    """
+    if self.mount is None:
+      return motion.limits
+    return self.mount.limits
+
   def __repr__(self):
     if self.posviolate:
       l1 = "Top RA:  %s    LST: %s         ObjID:   --" % (sexstring(self.RaC / 15.0 / 3600, dp=1), sexstring(self.Time.LST, dp=0))
       l2 = "Top Dec: %s     UT:  %s" % (sexstring(self.DecC / 3600, dp=0), self.Time.UT.time().isoformat()[:-4])
       l3 = "Alt:     %s      HA:  %s        ObjRA:   --" % (sexstring(self.Alt, dp=0), sexstring(self.RaC / 15 / 3600 - self.Time.LST, dp=0))
       l4 = "Airmass: %6.4f                              ObjDec:  --" % (1 / math.cos((90 - self.Alt) / 180 * math.pi))
-      l5 = "Moving:  %s           Frozen: %s           ObjEpoch: --" % ({False:" No", True:"Yes"}[motion.motors.Moving], {False:" No", True:"Yes"}[motion.motors.Frozen])
+      l5 = "Moving:  %s           Frozen: %s           ObjEpoch: --" % ({False:" No", True:"Yes"}[self.motors.Moving], {False:" No", True:"Yes"}[self.motors.Frozen])
     else:
       l1 = "Top RA:  %s    LST: %s         ObjID:   %s" % (sexstring(self.RaC / 15.0 / 3600, dp=1), sexstring(self.Time.LST, dp=0), self.ObjID)
       l2 = "Top Dec: %s     UT:  %s" % (sexstring(self.DecC / 3600, dp=0), self.Time.UT.time().isoformat()[:-4])
@@ -154,11 +196,14 @@ class CurrentPosition(correct.CalcPosition):
                                                             sexstring(self.Ra / 15 / 3600, dp=1))
       l4 = "Airmass: %6.4f                              ObjDec:  %s" % (1 / math.cos((90 - self.Alt) / 180 * math.pi),
                                                                         sexstring(self.Dec / 3600, dp=0))
-      l5 = "Moving:  %s           Frozen: %s           ObjEpoch:%6.1f" % ({False:" No", True:"Yes"}[motion.motors.Moving], {False:" No", True:"Yes"}[motion.motors.Frozen],
+      l5 = "Moving:  %s           Frozen: %s           ObjEpoch:%6.1f" % ({False:" No", True:"Yes"}[self.motors.Moving], {False:" No", True:"Yes"}[self.motors.Frozen],
                                                                           self.Epoch)
-    l6 = "Dome:  %s        Dome Tracking: %s           %s" % ({False:"Inactive", True:"  Active"}[dome.dome.DomeInUse],
-                                                              {False:" No", True:"Yes"}[dome.dome.DomeTracking],
-                                                              str(errors))
+    if self.main:
+      l6 = "Dome:  %s        Dome Tracking: %s           %s" % ({False:"Inactive", True:"  Active"}[dome.dome.DomeInUse],
+                                                                {False:" No", True:"Yes"}[dome.dome.DomeTracking],
+                                                                str(errors))
+    else:
+      l6 = "Mount: %s%s" % (self.mount.name, {False:"", True:"     Position not set"}[self.calerror])
     return '\n'.join([l1, l2, l3, l4, l5, l6]) + '\n'
 
   def UpdatePosition(self):
@@ -167,28 +212,24 @@ class CurrentPosition(correct.CalcPosition):
        This function is called at regular intervals by the 'fastloop'.
     """
     # invalidate orig RA and Dec if frozen, or paddle move, or non-sidereal move}
-    if motion.motors.Frozen or motion.limits.HWLimit or (motion.motors.RA.padlog != 0) or (motion.motors.DEC.padlog != 0):
+    if self.motors.Frozen or self.limits.HWLimit or (self.motors.RA.padlog != 0) or (self.motors.DEC.padlog != 0):
       self.posviolate = True
 
-    with motion.motors.RA.lock:
-      # account for paddle and non-sid. motion, and limit encounters}
-      self.RaA += motion.motors.RA.padlog / 20
-      # above, plus real-time refraction+flexure+guide in the fully corrected coords}
-      self.RaC += motion.motors.RA.padlog / 20 + motion.motors.RA.reflog / 20 + motion.motors.RA.guidelog / 20
-      paddles.RA_GuideAcc += motion.motors.RA.guidelog / 20
-      motion.motors.RA.padlog = 0
-      motion.motors.RA.reflog = 0
-      motion.motors.RA.guidelog = 0
-
-    with motion.motors.DEC.lock:
-      # account for paddle and non-sid. motion, and limit encounters}
-      self.DecA += motion.motors.DEC.padlog / 20
-      # above, plus real-time refraction+flexure+guide in the fully corrected coords}
-      self.DecC += motion.motors.DEC.padlog / 20 + motion.motors.DEC.reflog / 20 + motion.motors.DEC.guidelog / 20
-      paddles.DEC_GuideAcc += motion.motors.DEC.guidelog / 20
-      motion.motors.DEC.padlog = 0
-      motion.motors.DEC.reflog = 0
-      motion.motors.DEC.guidelog = 0
+    padlog, reflog, guidelog = self.motors.RA.ReadLogs()    # Integer sub-steps
+    # account for paddle and non-sid. motion, and limit encounters}
+    self.RaA += padlog / motion.SUBSTEPS_PER_ARCSEC
+    # above, plus real-time refraction+flexure+guide in the fully corrected coords}
+    self.RaC += (padlog + reflog + guidelog) / motion.SUBSTEPS_PER_ARCSEC
+    if self.main:
+      paddles.RA_GuideAcc += guidelog / motion.SUBSTEPS_PER_ARCSEC
+
+    padlog, reflog, guidelog = self.motors.DEC.ReadLogs()    # Integer sub-steps
+    # account for paddle and non-sid. motion, and limit encounters}
+    self.DecA += padlog / motion.SUBSTEPS_PER_ARCSEC
+    # above, plus real-time refraction+flexure+guide in the fully corrected coords}
+    self.DecC += (padlog + reflog + guidelog) / motion.SUBSTEPS_PER_ARCSEC
+    if self.main:
+      paddles.DEC_GuideAcc += guidelog / motion.SUBSTEPS_PER_ARCSEC
 
     if self.RaA > (24 * 60 * 60 * 15):
       self.RaA -= (24 * 60 * 60 * 15)
@@ -202,10 +243,11 @@ class CurrentPosition(correct.CalcPosition):
 
     self.Time.update()
     self.AltAziConv()           # Calculate Alt/Az now
-    if self.Alt < prefs.AltWarning:
-      errors.AltError = True
-    else:
-      errors.AltError = False
+    if self.main:
+      if self.Alt < prefs.AltWarning:
+        errors.AltError = True
+      else:
+        errors.AltError = False
 
   def RelRef(self):
     """Calculates real time refraction and flexure correction velocities for the current position.
@@ -223,10 +265,8 @@ class CurrentPosition(correct.CalcPosition):
 
     if (not prefs.RealTimeOn) or (not prefs.RefractionOn and not prefs.FlexureOn):
       # **Stop the refraction correction**
-      with motion.motors.RA.lock:
-        motion.motors.RA.refraction = 0.0
-      with motion.motors.DEC.lock:
-        motion.motors.DEC.refraction = 0.0
+      self.motors.RA.SetRefraction(0.0)
+      self.motors.DEC.SetRefraction(0.0)
       errors.RefError = False
       return
 
@@ -283,12 +323,10 @@ class CurrentPosition(correct.CalcPosition):
       errors.RefError = True
 
     #Set the actual refraction/flexure correction velocities in steps/50ms
-    with motion.motors.RA.lock:
-      motion.motors.RA.refraction = RA_ref
-    with motion.motors.DEC.lock:
-      motion.motors.DEC.refraction = DEC_ref
+    self.motors.RA.SetRefraction(RA_ref)
+    self.motors.DEC.SetRefraction(DEC_ref)
 
-  def Jump(self, FObj, Rate=None, force=False):
+  def Jump(self, FObj, Rate=None, force=False, retarget=False):
     """Jump the telescope to new position.
 
        Inputs:
@@ -301,6 +339,9 @@ class CurrentPosition(correct.CalcPosition):
        Every action that results in a telescope slew (Pyro4 remote calls, the user on the command line,
        tjbox table processing, etc) ends up in a call to this method. The only exceptions are hand-paddle
        motion (in handpaddle.py) and small offsets (the 'Offset' method below).
+
+       If 'retarget' is True and the telescope is already slewing, the slew in progress is sent to the new
+       destination from its current velocity, instead of the new jump waiting for it to finish.
     """
     global LastObj
     if Rate is None:
@@ -313,7 +354,7 @@ class CurrentPosition(correct.CalcPosition):
     else:
       AltCutoffTo = prefs.AltCutoffLo
 
-    if errors.CalError:
+    if errors.CalError or self.calerror:
       logger.error('Teljoy uncalibrated! - do a Reset() to set the position before slewing')
       return True
     elif (self.Alt < prefs.AltCutoffFrom) or (FObj.Alt < AltCutoffTo):
@@ -322,34 +363,25 @@ class CurrentPosition(correct.CalcPosition):
     elif (not safety.Active.is_set()) and (not force):
       logger.error('detevent.Jump: safety interlock - no jumping allowed.')
       return True
-    elif motion.limits.HWLimit:
+    elif self.limits.HWLimit:
       logger.error('Hardware limit active - no jumping allowed.')
       return True
     else:
       if force:
         logger.info('detevent.Jump: safety interlock forced - jumping anyway')
-      DelRA = FObj.RaC - self.RaC
+      DelRA, DelDEC = JumpSteps(self, FObj)
 
-      if abs(DelRA) > (3600 * 15 * 12):
-        if DelRA < 0:
-          DelRA += (3600 * 15 * 24)
+      with self.motors.lock:
+        # Calculate the profile and start the actual slew, or queue it if the telescope is already moving
+        if retarget:
+          jumperror = self.motors.Retarget(DelRA, DelDEC, Rate, force=force)
         else:
-          DelRA -= (3600 * 15 * 24)
-      DelDEC = FObj.DecC - self.DecC
-
-      DelRA = DelRA * 20        # Convert to number of motor steps}
-      DelDEC = DelDEC * 20
-
-      with motion.motors.lock:
-        if motion.motors.Moving or motion.motors.Paddling:
-          logger.error('detevent.Jump called while telescope in motion!')
-          return True
-
-        jumperror = motion.motors.Jump(DelRA, DelDEC, Rate, force=force)  # Calculate the profile and start the actual slew
+          jumperror = self.motors.Jump(DelRA, DelDEC, Rate, force=force)
         if jumperror:
           return True
         else:
-          LastObj = copy.deepcopy(self)                    # Save the current position
+          if self.main:
+            LastObj = copy.deepcopy(self)                  # Save the current position
           self.RaC, self.DecC = FObj.RaC, FObj.DecC     # Copy the coordinates to the current position record
           self.RaA, self.DecA = FObj.RaA, FObj.DecA
           self.Ra, self.Dec = FObj.Ra, FObj.Dec
@@ -357,12 +389,17 @@ class CurrentPosition(correct.CalcPosition):
           self.TraRA = FObj.TraRA                          # Copy the non-sidereal trackrate to the current position record
           self.TraDEC = FObj.TraDEC                        # Non-sidereal tracking will only start when the profiled jump finishes
           self.ObjID = FObj.ObjID
-          with motion.motors.RA.lock:
-            motion.motors.RA.track = self.TraRA              # Set the actual hardware trackrate in the motion controller
-          with motion.motors.DEC.lock:
-            motion.motors.DEC.track = self.TraDEC
+          self.motors.RA.SetTrack(self.TraRA)              # Set the actual hardware trackrate in the motion controller
+          self.motors.DEC.SetTrack(self.TraDEC)
           self.posviolate = False    # signal a valid original RA and Dec
 
+  def Retarget(self, FObj, Rate=None, force=False):
+    """Change the destination of the slew in progress to the position in FObj (a correct.CalcPosition
+       object), without waiting for the current slew to finish. If the telescope isn't moving, this is
+       the same as Jump(). Returns 'True' if there was an error, 'False' if the new target was accepted.
+    """
+    return self.Jump(FObj, Rate=Rate, force=force, retarget=True)
+
   def IniPos(self):
     """This function is called on startup to set the 'Current' position
        and other data to something reasonable on startup.
@@ -383,7 +420,7 @@ class CurrentPosition(correct.CalcPosition):
       dome.dome.IsShutterOpen = info.ShutterOpen
       prefs.EastOfPier = info.EastOfPier
 
-    motion.motors.Frozen = False    # Always start out not frozen
+    self.motors.Frozen = False    # Always start out not frozen
 
     self.Time.update()
     rac = (self.Time.LST + HA) * 15 * 3600
@@ -412,7 +449,10 @@ class CurrentPosition(correct.CalcPosition):
     obj.update()
     self.Ra, self.Dec, self.Epoch, self.ObjID = obj.Ra, obj.Dec, obj.Epoch, obj.ObjID
     self.update()
-    errors.CalError = False
+    if self.main:
+      errors.CalError = False
+    self.calerror = False
+    self.motors.ClearStepError()
 
   def Offset(self, ora, odec):
     """Make a tiny slew from the current position, by ora,odec arcseconds.
@@ -427,22 +467,104 @@ class CurrentPosition(correct.CalcPosition):
     if (abs(DelRA) > MAXOFFSETSTEPS) or (abs(DelDEC) > MAXOFFSETSTEPS):
       logger.error('Offset() called with values resulting in too large a shift.')
       return True
-    if motion.limits.HWLimit:
+    if self.limits.HWLimit:
       logger.error('detevent.Offset called when hardware limit is active!')
       return True
-    with motion.motors.lock:
-      if motion.motors.Moving or motion.motors.Paddling:
-        logger.error('detevent.Offset called while telescope in motion!')
-        return True
-      error = motion.motors.Jump(DelRA, DelDEC, prefs.SlewRate)  # Calculate the motor profile and jump
+    with self.motors.lock:
+      # Calculate the motor profile and jump, or queue it (merged with any other queued offsets) if already moving
+      error = self.motors.Jump(DelRA, DelDEC, prefs.SlewRate, offset=True)
       if not error:
-        if not self.posviolate:
-          self.Ra += ora / math.cos(self.DecC / 3600 * math.pi / 180)
-          self.Dec += odec
-        self.RaA += ora / math.cos(self.DecC / 3600 * math.pi / 180)
-        self.DecA += odec
-        self.RaC += ora / math.cos(self.DecC / 3600 * math.pi / 180)
-        self.DecC += odec
+        self.ApplyOffset(DelRA / 20.0, DelDEC / 20.0)
+    return error
+
+  def ApplyOffset(self, dra, ddec):
+    """Add an offset that has been sent to the motors to the current position. dra and ddec are in arcseconds
+       of RA and DEC (not arcseconds on the sky), so dra has already been divided by cos(DEC).
+    """
+    if not self.posviolate:
+      self.Ra += dra
+      self.Dec += ddec
+    self.RaA += dra
+    self.DecA += ddec
+    self.RaC += dra
+    self.DecC += ddec
+
+
+def Shedding():
+  """Return True if non-critical background work should be skipped, because prefs.UnderflowShed is set and the
+     controller queue for any mount is predicted to underflow soon.
+  """
+  if not prefs.UnderflowShed:
+    return False
+  for m in motion.mounts.values():
+    driver = m.motors.Driver
+    if (driver is not None) and driver.UnderflowRisk():
+      return True
+  return False
+
+
+def JumpSteps(From, To):
+  """Return the offsets (DelRA, DelDEC) in motor steps for a jump from the 'From' position to the 'To'
+     position (both correct.CalcPosition objects), taking the short way round in RA.
+  """
+  DelRA = To.RaC - From.RaC
+
+  if abs(DelRA) > (3600 * 15 * 12):
+    if DelRA < 0:
+      DelRA += (3600 * 15 * 24)
+    else:
+      DelRA -= (3600 * 15 * 24)
+  DelDEC = To.DecC - From.DecC
+
+  return DelRA * 20, DelDEC * 20        # Convert to number of motor steps
+
+
+def DomeTime(fromazi, toazi):
+  """Return the time in seconds for the dome to rotate from azimuth 'fromazi' to 'toazi' (in degrees), the
+     short way round, at prefs.DomeSpeed degrees/second.
+  """
+  dazi = abs(toazi - fromazi) % 360
+  return min(dazi, 360 - dazi) / prefs.DomeSpeed
+
+
+def SlewTime(FObj, From=None, Rate=None, update=True):
+  """Estimate how long it would take to jump to the position 'FObj' (a correct.CalcPosition object), from the
+     position 'From' (the current position, if None), with a peak velocity of 'Rate' steps/second. Nothing
+     is moved and no telescope state is changed - the slew times come from the same profile planning code
+     used for a real jump. If 'update' is True, the coordinates of FObj (and From, if given) are updated for
+     the current time first.
+
+     Returns a dictionary with the slew time for each axis ('ra' and 'dec'), the slew time for the jump
+     ('slew', the longer of the two), the dome move time ('dome', zero if the dome isn't in automatic mode),
+     the expected settle time after the slew ('settle'), and the total ('total', the longer of the slew and dome
+     times, plus the settle time), all in seconds.
+  """
+  if Rate is None:
+    Rate = prefs.SlewRate
+  if update:
+    FObj.update()
+    if From is not None:
+      From.update()
+  if From is None:
+    From = current
+  DelRA, DelDEC = JumpSteps(From, FObj)
+  ra = motion.SlewFrames(DelRA, Rate) * PULSE
+  dec = motion.SlewFrames(DelDEC, Rate) * PULSE
+  slew = max(ra, dec)
+
+  domet = 0.0
+  if dome.dome.AutoDome:
+    if (From is current) and (dome.dome.DomeAzi >= 0):
+      fromazi = dome.dome.DomeAzi
+    else:
+      fromazi = dome.dome.CalcAzi(From)
+    domet = DomeTime(fromazi, dome.dome.CalcAzi(FObj))
+
+  if slew > 0:
+    settle = prefs.SettleTime
+  else:
+    settle = 0.0
+  return {'ra':ra, 'dec':dec, 'slew':slew, 'dome':domet, 'settle':settle, 'total':max(slew, domet) + settle}
 
 
 def CheckDirtyPos():
@@ -473,32 +595,37 @@ def CheckDirtyPos():
     paddles.DEC_GuideAcc = 0.0
 
 
-def CheckLimitClear():
+def CheckLimitClear(m=None):
   """Periodically check to see if a hardware limit state has been cleared. If it has,
      and it's now safe to resume motion (we aren't moving, etc), then clear the
-     global limit flag.
+     global limit flag. If 'm' is given, check the limits for that motion.Mount object
+     instead of the main mount.
 
      This function is called at regular intervals by the 'fastloop'.
   """
-  if motion.limits.HWLimit and ( (not motion.motors.Moving) and
-                                 (not motion.limits.PowerOff) and
-                                 (not motion.limits.HorizLim) and
-                                 (not motion.limits.MeshLim) and
-                                 (not motion.limits.EastLim) and
-                                 (not motion.limits.WestLim) ):
+  if m is None:
+    limits, motors = motion.limits, motion.motors
+  else:
+    limits, motors = m.limits, m.motors
+  if limits.HWLimit and ( (not motors.Moving) and
+                          (not limits.PowerOff) and
+                          (not limits.HorizLim) and
+                          (not limits.MeshLim) and
+                          (not limits.EastLim) and
+                          (not limits.WestLim) ):
     logger.info('Hardware limit cleared or power restored.')
-    motion.limits.HWLimit = False
-    motion.limits.LimOverride = False
-    motion.limits.WantsOverride = False
-
-  if (motion.limits.WantsOverride or motion.limits.LimOverride):
-    if not motion.limits.HWLimit:    # Clear any override flag if there's no limit active now
-      motion.limits.WantsOverride = False
-      motion.limits.LimOverride = False
-
-  if motion.limits.WantsOverride and (not motion.motors.Moving):
-    motion.limits.LimOverride = True
-    motion.limits.WantsOverride = False
+    limits.HWLimit = False
+    limits.LimOverride = False
+    limits.WantsOverride = False
+
+  if (limits.WantsOverride or limits.LimOverride):
+    if not limits.HWLimit:    # Clear any override flag if there's no limit active now
+      limits.WantsOverride = False
+      limits.LimOverride = False
+
+  if limits.WantsOverride and (not motors.Moving):
+    limits.LimOverride = True
+    limits.WantsOverride = False
     logger.error("Hardware cable wrap limit overriden in software.")
     logger.error("Use paddles to move slowly away from the limit.")
 
@@ -564,7 +691,10 @@ def DoTJbox():
   if BObj is None or other is None:
     return
   ProspLastTime = time.time()
-  if (other.LastMod < 0) or (other.LastMod > 5) or motion.motors.Moving:
+  # Jumps and offsets can be queued while the telescope is moving, other actions have to wait
+  if ((other.LastMod < 0) or (other.LastMod > 5) or
+      (motion.motors.Moving and ((other.action not in ['jumpid', 'jumprd', 'offset']) or
+                                 (len(motion.motors.queue) >= prefs.MotionQueueLength)))):
     other.action = 'none'
     sqlint.ClearTJbox(db=db)
     TJboxAction = 'none'
@@ -774,7 +904,7 @@ def Init():
 
   fastloop = EventLoop(name='FastLoop', looptime=FASTLOOP)
   fastloop.register('UpdateCurrent', current.UpdatePosition)         # add all motion to 'current' object coordinates
-  fastloop.register('CheckDBUpdate', CheckDBUpdate)              # Update database at intervals with saved state information
+  fastloop.register('CheckDBUpdate', CheckDBUpdate, critical=False)   # Update database at intervals with saved state information
   fastloop.register('CheckDirtyPos', CheckDirtyPos)         # Check to see if the PosDirty flag needs to be cleared
   fastloop.register('CheckDirtyDome', CheckDirtyDome)       # Check to see if dome needs moving if DomeTracking is on
   fastloop.register('dome.dome.check', dome.dome.check)  # Check to see if dome has reached destination azimuth
@@ -785,11 +915,11 @@ def Init():
 
   slowloop = EventLoop(name='SlowLoop', looptime=SLOWLOOP)
   if SITE == 'PERTH':
-    slowloop.register('Weather', weather._background)
+    slowloop.register('Weather', weather._background, critical=False)
   slowloop.register('RelRef', current.RelRef)              # calculate refraction+flexure velocities, check alt, set 'AltError' if low
-  slowloop.register("CheckErrors", CheckErrors)
+  slowloop.register("CheckErrors", CheckErrors, critical=False)
   slowloop.register('CheckTimeout', CheckTimeout)           # Check to see if Prosp (CCD camera controller) is still alive and monitoring weather
-  slowloop.register('LogGuider', LogGuider)             # If Autoguiding is true, log the guider step counters to a file.
+  slowloop.register('LogGuider', LogGuider, critical=False)   # If Autoguiding is true, log the guider step counters to a file.
 
   logger.debug('Detevent unit init finished')
   fastthread = threading.Thread(target=fastloop.runloop, name='detevent-fastloop-thread')
@@ -801,6 +931,43 @@ def Init():
   slowthread.start()
   logger.debug('detevent.init: Detevent slow loop thread started.')
 
+  motion.mount.current = current
+  motion.mount.dome = dome.dome
+  motion.mount.fastloop, motion.mount.slowloop = fastloop, slowloop
+  for m in motion.mounts.values():
+    if m is not motion.mount:
+      InitMount(m)
+
+
+def InitMount(m):
+  """Create the current position for an extra mount (a motion.Mount object), and start its own fast and
+     slow event loops, to keep the position up to date, clear its hardware limit flag, and calculate its
+     refraction and flexure correction. There's no saved position for an extra mount, so it starts off
+     pointing straight up, and must be reset before it can be jumped.
+
+     The dome, hand paddles, SQL state and TJbox command table all belong to the main mount.
+  """
+  m.current = CurrentPosition()
+  m.current.mount = m
+  m.current.calerror = True
+  m.current.Time.update()
+  m.current.RaC = m.current.Ra = m.current.RaA = m.current.Time.LST * 15 * 3600
+  m.current.DecC = m.current.Dec = m.current.DecA = prefs.ObsLat * 3600
+  m.current.Epoch = 0.0
+  m.current.AltAziConv()
+  logger.error('Mount %s has no initial position, you MUST reset the position before slewing!' % m.name)
+
+  m.fastloop = EventLoop(name='FastLoop-%s' % m.name, looptime=FASTLOOP)
+  m.fastloop.register('UpdateCurrent', m.current.UpdatePosition)
+  m.fastloop.register('CheckLimitClear', lambda: CheckLimitClear(m))
+  m.slowloop = EventLoop(name='SlowLoop-%s' % m.name, looptime=SLOWLOOP)
+  m.slowloop.register('RelRef', m.current.RelRef)
+  for loop in [m.fastloop, m.slowloop]:
+    t = threading.Thread(target=loop.runloop, name='detevent-%s-thread' % loop.name.lower())
+    t.daemon = True
+    t.start()
+  logger.debug('detevent.InitMount: event loops for mount %s started.' % m.name)
+
 
 current = None
 LastObj = None
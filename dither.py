@@ -0,0 +1,194 @@
+
+"""Dither pattern engine. A pattern of small offsets (a spiral, random points within a radius, or
+   a grid) is uploaded once, using 'Upload()' (or the 'dither' Pyro4 call). Each call to 'Next()' then moves
+   the telescope to the next position in the pattern, wrapping back to the first position after the last one.
+   Pattern positions are relative to the telescope position when the pattern was uploaded.
+
+   The offsets between consecutive positions are converted to motor steps (in the tangent plane, at the
+   current declination), and the motion profiles for each axis are planned, when the pattern is uploaded. Each
+   'Next()' call only has to hand those precomputed profiles to the motion control code, and the profiles are
+   the shortest possible at the normal slew rate and acceleration.
+
+   If the telescope has moved more than MAXDECCHANGE arcseconds in declination since the pattern was
+   prepared, the steps and profiles are recalculated for the new declination on the next call.
+"""
+
+import math
+import random
+
+from globals import *
+import detevent
+import motion
+
+MAXDECCHANGE = 60.0      # Recalculate the steps if the current DEC has changed by more than this, in arcseconds
+
+KINDS = ['spiral', 'random', 'grid']
+
+pattern = None     # The current Pattern object, set by Upload()
+
+
+class Pattern(object):
+  """A dither pattern - a list of positions, in arcseconds on the sky (east, north) relative to the
+     starting position, and the steps and motion profiles needed to move between them.
+  """
+  def __init__(self, kind='spiral', n=9, size=10.0, seed=None):
+    """Create a new pattern of 'n' positions.
+
+       For a 'spiral' or 'grid' pattern, 'size' is the spacing between positions, in arcseconds. For a 'random'
+       pattern, it's the radius (in arcseconds) of the circle that the random positions are chosen from. 'seed'
+       is the random number seed, for a repeatable random pattern.
+    """
+    if kind not in KINDS:
+      raise ValueError("Unknown dither pattern '%s', must be one of %s" % (kind, KINDS))
+    self.kind = kind
+    self.n = max(int(n), 1)
+    self.size = float(size)
+    self.seed = seed
+    self.positions = []    # (east, north) offsets from the starting position, in arcseconds on the sky
+    self.dec = None        # Declination (in arcseconds) that the steps and profiles were calculated for
+    self.steps = []        # (RA, DEC) offsets in steps, to each position from the one before it
+    self.plans = []        # (RA, DEC) motion profiles to each position from the one before it, from motion.PlanJump
+    self.times = []        # Time (in seconds) to move to each position from the one before it
+    self.startsteps = None   # (RA, DEC) offset in steps from the starting position to the first position
+    self.startplans = None   # (RA, DEC) motion profiles from the starting position to the first position
+    if kind == 'spiral':
+      self._spiral()
+    elif kind == 'random':
+      self._random()
+    else:
+      self._grid()
+    if self.positions[0] == (0.0, 0.0):
+      self.index = 0       # Index of the position the telescope is currently at
+    else:
+      self.index = None    # None if the telescope is at the starting position, and that isn't in the pattern
+
+  def __repr__(self):
+    return "<Pattern: %s, %d positions, size=%4.1f arcsec, at position %s>" % (self.kind, self.n, self.size, self.index)
+
+  def _spiral(self):
+    """Square spiral outwards from the starting position.
+    """
+    x, y = 0, 0
+    dx, dy = 1, 0
+    leg, done = 1, 0
+    self.positions.append((0.0, 0.0))
+    while len(self.positions) < self.n:
+      x += dx
+      y += dy
+      self.positions.append((x * self.size, y * self.size))
+      done += 1
+      if done == leg:
+        done = 0
+        dx, dy = -dy, dx     # Turn 90 degrees
+        if dy == 0:
+          leg += 1           # Legs get longer every second turn
+
+  def _random(self):
+    """Starting position, then random points uniformly distributed within a circle of radius self.size.
+    """
+    rand = random.Random(self.seed)
+    self.positions.append((0.0, 0.0))
+    while len(self.positions) < self.n:
+      x = rand.uniform(-self.size, self.size)
+      y = rand.uniform(-self.size, self.size)
+      if (x * x + y * y) <= (self.size * self.size):
+        self.positions.append((x, y))
+
+  def _grid(self):
+    """Square grid centred on the starting position, covered row by row in alternating directions
+       so that every move is a single grid spacing.
+    """
+    side = int(math.ceil(math.sqrt(self.n)))
+    offset = (side - 1) / 2.0
+    for row in range(side):
+      cols = range(side)
+      if row % 2:
+        cols.reverse()
+      for col in cols:
+        self.positions.append(((col - offset) * self.size, (row - offset) * self.size))
+    self.positions = self.positions[:self.n]
+
+  def prepare(self, dec, Rate=None):
+    """Calculate the steps and motion profiles to each position from the one before it (and to the first
+       position from the last one, and from the starting position) for a declination of 'dec' arcseconds, at a
+       peak velocity of 'Rate' steps/second.
+    """
+    if Rate is None:
+      Rate = prefs.SlewRate
+    cosdec = math.cos(dec / 3600 * math.pi / 180)
+    self.dec = dec
+    self.steps, self.plans, self.times = [], [], []
+    for i in range(-1, self.n):
+      if i < 0:
+        x0, y0 = 0.0, 0.0
+        x1, y1 = self.positions[0]
+      else:
+        x0, y0 = self.positions[i - 1]      # For i=0, this is the last position
+        x1, y1 = self.positions[i]
+      dra = 20 * (x1 - x0) / cosdec       # conv to motor steps
+      ddec = 20 * (y1 - y0)
+      plans = (motion.PlanJump(dra, Rate), motion.PlanJump(ddec, Rate))
+      if i < 0:
+        self.startsteps, self.startplans = (dra, ddec), plans
+      else:
+        frames = max([sum([n for n, v in plan[0]]) for plan in plans])
+        self.steps.append((dra, ddec))
+        self.plans.append(plans)
+        self.times.append((frames + 1) * PULSE)
+
+
+def Upload(kind='spiral', n=9, size=10.0, seed=None):
+  """Create a new dither pattern, starting at the current telescope position, and prepare it for the current
+     declination. Returns the new Pattern object.
+  """
+  global pattern
+  p = Pattern(kind=kind, n=n, size=size, seed=seed)
+  p.prepare(detevent.current.DecC)
+  pattern = p
+  logger.info("dither.Upload: new pattern %s, %4.2f sec per move on average" % (p, sum(p.times) / p.n))
+  return p
+
+
+def Next():
+  """Move the telescope to the next position in the current pattern. The move starts in the next frame
+     if the telescope is idle, or is queued if it's already moving. Returns the index of the new position,
+     or None if there was an error.
+  """
+  if pattern is None:
+    logger.error('dither.Next called with no dither pattern uploaded.')
+    return None
+  with motion.motors.lock:
+    if abs(detevent.current.DecC - pattern.dec) > MAXDECCHANGE:
+      pattern.prepare(detevent.current.DecC)
+    if pattern.index is None:
+      i = 0
+      (dra, ddec), plans = pattern.startsteps, pattern.startplans
+    else:
+      i = (pattern.index + 1) % pattern.n
+      (dra, ddec), plans = pattern.steps[i], pattern.plans[i]
+    error = motion.motors.Jump(dra, ddec, prefs.SlewRate, plans=plans)
+    if error:
+      return None
+    detevent.current.ApplyOffset(dra / 20.0, ddec / 20.0)
+    pattern.index = i
+    return i
+
+
+def Reset():
+  """Move the telescope back to the starting position of the current pattern. Returns the new position
+     index (0, or None if the starting position isn't in the pattern), or False if there was an error.
+  """
+  if pattern is None:
+    logger.error('dither.Reset called with no dither pattern uploaded.')
+    return False
+  with motion.motors.lock:
+    if pattern.index is not None:
+      x, y = pattern.positions[pattern.index]
+      error = detevent.current.Offset(-x, -y)
+      if error:
+        return False
+    if pattern.positions[0] == (0.0, 0.0):
+      pattern.index = 0
+    else:
+      pattern.index = None
+    return pattern.index
@@ -96,6 +96,8 @@ class CurrentStatus(StatusObj):
 class MotorsStatus(StatusObj):
   def __init__(self):
     self.Jumping = False
+    self.Scanning = False
+    self.scanline = 0
     self.Paddling = False
     self.Moving = False
     self.PosDirty = False
@@ -103,6 +105,12 @@ class MotorsStatus(StatusObj):
     self.Frozen = False
     self.Autoguiding = False
     self.guidelog = (0,0)
+    self.lost = (0,0)
+    self.steperror = (0,0)
+    self.queuedepth = 0
+    self.Stopping = False
+    self.stopdistance = (0,0)
+    self.stoptime = None
 
 
 class LimitStatus(object):
@@ -0,0 +1,650 @@
+
+"""In-process fake of the telescope controller card, and the parts of python-libusb1 that controller.py uses, so
+   the controller.Controller and usbcon.Driver code can be run, tested and profiled without the hardware.
+
+   A Backend object stands in for the usb1 module - pass it to controller.run (or usbcon.Driver, or set
+   FakeController=1 in the [Motion] section of teljoy.ini to use it for every mount). Each FakeContext created by a
+   Backend lists that backend's FakeController devices, and the FakeUSBPoller it creates wraps the normal system
+   poller, so the controller's own file descriptors (eg the call_in_loop wakeup pipe) still work, and shortens each
+   poll timeout so the fake devices' USB transfers complete and their frames are clocked out on time.
+
+   The FakeController emulates the TC_* protocol in controller.py - the version request, motor control, GPIO and
+   safety configuration, frame enqueues (checking frame numbers and the queue capacity), the frame clock (dequeuing a
+   frame every frame period, with the velocity and acceleration limit checks and queue underflow), counters, guider
+   steps, outputs, state commands (shutdown with a ramped stop, guider enable/disable, forced interrupts, resets),
+   exceptions with exception details, and the interrupt endpoint status packets sent whenever the state, inputs or
+   queue change.
+
+   Faults can be injected from any thread: transfer latency and stalls, failed transfers for a given command,
+   controller exceptions (with axis trace or FPGA error details), input changes (including limit and shutdown inputs)
+   and autoguider steps. The fake runs in real time (on controller.monotonic_time) by default - set 'speed' to run
+   the frame clock faster, or pass a 'clock' function that returns a simulated time, and call process() directly to
+   step the device through it (as framebench does).
+"""
+
+import collections
+import struct
+
+import libusb1
+
+import controller
+
+VENDOR_ID = 0x1bad
+PRODUCT_ID = 0xbeef
+
+CLOCK_FREQUENCY = 12000000    # Controller clock frequency, in Hz
+CAPACITY = 32                 # Number of frames the controller queue can hold
+LATENCY = 0.0005              # Default USB round trip time for each transfer, in seconds
+
+INTERRUPT_ENDPOINT = 0x81
+
+_VERSION = struct.Struct("<HHHHLHH")
+_MC_CONFIGURATION = struct.Struct("<HHHHHHHHLLBBBBBBBBLHHHHHH")
+_STATUS = struct.Struct("<BBHLQLL")
+_COUNTERS = struct.Struct("<Lllllll")
+_ENQUEUE = struct.Struct("<Lhh")
+_WORD = struct.Struct("<L")
+_OUTPUTS = struct.Struct("<Q")
+
+
+def AxisTraceDetails(axis_index, steps=0, guider_steps=0, previous_remainder=0, current_remainder=0,
+                     previous_negative=False, current_negative=False):
+  """Return an exception details buffer of kind TC_DETAIL_KIND_AXIS_TRACE, for FakeController.raise_exception.
+  """
+  return struct.pack("<LLiiiiBBBB", controller.TC_DETAIL_KIND_AXIS_TRACE, axis_index, steps, guider_steps,
+                     previous_remainder, current_remainder, int(previous_negative), int(current_negative), 0, 0)
+
+
+def FPGAErrorDetails(error_bits):
+  """Return an exception details buffer of kind TC_DETAIL_KIND_FPGA_ERRORS, for FakeController.raise_exception.
+  """
+  return struct.pack("<LL", controller.TC_DETAIL_KIND_FPGA_ERRORS, error_bits)
+
+
+class FakeTransfer(object):
+  """Stands in for a python-libusb1 USBTransfer, on a FakeController device.
+  """
+  def __init__(self, device):
+    self._device = device
+    self._callback = None
+    self._user_data = None
+    self._request = None      # Control request (a TC_* command), or None for an interrupt transfer
+    self._data = ""           # Data sent with a control write
+    self._length = 0          # Number of bytes requested by a read
+    self._inbound = False
+    self._buffer = ""
+    self._status = None
+    self._submitted = False
+    self.due = None           # Time the transfer completes, once submitted
+
+  def setControl(self, request_type, request, value, index, buffer_or_len, callback=None, user_data=None, timeout=0):
+    assert not self._submitted
+    self._request = request
+    self._inbound = bool(request_type & libusb1.LIBUSB_ENDPOINT_IN)
+    if self._inbound:
+      self._data, self._length = "", buffer_or_len
+    else:
+      self._data, self._length = buffer_or_len, len(buffer_or_len)
+    self._callback = callback
+    self._user_data = user_data
+
+  def setInterrupt(self, endpoint, buffer_or_len, callback=None, user_data=None, timeout=0):
+    assert not self._submitted
+    assert endpoint == INTERRUPT_ENDPOINT
+    self._request = None
+    self._inbound = True
+    self._data, self._length = "", buffer_or_len
+    self._callback = callback
+    self._user_data = user_data
+
+  def submit(self):
+    assert not self._submitted
+    self._submitted = True
+    self._device._submit(self)
+
+  def isSubmitted(self):
+    return self._submitted
+
+  def getStatus(self):
+    return self._status
+
+  def getActualLength(self):
+    if self._inbound:
+      return len(self._buffer)
+    return self._length
+
+  def getBuffer(self):
+    return self._buffer
+
+  def getUserData(self):
+    return self._user_data
+
+  def close(self):
+    pass
+
+  def _complete(self, status, buffer=""):
+    self._status = status
+    self._buffer = buffer
+    self._submitted = False
+    if self._callback is not None:
+      self._callback(self)
+
+
+class _Configuration(list):
+  def getConfigurationValue(self):
+    return 1
+
+
+class FakeDeviceHandle(object):
+  """Stands in for a python-libusb1 USBDeviceHandle.
+  """
+  def __init__(self, device):
+    self._device = device
+
+  def getDevice(self):
+    return self._device
+
+  def setConfiguration(self, value):
+    pass
+
+  def claimInterface(self, interface):
+    pass
+
+  def getTransfer(self):
+    return FakeTransfer(self._device)
+
+  def close(self):
+    self._device._close()
+
+
+class FakeController(object):
+  """An emulated controller card. Also stands in for the python-libusb1 USBDevice object used to open it.
+
+     The methods that inject faults (set_latency, stall, fail, raise_exception, set_inputs and guide) are safe to
+     call from any thread - they take effect in the event loop thread, the next time the device is polled.
+  """
+  def __init__(self, serial='FAKE0001', bus=1, address=1, latency=LATENCY, speed=1.0, capacity=CAPACITY,
+               clock_frequency=CLOCK_FREQUENCY, version=controller.module_version[:2], clock=controller.monotonic_time):
+    self.serial = serial
+    self.bus = bus
+    self.address = address
+    self.latency = latency                  # USB round trip time for each transfer, in seconds
+    self.speed = speed                      # Run the frame clock this many times faster than real time
+    self.capacity = capacity
+    self.clock_frequency = clock_frequency
+    self.version = version                  # (major, minor) firmware version
+    self.clock = clock                      # Function returning the current time, in seconds
+    self._injections = collections.deque()  # Fault injections from other threads, run in the event loop thread
+    self._faults = {}                       # Statuses for the next transfers, as lists by command ('interrupt' for the interrupt endpoint)
+    self._transfers = collections.deque()   # Submitted control transfers, in order
+    self._interrupts = collections.deque()  # Submitted interrupt transfers, waiting for a status change
+    self._stall_until = 0.0                 # No transfers complete before this time
+    self._open = False
+    self.outputs = 0L
+    self.inputs = 0L
+    self.hardware_reset()
+
+  def __repr__(self):
+    return "<FakeController %s (%d:%d): state=%s, exception=%s, queue=%d, frame=%d>" % (
+        self.serial, self.bus, self.address, self.state, self.exception, len(self.queue), self.last_dequeued_frame)
+
+  def __getitem__(self, index):
+    """The USB configuration, interface and alternate setting, as used by controller.Controller.__init__.
+    """
+    return [_Configuration([[None]])][index]
+
+  # python-libusb1 USBDevice methods:
+
+  def getVendorID(self):
+    return VENDOR_ID
+
+  def getProductID(self):
+    return PRODUCT_ID
+
+  def getBusNumber(self):
+    return self.bus
+
+  def getDeviceAddress(self):
+    return self.address
+
+  def getSerialNumber(self):
+    return self.serial
+
+  def open(self):
+    self._open = True
+    self._changed = False          # Status changes before the device was opened aren't sent
+    return FakeDeviceHandle(self)
+
+  def _close(self):
+    self._open = False
+    self._transfers.clear()
+    self._interrupts.clear()
+
+  # Fault injection:
+
+  def set_latency(self, latency):
+    """Set the USB round trip time for each transfer, in seconds.
+    """
+    self._injections.append(lambda now: setattr(self, 'latency', latency))
+
+  def stall(self, seconds):
+    """Stop completing USB transfers for the given time - the frame clock keeps running.
+    """
+    self._injections.append(lambda now: setattr(self, '_stall_until', now + seconds))
+
+  def fail(self, command, status=libusb1.LIBUSB_TRANSFER_ERROR, count=1):
+    """Fail the next 'count' transfers for the given command (a TC_* request code, or 'interrupt' for the
+       interrupt endpoint) with the given libusb transfer status.
+    """
+    self._injections.append(lambda now: self._faults.setdefault(command, []).extend([status] * count))
+
+  def raise_exception(self, exception, details=""):
+    """Raise a controller exception (a TC_EXCEPTION_* code), with an optional exception details buffer (see
+       AxisTraceDetails and FPGAErrorDetails).
+    """
+    self._injections.append(lambda now: self._raise(exception, details))
+
+  def set_inputs(self, inputs):
+    """Set the state of all the GPIO inputs, as a 64 bit mask. Triggers a limit or shutdown exception if a
+       configured limit or shutdown input becomes active while the motors are running.
+    """
+    self._injections.append(lambda now: self._set_inputs(inputs))
+
+  def guide(self, a_steps, b_steps):
+    """Add autoguider steps to the next frame, if the guider is enabled.
+    """
+    def inject(now):
+      self.guide_a += a_steps
+      self.guide_b += b_steps
+    self._injections.append(inject)
+
+  # Controller state:
+
+  def hardware_reset(self):
+    """Return the controller to its power-on state.
+    """
+    self.state = controller.TC_STATE_IDLE
+    self.exceptions = []           # Pending (exception, details) pairs, the first is the current exception
+    self.queue = collections.deque()
+    self._reset_frames()
+    self.guider_enabled = False
+    self.guide_a = 0               # Autoguider steps waiting to be added to the next frame
+    self.guide_b = 0
+    self.velocity = (0, 0)         # Steps in the last frame, in each axis
+    self.next_frame = None         # Time the next frame is due to be dequeued, or None if not running
+    self.prefill = 8
+    self.frame_period = self.clock_frequency / 20
+    self.velocity_limit = (7600, 7600)
+    self.acceleration_limit = (500, 500)
+    self.shutdown_acceleration = (1, 1)
+    self.limit_inputs = [None] * 4     # A+, A-, B+, B- limit inputs
+    self.shutdown_inputs = [None] * 4
+    self.guider_result = (0, 0)
+    self._changed = False          # True if there's a status change to send on the interrupt endpoint
+
+  def _reset_frames(self):
+    """Start a new run - frame numbers and the step counters start again from zero.
+    """
+    self.last_enqueued_frame = 0xffffffffL
+    self.last_dequeued_frame = 0xffffffffL
+    self.a_total_steps = 0
+    self.b_total_steps = 0
+    self.a_guider_steps = 0
+    self.b_guider_steps = 0
+
+  @property
+  def exception(self):
+    if self.exceptions:
+      return self.exceptions[0][0]
+    return controller.TC_EXCEPTION_NONE
+
+  def _period(self):
+    return float(self.frame_period) / self.clock_frequency / self.speed
+
+  def _raise(self, exception, details=""):
+    if exception == controller.TC_EXCEPTION_SHUTDOWN_REQUESTED and self.state == controller.TC_STATE_RUNNING:
+      self.state = controller.TC_STATE_STOPPING    # Ramp down to a stop first
+    else:
+      self.state = controller.TC_STATE_EXCEPTION
+      self.queue.clear()
+      self.next_frame = None
+      self.velocity = (0, 0)
+    self.exceptions.append((exception, details))
+    self._changed = True
+
+  def _set_inputs(self, inputs):
+    self.inputs = inputs
+    self._changed = True
+    if self.state != controller.TC_STATE_RUNNING:
+      return
+    for i, pin in enumerate(self.shutdown_inputs):
+      if (pin is not None) and (inputs & (1L << pin)):
+        self._raise(controller.TC_EXCEPTION_SHUTDOWN_INPUT_TRIGGERED)
+        return
+    codes = [controller.TC_EXCEPTION_MCA_POSITIVE_LIMITED, controller.TC_EXCEPTION_MCA_NEGATIVE_LIMITED,
+             controller.TC_EXCEPTION_MCB_POSITIVE_LIMITED, controller.TC_EXCEPTION_MCB_NEGATIVE_LIMITED]
+    for pin, code in zip(self.limit_inputs, codes):
+      if (pin is not None) and (inputs & (1L << pin)):
+        self._raise(code)
+        return
+
+  def _tick(self):
+    """Dequeue one frame (or one step of a ramped shutdown).
+    """
+    va, vb = self.velocity
+    if self.state == controller.TC_STATE_STOPPING:
+      accel_a, accel_b = self.shutdown_acceleration
+      va = max(abs(va) - accel_a, 0) * cmp(va, 0)
+      vb = max(abs(vb) - accel_b, 0) * cmp(vb, 0)
+      self._move(va, vb)
+      if va == vb == 0:
+        self.state = controller.TC_STATE_EXCEPTION
+        self.queue.clear()
+        self.next_frame = None
+      self._changed = True
+      return
+
+    if not self.queue:
+      self._raise(controller.TC_EXCEPTION_QUEUE_UNDERFLOW)
+      return
+    frame_number, a, b = self.queue.popleft()
+    if self.guider_enabled:
+      a += self.guide_a
+      b += self.guide_b
+      self.a_guider_steps += self.guide_a
+      self.b_guider_steps += self.guide_b
+    self.guide_a = self.guide_b = 0
+    if (abs(a) > self.velocity_limit[0]) or (abs(b) > self.velocity_limit[1]):
+      self._raise(controller.TC_EXCEPTION_VELOCITY_LIMIT_EXCEEDED)
+      return
+    if (abs(a - va) > self.acceleration_limit[0]) or (abs(b - vb) > self.acceleration_limit[1]):
+      self._raise(controller.TC_EXCEPTION_ACCELERATION_LIMIT_EXCEEDED,
+                  AxisTraceDetails(int(abs(b - vb) > self.acceleration_limit[1]), steps=a, previous_remainder=va))
+      return
+    self._move(a, b)
+    self.last_dequeued_frame = frame_number
+    self._changed = True
+
+  def _move(self, a, b):
+    self.velocity = (a, b)
+    self.a_total_steps += a
+    self.b_total_steps += b
+
+  # Control requests. Each returns the data for a read, or None for a write, or raises _Stall or _Wait:
+
+  def _request(self, request, data, length):
+    if request == controller.TC_ENQUEUE:
+      return self._enqueue(*_ENQUEUE.unpack(data))
+    elif request == controller.TC_GET_VERSION:
+      major, minor = self.version
+      return _VERSION.pack(minor, major, minor, major, self.clock_frequency, self.capacity, 0)
+    elif request == controller.TC_ISSUE_STATE_COMMAND:
+      return self._state_command(_WORD.unpack(data)[0])
+    elif request == controller.TC_MC_CONFIGURE:
+      self._configure_mc(_MC_CONFIGURATION.unpack(data))
+    elif request in (controller.TC_GPIO_CONFIGURE, controller.TC_SAFETY_CONFIGURE):
+      if request == controller.TC_SAFETY_CONFIGURE:
+        self.shutdown_inputs = [self._input(pin) for pin in struct.unpack("<BBBB", data)]
+    elif request == controller.TC_WRITE_OUTPUTS:
+      self.outputs = _OUTPUTS.unpack(data)[0]
+    elif request == controller.TC_GET_COUNTERS:
+      return _COUNTERS.pack(self.last_dequeued_frame, self.a_total_steps, self.b_total_steps, self.a_guider_steps,
+                            self.b_guider_steps, self.a_total_steps, self.b_total_steps)
+    elif request == controller.TC_GET_DEBUG_REGISTERS:
+      return struct.pack("<LL", 0, 0)
+    elif request == controller.TC_SET_GUIDER_VALUES:
+      run_at, reserved_a, reserved_b, frame_number = struct.unpack("<BBHL", data[:8])
+      self.guider_result = (frame_number, (len(data) - 8) // 4)
+    elif request == controller.TC_GET_GUIDER_RESULT:
+      return struct.pack("<LL", *self.guider_result)
+    elif request == controller.TC_GET_EXCEPTION:
+      return _WORD.pack(self.exception)
+    elif request == controller.TC_GET_EXCEPTION_DETAILS_LENGTH:
+      return _WORD.pack(len(self.exceptions[0][1]) if self.exceptions else 0)
+    elif request == controller.TC_GET_EXCEPTION_DETAILS:
+      if not self.exceptions:
+        raise _Stall()
+      return self.exceptions[0][1]
+    elif request == controller.TC_CLEAR_EXCEPTION:
+      if self.exception != _WORD.unpack(data)[0] or self.state == controller.TC_STATE_STOPPING:
+        raise _Stall()
+      self.exceptions.pop(0)
+      if not self.exceptions:
+        self.state = controller.TC_STATE_IDLE
+        self._reset_frames()
+        self._changed = True
+    else:
+      raise _Stall()
+    return None
+
+  def _input(self, pin):
+    if pin == controller.TC_MC_UNUSED_INPUT:
+      return None
+    return pin
+
+  def _configure_mc(self, values):
+    (self.prefill, pin_flags, shutdown_a, shutdown_b, accel_a, accel_b, velocity_a, velocity_b, self.frame_period,
+     pulse_width) = values[:10]
+    self.shutdown_acceleration = (shutdown_a, shutdown_b)
+    self.acceleration_limit = (accel_a, accel_b)
+    self.velocity_limit = (velocity_a, velocity_b)
+    self.limit_inputs = [self._input(pin) for pin in values[10:14]]
+
+  def _state_command(self, command):
+    if command == controller.TC_STATE_COMMAND_SHUTDOWN:
+      if self.state in (controller.TC_STATE_IDLE, controller.TC_STATE_RUNNING):
+        self._raise(controller.TC_EXCEPTION_SHUTDOWN_REQUESTED)
+    elif command == controller.TC_STATE_COMMAND_ENABLE_GUIDER:
+      self.guider_enabled = True
+    elif command == controller.TC_STATE_COMMAND_DISABLE_GUIDER:
+      self.guider_enabled = False
+    elif command == controller.TC_STATE_COMMAND_FORCE_INTERRUPT:
+      self._changed = True
+    elif command == controller.TC_STATE_COMMAND_RESET_IO:
+      self.outputs = 0L
+    elif command == controller.TC_STATE_COMMAND_HARDWARE_RESET:
+      if self.state not in (controller.TC_STATE_IDLE, controller.TC_STATE_EXCEPTION):
+        raise _Stall()
+      self.hardware_reset()
+    elif command == controller.TC_STATE_COMMAND_FORCE_HARDWARE_RESET:
+      self.hardware_reset()
+    else:
+      raise _Stall()
+
+  def _enqueue(self, frame_number, a_steps, b_steps):
+    if self.state not in (controller.TC_STATE_IDLE, controller.TC_STATE_RUNNING):
+      return None      # Frames sent after an exception are discarded
+    if frame_number != (self.last_enqueued_frame + 1) % 0x100000000L:
+      self._raise(controller.TC_EXCEPTION_QUEUE_NONSEQUENTIAL_FRAME_NUMBER)
+      return None
+    if len(self.queue) >= self.capacity:
+      raise _Wait()
+    self.queue.append((frame_number, a_steps, b_steps))
+    self.last_enqueued_frame = frame_number
+    if (self.state == controller.TC_STATE_IDLE) and (len(self.queue) >= self.prefill):
+      self.state = controller.TC_STATE_RUNNING
+      self.next_frame = self.clock() + self._period()
+      self._changed = True
+    return None
+
+  # USB transfers, and the event loop:
+
+  def _submit(self, transfer):
+    if transfer._request is None:
+      self._interrupts.append(transfer)
+    else:
+      due = self.clock() + self.latency
+      if self._transfers:
+        due = max(due, self._transfers[-1].due)    # Control transfers complete in order
+      transfer.due = due
+      self._transfers.append(transfer)
+
+  def _fault(self, command):
+    faults = self._faults.get(command)
+    if faults:
+      return faults.pop(0)
+    return None
+
+  def next_due(self):
+    """Return the time of the next thing this device has to do, or None.
+    """
+    times = []
+    if self._transfers:
+      times.append(max(self._transfers[0].due, self._stall_until))
+    if self.next_frame is not None:
+      times.append(self.next_frame)
+    if self._changed and self._interrupts:
+      times.append(self._stall_until)
+    if self._injections:
+      times.append(0.0)
+    if times:
+      return min(times)
+    return None
+
+  def process(self, now):
+    """Do everything due by time 'now' - fault injections, frame ticks, and transfer completions, in time order.
+    """
+    while self._injections:
+      self._injections.popleft()(now)
+    while True:
+      frame = self.next_frame
+      transfer = None
+      if self._transfers and (max(self._transfers[0].due, self._stall_until) <= now):
+        transfer = self._transfers[0]
+      if (frame is not None) and (frame <= now) and ((transfer is None) or (frame <= transfer.due)):
+        self._tick()
+        if self.next_frame is not None:
+          self.next_frame = frame + self._period()
+      elif (transfer is not None) and self._complete_control(transfer):
+        self._transfers.popleft()
+      elif self._changed and self._interrupts and (self._stall_until <= now):
+        self._complete_interrupt(self._interrupts.popleft())
+      else:
+        break
+
+  def _complete_control(self, transfer):
+    """Complete the control transfer at the head of the queue, unless it has to wait for a frame to be dequeued
+       first. Returns True if it completed.
+    """
+    status = self._fault(transfer._request)
+    if status is not None:
+      transfer._complete(status)
+      return True
+    try:
+      result = self._request(transfer._request, transfer._data, transfer._length)
+    except _Wait:
+      if self.next_frame is None:
+        transfer._complete(libusb1.LIBUSB_TRANSFER_STALL)     # Would never complete
+        return True
+      transfer.due = self.next_frame
+      return False
+    except _Stall:
+      transfer._complete(libusb1.LIBUSB_TRANSFER_STALL)
+      return True
+    if transfer._inbound:
+      transfer._complete(libusb1.LIBUSB_TRANSFER_COMPLETED, (result or "")[:transfer._length])
+    else:
+      transfer._complete(libusb1.LIBUSB_TRANSFER_COMPLETED)
+    return True
+
+  def _complete_interrupt(self, transfer):
+    status = self._fault('interrupt')
+    if status is not None:
+      transfer._complete(status)
+      return
+    self._changed = False
+    flags = int(self.guider_enabled)
+    transfer._complete(libusb1.LIBUSB_TRANSFER_COMPLETED,
+                       _STATUS.pack(1, self.state, flags, self.exception, self.inputs, self.last_enqueued_frame,
+                                    self.last_dequeued_frame))
+
+
+class _Stall(Exception):
+  """Raised by a FakeController request handler to stall (reject) the control transfer.
+  """
+  pass
+
+
+class _Wait(Exception):
+  """Raised by a FakeController request handler if the transfer can't complete until the next frame is dequeued,
+     (an enqueue with the controller queue full).
+  """
+  pass
+
+
+class FakeContext(object):
+  """Stands in for a python-libusb1 LibUSBContext, listing the backend's fake devices.
+  """
+  def __init__(self, devices):
+    self._devices = devices
+
+  def getDeviceList(self):
+    return list(self._devices)
+
+  def exit(self):
+    pass
+
+  def timeout(self):
+    """Return the time in seconds until the next thing one of the open devices has to do, or None.
+    """
+    times = []
+    for device in self._devices:
+      if device._open:
+        due = device.next_due()
+        if due is not None:
+          times.append(due - device.clock())
+    if times:
+      return max(min(times), 0.0)
+    return None
+
+  def process(self):
+    for device in self._devices:
+      if device._open:
+        device.process(device.clock())
+
+
+class FakeUSBPoller(object):
+  """Stands in for a python-libusb1 USBPoller, wrapping the system poller passed to controller.run.
+  """
+  def __init__(self, context, poller):
+    self._context = context
+    self._poller = poller
+
+  def register(self, fd, events):
+    self._poller.register(fd, events)
+
+  def unregister(self, fd):
+    self._poller.unregister(fd)
+
+  def poll(self, timeout=None):
+    """Wait for events on the registered file descriptors, for up to 'timeout' seconds, or until the next
+       transfer completion or frame on a fake device, then process the fake devices. Returns the events
+       from the system poller.
+    """
+    wait = self._context.timeout()
+    if (wait is not None) and ((timeout is None) or (wait < timeout)):
+      timeout = wait
+    result = self._poller.poll(timeout)
+    self._context.process()
+    return result
+
+
+class Backend(object):
+  """A USB backend with fake controller devices, to pass to controller.run in place of the usb1 module.
+  """
+  def __init__(self, devices=None, **kwargs):
+    """'devices' is a list of FakeController objects. If it's None, one FakeController is created, with the
+       given keyword arguments.
+    """
+    if devices is None:
+      devices = [FakeController(**kwargs)]
+    self.devices = devices
+
+  def __repr__(self):
+    return "<fakeusb.Backend: %s>" % self.devices
+
+  def LibUSBContext(self):
+    return FakeContext(self.devices)
+
+  def USBPoller(self, context, poller):
+    return FakeUSBPoller(context, poller)
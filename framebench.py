@@ -0,0 +1,239 @@
+
+"""Microbenchmarks for the 50ms frame hot path - MotorControl.getframe, Axis.getframe, CalcJump and
+   CalcPaddle, usbcon.Driver.enqueue_frame_available and the controller's enqueue_frame call - with no
+   hardware attached. Run it with 'python framebench.py [scenario ...]', or call 'Run()'.
+
+   Each scenario drives a fresh MotorControl, usbcon.Driver and controller.Controller through FRAMES frames,
+   talking to an emulated controller card (a fakeusb.FakeController) on a simulated clock. Each frame, the
+   benchmark advances the clock by one frame period and lets the fake controller catch up - it dequeues a frame,
+   sends the status packet on the interrupt endpoint, and completes the enqueue transfer that the driver sends
+   in reply, in the same way libusb would. So the times are the CPU cost of the Python code that runs for every
+   frame, from the status packet to the completion of the next enqueue (including the small cost of the fake
+   controller itself). The scenarios are:
+
+     tracking - sidereal, non-sidereal and refraction tracking, no other motion
+     slew     - back and forth jumps of SLEWDEGREES degrees in each axis at the slew rate
+     paddle   - hand paddle held down at the slew rate in both axes, released and pressed again
+     guider   - tracking, with new controller counters (autoguider steps and step reconciliation) every
+                prefs.GuideCounterInterval seconds
+     limit    - a slew, interrupted by a hardware limit and an emergency stop (the stop is only done
+                in software at NZ, so at other sites this is the same as a slew)
+
+   Refill() simulates the controller queue running dry, and measures how long it takes to fill again, with a
+   given number of enqueue transfers in flight at once (see controller.Controller.set_enqueue_window).
+
+   For each scenario, the per-frame latency (mean, 99th percentile and maximum) is reported, along with the
+   number of garbage collections that ran inside a frame, and the worst latency of those frames. Python 2 has
+   no way to count every memory allocation, so the allocation count is the net number of new objects tracked
+   by the garbage collector in each frame (measured in a second pass with the collector turned off) - that's
+   the number that triggers garbage collections.
+"""
+
+import gc
+import sys
+
+from globals import *
+import fakeusb
+import motion
+import usbcon
+
+FRAMES = 6000            # Number of frames (5 minutes of telescope time) to run for each scenario
+SLEWDEGREES = 10.0       # Size of the jumps in the 'slew' and 'limit' scenarios, in degrees
+LIMITFRAME = 100         # Frame number in the 'limit' scenario when the hardware limit is hit
+USBLATENCY = 0.001       # Simulated USB round trip time for each transfer, in seconds, for Refill()
+REFILLWINDOWS = [1, 2, 4, 12]   # Enqueue windows to compare in Refill()
+
+SCENARIOS = ['tracking', 'slew', 'paddle', 'guider', 'limit']
+
+
+class Bench(object):
+  """A MotorControl and usbcon.Driver wired to a fake controller, for one run of one scenario.
+  """
+  def __init__(self, scenario, latency=0.0):
+    if scenario not in SCENARIOS:
+      raise ValueError("Unknown scenario '%s', must be one of %s" % (scenario, SCENARIOS))
+    self.scenario = scenario
+    self.limits = usbcon.LimitStatus()
+    self.motors = motion.MotorControl(limits=self.limits)
+    self.driver = usbcon.Driver(getframe=self.motors.getframe, newcounters=self.motors.newcounters,
+                                limits=self.limits, getline=self.motors.getline)
+    self.now = 0.0           # Simulated time, in seconds
+    self.device = fakeusb.FakeController(latency=latency, clock=lambda: self.now)
+    self.host = usbcon.controller.Controller(self.driver, device_handle=self.device.open())
+    self.host.mc_frames_capacity = self.device.capacity
+    self.driver.internal_attach_host(self.host)
+    self.motors.Driver = self.driver
+    self.frame = 0
+    self.direction = 1
+    self.counterframes = max(int(round(prefs.GuideCounterInterval / PULSE)), 1)
+    if scenario in ['tracking', 'guider']:
+      self.motors.RA.SetTrack(0.01)
+      self.motors.DEC.SetTrack(-0.005)
+      self.motors.RA.SetRefraction(0.002)
+      self.motors.DEC.SetRefraction(0.001)
+    if scenario == 'guider':
+      self.motors.Autoguiding = True
+      self.driver.guider_enabled = True
+      self.device.guider_enabled = True
+
+  def start(self):
+    """Start listening for status packets, and fill the controller queue, ready for the first frame.
+    """
+    self.host._initiate_interrupt_read()
+    self.host._call_enqueue_available()
+    self.run()
+
+  def run(self):
+    """Let the fake controller do everything due by the current simulated time, and check that it's still
+       running.
+    """
+    self.device.process(self.now)
+    if self.device.exception != usbcon.controller.TC_EXCEPTION_NONE:
+      raise RuntimeError("Fake controller raised exception %d in frame %d" % (self.device.exception, self.frame))
+
+  def _jump(self):
+    """Start a jump of SLEWDEGREES in each axis, in the opposite direction to the last one.
+    """
+    steps = self.direction * SLEWDEGREES * 3600 * 20
+    self.motors.Jump(steps, steps, prefs.SlewRate, force=True)
+    self.direction = -self.direction
+
+  def prepare(self):
+    """Post any motion requests for the next frame, as the other threads would. Not included in the timing.
+    """
+    motors = self.motors
+    if self.scenario == 'slew':
+      if not (motors.Moving or motors.RA.Jumping or motors.DEC.Jumping):
+        self._jump()
+    elif self.scenario == 'paddle':
+      period = int(60 / PULSE)
+      if self.frame % period == 0:
+        motors.RA.StartPaddle(prefs.SlewRate * self.direction)
+        motors.DEC.StartPaddle(prefs.SlewRate * self.direction)
+        self.direction = -self.direction
+      elif self.frame % period == period // 2:
+        motors.RA.StopPaddle()
+        motors.DEC.StopPaddle()
+    elif self.scenario == 'guider':
+      if self.frame % 4 == 0:
+        self.device.guide(1, -1)
+        self.device.process(self.now)      # Apply the injected steps outside the timing
+    elif self.scenario == 'limit':
+      if self.frame == 0:
+        self._jump()
+      elif self.frame == LIMITFRAME:
+        self.limits.EastLim = True
+        self.limits.HWLimit = True
+
+  def counters(self):
+    """Return a controller.CounterDetails object with the fake controller's current counters, as the driver
+       would read them.
+    """
+    device = self.device
+    counters = usbcon.controller.CounterDetails()
+    counters.reference_frame_number = device.last_dequeued_frame
+    counters.a_total_steps, counters.b_total_steps = device.a_total_steps, device.b_total_steps
+    counters.a_guider_steps, counters.b_guider_steps = device.a_guider_steps, device.b_guider_steps
+    counters.a_measured_steps, counters.b_measured_steps = device.a_total_steps, device.b_total_steps
+    return counters
+
+  def step(self):
+    """Advance the clock by one frame period, so the fake controller dequeues a frame and the driver sends the
+       next one, and deliver new counters if they're due - the work done in the frame thread.
+    """
+    self.now += PULSE
+    self.run()
+    if (self.scenario == 'guider') and (self.frame % self.counterframes == 0):
+      self.driver._newcounters(self.counters())
+    self.frame += 1
+
+
+def _percentile(values, p):
+  """Return the p'th percentile of a sorted list of values.
+  """
+  return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def Bench1(scenario, frames=FRAMES):
+  """Run one scenario for 'frames' frames, and return a dictionary of results - per-frame latency in
+     microseconds ('mean', 'p99', 'max'), the number of frames with a garbage collection ('gcframes') and the
+     worst latency of those frames ('gcmax'), and the net number of new objects tracked by the garbage collector
+     per frame ('allocmean', 'allocmax').
+  """
+  clock = time.time
+  b = Bench(scenario)
+  b.start()
+  times = []
+  gcframes, gcmax = 0, 0.0
+  for i in xrange(frames):
+    b.prepare()
+    collections = gc.get_count()[1]
+    t0 = clock()
+    b.step()
+    dt = clock() - t0
+    times.append(dt)
+    if gc.get_count()[1] != collections:    # Generation 1 count goes up by one with each generation 0 collection
+      gcframes += 1
+      gcmax = max(gcmax, dt)
+
+  b = Bench(scenario)
+  b.start()
+  allocs = []
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    for i in xrange(frames):
+      b.prepare()
+      n0 = gc.get_count()[0]
+      b.step()
+      allocs.append(gc.get_count()[0] - n0)
+  finally:
+    if enabled:
+      gc.enable()
+
+  times.sort()
+  return {'scenario':scenario,
+          'frames':frames,
+          'mean':sum(times) / len(times) * 1e6,
+          'p99':_percentile(times, 99) * 1e6,
+          'max':times[-1] * 1e6,
+          'gcframes':gcframes,
+          'gcmax':gcmax * 1e6,
+          'allocmean':float(sum(allocs)) / len(allocs),
+          'allocmax':max(allocs)}
+
+
+def Refill(window=1, latency=USBLATENCY):
+  """Simulate the controller queue running dry, and return the time (in seconds, with a simulated USB round
+     trip of 'latency' seconds for each transfer) until the queue is back to the target depth (see usbcon.QueueControl), with
+     'window' enqueue transfers allowed in flight at once.
+  """
+  b = Bench('tracking', latency=latency)
+  b.host.set_enqueue_window(window)
+  b.host._initiate_interrupt_read()
+  b.host._call_enqueue_available()     # The fake controller starts with an empty queue
+  while b.host._enqueues_in_flight:
+    b.now = b.device.next_due()
+    b.run()
+  return b.now
+
+
+def Run(scenarios=None, frames=FRAMES):
+  """Run each of the given scenarios (all of them, if None) for 'frames' frames, print a table of the
+     results, and return a list of result dictionaries (see Bench1).
+  """
+  if not scenarios:
+    scenarios = SCENARIOS
+  results = [Bench1(scenario, frames=frames) for scenario in scenarios]
+  print "%-10s %8s %8s %8s %8s %8s %8s %8s" % ('scenario', 'mean us', 'p99 us', 'max us', 'gc frms', 'gc max', 'alloc',
+                                               'allocmax')
+  for r in results:
+    print "%(scenario)-10s %(mean)8.1f %(p99)8.1f %(max)8.1f %(gcframes)8d %(gcmax)8.1f %(allocmean)8.2f %(allocmax)8d" % r
+  print
+  print "Queue refill time with a %3.1f ms USB round trip:" % (USBLATENCY * 1000),
+  print ", ".join(["window %d: %4.1f ms" % (w, Refill(window=w) * 1000) for w in REFILLWINDOWS])
+  return results
+
+
+if __name__ == '__main__':
+  Run(sys.argv[1:])
@@ -168,12 +168,13 @@ class Errors(object):
     self.CalError = False       # Current position is unknown
     self.CalErrorTag = None     # Save the 'CalErr' safety interlock tag, if there is one
     self.TimeoutError = False   # Haven't heard from Prosp for a while, not safe to continue
+    self.StepError = False      # The controller step counters don't match the steps sent
 
   def __getstate__(self):
     """Can't pickle the __setattr__ function when saving state
     """
     d = {}
-    for n in ['RefError', 'AltError', 'CalError', 'TimeoutError']:
+    for n in ['RefError', 'AltError', 'CalError', 'TimeoutError', 'StepError']:
       d[n] = self.__dict__[n]
     return d
 
@@ -187,6 +188,8 @@ class Errors(object):
       errs.append('**Object too LOW**')
     if self.TimeoutError:
       errs.append('**No contact with Prosp**')
+    if self.StepError:
+      errs.append('**Motor steps lost - Reset Position!**')
     return '\n'.join(errs) + '\n'
 
   def __str__(self):
@@ -199,6 +202,8 @@ class Errors(object):
       errs.append('ALT')
     if self.TimeoutError:
       errs.append('PROSP')
+    if self.StepError:
+      errs.append('STEP')
     return "Errors:[%s]" % (','.join(errs))
 
 
@@ -228,6 +233,7 @@ class Prefs(object):
     self.Press = CP.getfloat('Environment', 'Pressure')
     self.WaitBeforePosUpdate = CP.getfloat('Dome', 'WaitTime')
     self.MinWaitBetweenDomeMoves = CP.getfloat('Dome', 'MinBetween')
+    self.DomeSpeed = CP.getfloat('Dome', 'DomeSpeed')
     self.LogDirName = CP.get('Paths', 'LogDirName')
     self.CapHourAngle = CP.getfloat('Presets', 'CapHourAngle')
     self.CapDec = CP.getfloat('Presets', 'CapDec')
@@ -239,6 +245,50 @@ class Prefs(object):
     self.DomeFlatDomeAzi = CP.getfloat('Presets', 'DomeFlatDomeAzi')
     self.SkyFlatHourAngle = CP.getfloat('Presets', 'SkyFlatHourAngle')
     self.SkyFlatDec = CP.getfloat('Presets', 'SkyFlatDec')
+    self.FrameLogMinutes = CP.getfloat('Motion', 'FrameLogMinutes')
+    self.AutoRestart = CP.getboolean('Motion', 'AutoRestart')
+    self.CounterInterval = CP.getfloat('Motion', 'CounterInterval')
+    self.GuideCounterInterval = CP.getfloat('Motion', 'GuideCounterInterval')
+    self.ReconcileThreshold = CP.getint('Motion', 'ReconcileThreshold')
+    self.AutoCorrect = CP.getboolean('Motion', 'AutoCorrect')
+    self.MotionQueueLength = CP.getint('Motion', 'MotionQueueLength')
+    self.SettleTime = CP.getfloat('Motion', 'SettleTime')
+    self.FrameProcess = CP.getboolean('Motion', 'FrameProcess')
+    self.EnqueueWindow = CP.getint('Motion', 'EnqueueWindow')
+    self.QueueMinDepth = CP.getint('Motion', 'QueueMinDepth')
+    self.QueueMaxDepth = CP.getint('Motion', 'QueueMaxDepth')
+    self.QueueMargin = CP.getint('Motion', 'QueueMargin')
+    self.UnderflowHorizon = CP.getfloat('Motion', 'UnderflowHorizon')   # Warn of a queue underflow this many seconds ahead
+    self.UnderflowDeepen = CP.getboolean('Motion', 'UnderflowDeepen')   # Deepen the controller queue when an underflow is predicted
+    self.UnderflowShed = CP.getboolean('Motion', 'UnderflowShed')       # Skip non-critical detevent work when an underflow is predicted
+    self.PostMortemSeconds = CP.getfloat('Motion', 'PostMortemSeconds')   # Frame history saved after each shutdown
+    self.FakeController = CP.getboolean('Motion', 'FakeController')   # Use an emulated controller card (fakeusb.py)
+    self.ControllerDevice = ParseDevice(CP.get('Motion', 'ControllerDevice'))
+    self.ExtraMounts = []
+    mounts = CP.get('Motion', 'ExtraMounts').strip()
+    if mounts.lower() != 'none':
+      for spec in mounts.split(','):
+        name, device = spec.split('=', 1)
+        self.ExtraMounts.append((name.strip(), ParseDevice(device)))
+    self.RTPriority = CP.getint('Realtime', 'Priority')         # SCHED_FIFO priority for the frame thread, 0 for none
+    self.RTAffinity = []                                       # CPU numbers to pin the frame thread to, or empty
+    cpus = CP.get('Realtime', 'Affinity').strip()
+    if cpus.lower() != 'none':
+      self.RTAffinity = [int(cpu) for cpu in cpus.split(',')]
+    self.RTLockMemory = CP.getboolean('Realtime', 'LockMemory')   # Lock the process memory into RAM with mlockall
+
+
+def ParseDevice(spec):
+  """Convert a controller device string from the config file to a device selector for controller.Controller - None
+     for 'none' or an empty string (use the only controller connected), an integer index for a number, or otherwise
+     the string itself (a USB serial number, or "bus:address").
+  """
+  spec = spec.strip()
+  if (not spec) or (spec.lower() == 'none'):
+    return None
+  if spec.isdigit():
+    return int(spec)
+  return spec
 
 
 def sexstring(value=0.0, sp=':', fixed=False, dp=None):
@@ -440,6 +490,64 @@ class SafetyInterlock(object):
     return self.__repr__()
 
 
+class TimedLock(object):
+  """A re-entrant lock that keeps statistics on how long it is held, and how long threads have
+     to wait to acquire it. Can be used anywhere a threading.RLock would be, including in a
+     'with' statement.
+
+     Used for locks shared between the detevent threads, the Pyro server and the command line,
+     so that lock contention can be measured. The USB frame thread never takes these locks.
+  """
+  def __init__(self, name=''):
+    self.name = name
+    self._lock = threading.RLock()
+    self._depth = 0          # Re-entrant acquisition depth for the current owner
+    self._acquired = 0.0     # Time when the lock was last acquired by a new owner
+    self.count = 0           # Number of times the lock has been acquired (not counting re-entrant acquisitions)
+    self.held = 0.0          # Total time the lock has been held, in seconds
+    self.maxheld = 0.0       # Longest time the lock has been held, in seconds
+    self.waited = 0.0        # Total time spent waiting to acquire the lock, in seconds
+    self.maxwait = 0.0       # Longest wait to acquire the lock, in seconds
+
+  def __repr__(self):
+    return "<TimedLock %s: %d acquired, held max=%6.4fs total=%6.2fs, wait max=%6.4fs total=%6.2fs>" % (
+           self.name, self.count, self.maxheld, self.held, self.maxwait, self.waited)
+
+  def acquire(self):
+    start = time.time()
+    self._lock.acquire()
+    self._depth += 1
+    if self._depth == 1:
+      self._acquired = time.time()
+      wait = self._acquired - start
+      self.count += 1
+      self.waited += wait
+      if wait > self.maxwait:
+        self.maxwait = wait
+    return True
+
+  def release(self):
+    self._depth -= 1
+    if self._depth == 0:
+      held = time.time() - self._acquired
+      self.held += held
+      if held > self.maxheld:
+        self.maxheld = held
+    self._lock.release()
+
+  def __enter__(self):
+    return self.acquire()
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.release()
+
+  def stats(self):
+    """Return a dictionary of lock statistics, suitable for sending over Pyro.
+    """
+    return {'name':self.name, 'count':self.count, 'held':self.held, 'maxheld':self.maxheld,
+            'waited':self.waited, 'maxwait':self.maxwait}
+
+
 def UpdateConfig():
   """Load the .ini file and populate the ConfigParser object with the contents.
   """
@@ -448,7 +556,8 @@ def UpdateConfig():
   if not lCPfile:
     logger.error("None of the specified configuration files found by globals.py: %s" % (CPPATH,))
 
-  for section in ['Toggles', 'Environment', 'Presets', 'Paths', 'FlexureEast', 'FlexureWest', 'Alarms', 'Rates', 'Dome']:
+  for section in ['Toggles', 'Environment', 'Presets', 'Paths', 'FlexureEast', 'FlexureWest', 'Alarms', 'Rates', 'Dome', 'Motion',
+                  'Realtime']:
     if not lCP.has_section(section):
       lCP.add_section(section)
   return lCP, lCPfile
@@ -461,7 +570,18 @@ ConfigDefaults = {'FlexureOn':'True', 'HighHorizonOn':'False', 'RefractionOn':'T
                   'CoarseSet':str(DFCOARSESETRATE / 20), 'FineSet':str(DFFINESETRATE / 20), 'GUIDE':str(DFGUIDERATE / 20),
                   'Temp':str(DFTEMP), 'Press':str(DFPRESS)}
 
-ConfigDefaults.update( {'WaitTime':'0.5', 'MinBetween':'5', 'LogDirName':'/tmp'} )
+ConfigDefaults.update( {'WaitTime':'0.5', 'MinBetween':'5', 'DomeSpeed':'2.0', 'LogDirName':'/tmp'} )
+
+ConfigDefaults.update( {'FrameLogMinutes':'60', 'AutoRestart':'True', 'CounterInterval':'10.0',
+                        'GuideCounterInterval':'1.0',
+                        'ReconcileThreshold':'20', 'AutoCorrect':'False', 'MotionQueueLength':'8',
+                        'SettleTime':'2.0', 'ControllerDevice':'none', 'ExtraMounts':'none',
+                        'FrameProcess':'False', 'EnqueueWindow':'1',
+                        'QueueMinDepth':'6', 'QueueMaxDepth':'12', 'QueueMargin':'3',
+                        'UnderflowHorizon':'2.0', 'UnderflowDeepen':'True', 'UnderflowShed':'True',
+                        'PostMortemSeconds':'30', 'FakeController':'False'} )
+
+ConfigDefaults.update( {'Priority':'0', 'Affinity':'none', 'LockMemory':'False'} )
 
 CP, CPfile = UpdateConfig()
 
@@ -1,9 +1,13 @@
 
 """This module handles the telescope motion control - velocity ramping in each axis and sending
-   velocity pairs to the motor queue for each 50ms time step. It's handled by a single instance of the
+   velocity pairs to the motor queue for each 50ms time step. It's handled by an instance of the
    'MotorControl' class, stored in a module global called 'motors'. That motor control object contains
    two instances of the 'Axis' class, one for RA and the other for DEC.
 
+   Each mount (and controller card) has its own 'Mount' object, holding its MotorControl and LimitStatus
+   objects and running its own controller thread. The main mount's objects are the module globals 'motors'
+   and 'limits', and any extra mounts driven by the same process are in the 'mounts' dictionary.
+
    The low-level driver (defined in the 'Driver' class in usbcon.py) handles all of the USB
    communication, and is available here as the .Driver attribute in the MotorControl class. The motion
    control, and most of the methods here are called asynchronously by the controller.
@@ -15,36 +19,278 @@
    When MotorControl.enqueue_frame_available is called, that code calls getframe() on both the RA and DEC
    'Axis' objects, and it is this getframe() method that does the hand paddle and jump velocity ramping,
    adds the non-sidereal and sidereal track rates (if not 'Frozen'), and handles emergency stops when
-   the limits are active using the CutFrac variable.
+   the limits are active, ramping each axis down to rest from its current velocity at the controller's
+   shutdown deceleration.
 
    The getframe() method on each axis returns the number of steps to travel in that axis, for that frame, and
    these numbers are aggregated, converted to integer (aggregating any fractional part to add in on the next
    frame), and sent to the controller.
+
+   The USB frame thread never takes a lock. Other threads (detevent, Pyro, the command line) talk to each Axis
+   through a command block - motion requests (jumps, paddle start/stop) are posted to a queue that the frame
+   thread drains at the start of each frame, and tracking rates are published by replacing an immutable
+   AxisCommand object. Accumulated motion logs go the other way - the frame thread publishes running totals
+   as a single tuple every frame, and readers work out the change since they last looked.
+
+   All motion is accumulated as integers, in units of 1/SUBSTEPS of a motor step, so no steps are ever
+   lost or invented by floating point rounding, however long the system runs. SUBSTEPS is a power of two,
+   so converting a value in steps (as a float) to sub-steps and back is exact.
 """
 
+import bisect
+import collections
 import math
 import threading
 import time
 
 from globals import *
 import digio
+import realtime
 import usbcon
 
 
+SUBSTEPS = 1 << 20          # Number of sub-steps in one motor step
+SUBSTEPS_PER_ARCSEC = 20.0 * SUBSTEPS    # Motor steps are 0.05 arcseconds
+
 intthread = None
 
 log = []
 
 
+def ToSubsteps(steps):
+  """Convert a value in motor steps (int or float) to the nearest integer number of sub-steps.
+  """
+  return int(round(steps * SUBSTEPS))
+
+
+def RampRates(Rate):
+  """Return the ramp acceleration (in sub-steps/frame/frame) and the peak velocity (in sub-steps/frame)
+     for a jump with a peak velocity of 'Rate' steps/second, as a tuple (add_vel, max_vel). Both are unsigned.
+  """
+  max_vel = ToSubsteps(abs(Rate) * PULSE)
+  # number of time pulses in the ramp up.
+  ramp_time = abs(float(Rate)) / MOTOR_ACCEL     # MOTOR_ACCEL is in steps/sec/sec
+  num_pulses = math.trunc(ramp_time / PULSE)
+  if num_pulses > 0:
+    return max_vel // num_pulses, max_vel
+  else:
+    return max_vel, max_vel
+
+
+def StopFrames(velocity, add_vel):
+  """Return the number of frames with non-zero velocity while ramping down from 'velocity' (unsigned, in
+     sub-steps/frame) to zero, at 'add_vel' sub-steps/frame/frame, not counting the current frame.
+  """
+  if velocity <= 0:
+    return 0
+  return (velocity - 1) // add_vel
+
+
+def StopDistance(velocity, add_vel):
+  """Return the number of sub-steps moved while ramping down from 'velocity' (unsigned, in sub-steps/frame)
+     to zero, at 'add_vel' sub-steps/frame/frame, not counting the current frame.
+  """
+  n = StopFrames(velocity, add_vel)
+  return n * velocity - add_vel * n * (n + 1) // 2
+
+
+def JumpProfile(delta, velocity, add_vel, max_vel):
+  """Plan a jump of 'delta' sub-steps, starting at the current velocity of 'velocity' sub-steps/frame, with
+     an acceleration of at most 'add_vel' sub-steps/frame/frame and a peak velocity of 'max_vel' sub-steps/frame
+     (add_vel and max_vel are unsigned).
+
+     If the axis is moving the wrong way (or faster than max_vel), it's slowed down first. If it's moving too
+     fast to stop in time, it ramps down to zero past the destination and then jumps back.
+
+     Returns a tuple (segments, left), where segments is a list of (frames, velocity) pairs - the velocity to
+     send for that number of frames - and left is the number of sub-steps that don't fit into the profile,
+     to be spread out over the jump.
+  """
+  add_vel = max(add_vel, 1)
+  sign = {True:-1, False:1}[delta < 0]
+  togo = delta * sign        # Work with a positive jump, and flip the velocities at the end
+  v = velocity * sign
+  segments = []
+
+  # Moving the wrong way, or faster than max_vel - slow down first
+  while (v < 0) or (v > max_vel):
+    if v < 0:
+      v = min(v + add_vel, 0)
+    else:
+      v = max(v - add_vel, max_vel)
+    segments.append((1, v * sign))
+    togo -= v
+
+  if StopDistance(v, add_vel) > togo:
+    # Can't stop in time - ramp down to zero, then jump back the other way
+    while v > 0:
+      v = max(v - add_vel, 0)
+      if v > 0:
+        segments.append((1, v * sign))
+        togo -= v
+    rest, left = JumpProfile(togo * sign, 0, add_vel, max_vel)
+    return segments + rest, left
+
+  # Ramp up, as long as we can still stop in time
+  while v < max_vel:
+    nv = min(v + add_vel, max_vel)
+    if nv + StopDistance(nv, add_vel) > togo:
+      break
+    v = nv
+    segments.append((1, v * sign))
+    togo -= v
+
+  # Plateau - stay at this velocity for as many whole frames as possible, leaving room to stop
+  if v > 0:
+    n = (togo - StopDistance(v, add_vel)) // v
+    if n > 0:
+      segments.append((n, v * sign))
+      togo -= n * v
+
+  # Ramp down
+  while v > 0:
+    v = max(v - add_vel, 0)
+    if v > 0:
+      segments.append((1, v * sign))
+      togo -= v
+
+  return segments, togo * sign
+
+
+def PlanJump(delta, Rate):
+  """Plan a jump of 'delta' steps from rest, with a peak velocity of 'Rate' steps/second. Returns a
+     tuple (segments, left, delta, max_vel), with delta and max_vel in sub-steps, that can be passed
+     to Axis.StartProfile (or MotorControl.Jump as one of the 'plans').
+  """
+  delta = ToSubsteps(delta)
+  add_vel, max_vel = RampRates(Rate)
+  segments, left = JumpProfile(delta, 0, add_vel, max_vel)
+  return segments, left, delta, max_vel
+
+
+def SlewFrames(delta, Rate, velocity=0.0):
+  """Return the number of frames that a jump of 'delta' steps would take, with a peak velocity of 'Rate'
+     steps/second, starting at 'velocity' steps/frame, without changing any state. Uses the same profile
+     planning as a real jump, so it's exact, including the final frame that sends any steps left over.
+  """
+  add_vel, max_vel = RampRates(Rate)
+  segments, left = JumpProfile(ToSubsteps(delta), ToSubsteps(velocity), add_vel, max_vel)
+  frames = sum([n for n, v in segments])
+  if frames:
+    return frames + 1
+  elif left:
+    return 1      # Small enough to send in a single frame
+  return 0
+
+
+class SlewTimer(object):
+  """Fast, exact jump durations for many jumps from rest at the same peak velocity, for planning code that
+     needs thousands of them. The ramp up in JumpProfile() continues to the next velocity step only if there's
+     still room to stop in time, so the number of ramp steps for a jump depends only on the jump size, and the
+     thresholds can be calculated once, in advance. Gives the same answer as SlewFrames(delta, Rate).
+  """
+  def __init__(self, Rate):
+    self.Rate = Rate
+    self.add_vel, self.max_vel = RampRates(Rate)
+    self.add_vel = max(self.add_vel, 1)
+    self.thresholds = []    # Smallest jump (in sub-steps) that ramps up at least k+1 steps, for each k
+    self.velocities = [0]   # Velocity after k steps of the ramp up
+    self.moved = [0]        # Sub-steps moved after k steps of the ramp up
+    v, moved = 0, 0
+    while v < self.max_vel:
+      v = min(v + self.add_vel, self.max_vel)
+      self.thresholds.append(moved + v + StopDistance(v, self.add_vel))
+      moved += v
+      self.velocities.append(v)
+      self.moved.append(moved)
+
+  def frames(self, delta):
+    """Return the number of frames for a jump of 'delta' steps from rest.
+    """
+    togo = abs(ToSubsteps(delta))
+    k = bisect.bisect_right(self.thresholds, togo)    # Number of steps in the ramp up
+    v = self.velocities[k]
+    if v <= 0:
+      if togo:
+        return 1      # Small enough to send in a single frame
+      return 0
+    togo -= self.moved[k]
+    n = max((togo - StopDistance(v, self.add_vel)) // v, 0)     # Frames at the plateau velocity
+    return k + n + (v - 1) // self.add_vel + 1
+
+
 def KickStart():
-  """Start the motion control thread to keep the motor queue full.
+  """Create the main mount (using the controller given by prefs.ControllerDevice), and any extra mounts listed
+     in prefs.ExtraMounts, and start a motion control thread for each of them to keep the motor queues full.
   """
-  global intthread
+  global intthread, mount, motors, limits
   logger.info("Kickstarting motion control thread")
-  #Start the queue handler thread to keep the queue full
-  intthread = threading.Thread(target=RunQueue, name='USB-controller-thread')
-  intthread.daemon = True
-  intthread.start()
+  mount = Mount(name='main', device=prefs.ControllerDevice)
+  mount.KickStart()
+  motors, limits = mount.motors, mount.limits
+  intthread = mount.thread
+  for name, device in prefs.ExtraMounts:
+    AddMount(name, device=device)
+
+
+def AddMount(name, device=None):
+  """Create a new Mount object called 'name', for the controller given by 'device' (see Mount.__init__), add it to
+     the 'mounts' dictionary, and start its motion control thread. Returns the new Mount object.
+  """
+  if name in mounts:
+    raise ValueError("There is already a mount called '%s'" % name)
+  m = Mount(name=name, device=device)
+  m.KickStart()
+  return m
+
+
+class AxisCommand(object):
+  """Tracking rates for one axis, set by the detevent threads and read by the frame thread. Instances are
+     never modified once created - to change a rate, a new AxisCommand is created and the reference on the
+     Axis object replaced, so the frame thread always sees a consistent set of values.
+  """
+  def __init__(self, track=0.0, refraction=0.0):
+    self.track = track                # Non-sidereal tracking velocity for moving targets in steps/50ms
+    self.refraction = refraction      # Refraction and flexure correction velocity in steps/50ms
+    self.subtrack = ToSubsteps(track)             # The same velocities, in sub-steps/50ms
+    self.subrefraction = ToSubsteps(refraction)
+
+  def __repr__(self):
+    return "<AxisCommand: track=%f, refraction=%f>" % (self.track, self.refraction)
+
+
+class MotionCommand(object):
+  """A jump, offset or scan waiting in the MotorControl motion queue, to be started by the frame thread as
+     soon as the previous motion has finished.
+  """
+  def __init__(self, delRA=0.0, delDEC=0.0, Rate=0.0, force=False, offset=False, plans=None, scan=False):
+    self.delRA = delRA        # Offset in RA, in steps
+    self.delDEC = delDEC      # Offset in DEC, in steps
+    self.Rate = Rate          # Peak velocity in steps/second
+    self.force = force        # If True, ignore the safety interlock
+    self.offset = offset      # If True, this is a small offset that can be merged with the next one
+    self.plans = plans        # Optional (RA, DEC) profiles already calculated by PlanJump()
+    self.scan = scan          # If True, 'plans' are (RA, DEC) scan profiles, calculated by the scan module
+    self.queued = time.time()
+
+  def start(self, motors):
+    """Start this jump on both axes of the given MotorControl object.
+    """
+    if self.scan:
+      motors.RA.StartScan(*self.plans[0])
+      motors.DEC.StartScan(*self.plans[1])
+    elif self.plans is None:
+      motors.RA.StartJump(self.delRA, self.Rate)
+      motors.DEC.StartJump(self.delDEC, self.Rate)
+    else:
+      motors.RA.StartProfile(*self.plans[0])
+      motors.DEC.StartProfile(*self.plans[1])
+
+  def __repr__(self):
+    if self.scan:
+      return "<MotionCommand: scan of %d frames>" % sum([s[0] for s in self.plans[0][0]])
+    return "<MotionCommand: %s (%d, %d) at %d steps/sec>" % ({False:'jump', True:'offset'}[self.offset],
+                                                              self.delRA, self.delDEC, self.Rate)
 
 
 class Axis(object):
@@ -53,35 +299,49 @@ class Axis(object):
      interrupt handling thread when there is an empty spot in the input queue on
      the controller board, and that in turns calls CalcJump and CalcPaddle to
      do the velocity ramping for each type of motion.
+
+     Only the frame thread modifies the profile attributes (up, down, jump, etc) and the motion flags
+     (Jumping, Scanning, Paddling). Other threads start and stop motion with StartJump, StartPaddle and
+     StopPaddle, which post requests to self.requests, set tracking rates with SetTrack and SetRefraction,
+     and collect accumulated motion with ReadLogs. Motion that has been requested, but not yet started by
+     the frame thread, shows up in self.Pending, not in the motion flags.
   """
   def __init__(self, sidereal=0.0):
     """Set up empty attributes for a new axis record.
     """
-    self.sidereal = sidereal   # Sidereal rate for this axis (prefs.RAsid for RA, 0.0 for DEC)
-    self.up = 0                # number of 50ms ticks to ramp motor to max velocity for slew
-    self.down = 0              # number of 50ms ticks to ramp motor down after slew
-    self.plateau = 0           # number of 50ms ticks in the plateau of a slew
-    self.track = 0.0           # Current Non-Sidereal tracking velocity for moving targets in steps/50ms
-    self.add_vel = 0.0         # acceleration for slews in steps/50ms/50ms
-    self.max = 0.0             # Maximum velocity reached so far on ramp up, saved in case the jump is too short for a plateau
-    self.max_vel = 0.0         # plateau velocity in steps/50ms for current slew
-
-    self.jump = 0.0            # Current slew velocity in steps/50ms, calculated by self.CalcJump or self.CalcPaddle for each tick
-    self.remain = 0.0          # remainder after calculating ramp profile - used in telescope jump
+    self.sidereal = sidereal   # Sidereal rate for this axis in steps/50ms (prefs.RAsid for RA, 0.0 for DEC)
+    self.subsidereal = ToSubsteps(sidereal)   # Sidereal rate for this axis in sub-steps/50ms
+    self.up = 0                # number of 50ms ticks to ramp motor to max velocity for paddle motion
+    self.down = 0              # number of 50ms ticks to ramp motor down after paddle motion
+    self.add_vel = 0           # acceleration for paddle motion in sub-steps/50ms/50ms
+    self.max_vel = 0           # plateau velocity in sub-steps/50ms for current slew or paddle motion
+    self.profile = collections.deque()   # [frames, velocity] (or [frames, velocity, line] for a scan) segments left in the current slew, velocity in sub-steps/50ms
+
+    self.jump = 0              # Current slew velocity in sub-steps/50ms, calculated by self.CalcJump or self.CalcPaddle for each tick
+    self.remain = 0            # remainder after calculating ramp profile - used in telescope jump
+    self.togo = 0              # Sub-steps left to move in the current jump, sent on the last frame to make the total exact
     self.finish = True         # False if a jump (not paddle motion) is in progress for this axis
     self.Paddle_start = False  # True if hand-paddle motion for this axis is ramping up or or reached plateau velocity (button pressed)
     self.Paddle_stop = False   # True if hand-paddle motion for this axis is ramping down (button just released)
-    self.scl = 0               # How many ticks we have been decelerating for on the ramp down from a slew in this axis
-    self.refraction = 0.0      # Non sidereal trackrate used to correct for atmospheric refraction and telescope flexure - steps/50m
-    self.padlog = 0.0          # Accumulated motion from hand paddle movement
-    self.reflog = 0            # Accumulated motion from refraction tracking
-    self.guidelog = 0          # Accumulated motion from autoguider since the last time detevent.currentUpdatePosition read and cleared this variable
+    self.command = AxisCommand()   # Current tracking and refraction rates, replaced (never modified) by SetTrack/SetRefraction
+    self.requests = collections.deque()   # Motion requests posted by other threads, applied by the frame thread
+    self._padtotal = 0         # Total motion (in sub-steps) from hand paddle movement and non-sidereal tracking, since startup
+    self._reftotal = 0         # Total motion (in sub-steps) from refraction tracking, since startup
+    self._guidetotal = 0       # Total motion (in sub-steps) from the autoguider, since startup
+    self._refepoch = 0         # Incremented each time the refraction log is discarded at the end of a move
+    self._refmark = 0          # Value of self._reftotal when the refraction log was last discarded
+    self.logs = (0, 0, 0, 0, 0)       # Published (padtotal, reftotal, guidetotal, refepoch, refmark), replaced every frame
+    self._consumed = (0, 0, 0, 0, 0)  # The value of self.logs the last time ReadLogs was called
     self._guidersteps_last = 0  # Previous value for the accumulated guider steps value in Driver.counters for this axis.
     self.hold = 0              # These are used to delay a velocity value by 50ms (so we can insert a zero velocity frame)
-    self.frac = 0.0            # These store the accumulated fractional ticks, left over from previous frames
+    self.frac = 0              # Accumulated sub-steps left over from previous frames, always within half a step of zero
     self.Jumping = False       # True if a pre-calculated slew is in progress for this axis.
+    self.Scanning = False      # True if the pre-calculated slew in progress is a scan, logged as paddle motion
+    self.line = 0              # Scan line ID for the current frame, or 0 if not on a scan line
     self.Paddling = False      # True if hand-paddle motion is in progress for this axis
-    self.lock = threading.RLock()
+    self.Stopping = False      # True if an emergency stop is in progress (or finished) because of a hardware limit
+    self.velocity = 0          # Velocity sent in the last frame, in sub-steps/50ms (before rounding to whole steps)
+    self.lock = TimedLock(name='Axis')   # Only taken by writers and readers in other threads, never by the frame thread
 
   def __repr__(self):
     mesg = "  <Axis: Sidereal=%f\n" % self.sidereal
@@ -95,10 +355,14 @@ class Axis(object):
         flags.append("Paddling")
     if self.Jumping:
       flags.append("Jumping")
+    if self.Scanning:
+      flags.append("Scanning:%d" % self.line)
+    if self.Stopping:
+      flags.append("Stopping")
     if not self.finish:
       flags.append("Jump not finished")
     mesg += "    Flags: [%s]\n" % (', '.join(flags))
-    mesg += "    up/down/plateau = %d/%d/%d" % (self.up, self.down, self.plateau)
+    mesg += "    up/down = %d/%d, jump frames left = %d" % (self.up, self.down, sum([s[0] for s in self.profile]))
     mesg += '  >\n'
 
     return mesg
@@ -109,15 +373,142 @@ class Axis(object):
     """
     d = self.__dict__.copy()
     del d['lock']
+    del d['requests']
+    d['profile'] = list(d['profile'])
     return d
 
+  @property
+  def Pending(self):
+    """True if there are motion requests posted by other threads that the frame thread hasn't applied yet.
+    """
+    return bool(self.requests)
+
+  @property
+  def track(self):
+    return self.command.track
+
+  @property
+  def refraction(self):
+    return self.command.refraction
+
+  @property
+  def padlog(self):
+    """Accumulated motion in steps from hand paddle movement and non-sidereal tracking, not yet read by ReadLogs.
+    """
+    return (self.logs[0] - self._consumed[0]) / float(SUBSTEPS)
+
+  @property
+  def reflog(self):
+    """Accumulated motion in steps from refraction tracking, not yet read by ReadLogs.
+    """
+    if self.logs[3] != self._consumed[3]:
+      return (self.logs[1] - self.logs[4]) / float(SUBSTEPS)
+    return (self.logs[1] - self._consumed[1]) / float(SUBSTEPS)
+
+  @property
+  def guidelog(self):
+    """Accumulated motion in steps from the autoguider, not yet read by ReadLogs.
+    """
+    return (self.logs[2] - self._consumed[2]) / float(SUBSTEPS)
+
+  def SetTrack(self, track):
+    """Set the non-sidereal tracking rate for this axis, in steps/50ms. Called by the detevent threads.
+    """
+    with self.lock:
+      self.command = AxisCommand(track=track, refraction=self.command.refraction)
+
+  def SetRefraction(self, refraction):
+    """Set the refraction and flexure correction rate for this axis, in steps/50ms. Called by the detevent threads.
+    """
+    with self.lock:
+      self.command = AxisCommand(track=self.command.track, refraction=refraction)
+
+  def ReadLogs(self):
+    """Return the paddle, refraction and guider motion accumulated since the last call, as a tuple of
+       integers (padlog, reflog, guidelog), in sub-steps. Called by detevent.CurrentPosition.UpdatePosition.
+
+       The frame thread publishes a single tuple of running totals each frame, so this never needs
+       to wait for the frame thread, and no motion is ever lost between a read and a reset.
+    """
+    with self.lock:
+      logs = self.logs
+      last = self._consumed
+      padlog = logs[0] - last[0]
+      if logs[3] != last[3]:      # The refraction log was discarded since the last read
+        reflog = logs[1] - logs[4]
+      else:
+        reflog = logs[1] - last[1]
+      guidelog = logs[2] - last[2]
+      self._consumed = logs
+    return padlog, reflog, guidelog
+
+  def _publish(self):
+    """Called by the frame thread to publish the current log totals for ReadLogs.
+    """
+    self.logs = (self._padtotal, self._reftotal, self._guidetotal, self._refepoch, self._refmark)
+
+  def DiscardRefLog(self):
+    """Throw away any refraction motion not yet read by ReadLogs. Called by the frame thread when a move
+       finishes, because the destination coordinates already include refraction.
+    """
+    self._refepoch += 1
+    self._refmark = self._reftotal
+    self._publish()
+
+  def AddCorrection(self, steps):
+    """Add motion (in steps) that the telescope made, but that wasn't commanded (or subtract commanded
+       motion that didn't happen), to the paddle log. Called by the frame thread.
+    """
+    self._padtotal += steps * SUBSTEPS
+    self._publish()
+
+  def AddGuide(self, steps):
+    """Add autoguider motion to the guide log. Called by the frame thread when new counters arrive.
+    """
+    self._guidetotal += steps * SUBSTEPS
+    self._publish()
+
+  def _apply_requests(self):
+    """Apply any motion requests posted by other threads since the last frame. Called by the frame thread.
+    """
+    while self.requests:
+      action, args = self.requests.popleft()
+      if action == 'jump':
+        self.jump = 0
+        self._startprofile(*args)
+      elif action == 'scan':
+        segments, delta, max_vel = args
+        self.jump = 0
+        self._startprofile(segments, 0, delta, max_vel)
+        self.Scanning = self.Jumping
+      elif action == 'retarget':
+        delta, add_vel, max_vel = args
+        if self.Jumping and (self.profile or self.togo):
+          velocity = self.jump
+          delta += self.togo                # Steps still to go in the current jump
+        else:
+          velocity = self.jump = 0
+        segments, left = JumpProfile(delta, velocity, add_vel, max_vel)
+        self._startprofile(segments, left, delta, max_vel)
+      elif action == 'hold':
+        self.hold += args
+      elif action == 'paddle':
+        self.up, self.max_vel, self.add_vel = args
+        self.down = 0
+        self.Paddle_start = True
+        self.Paddle_stop = False
+        self.Paddling = True
+      elif action == 'stop':
+        self.Paddle_start = False
+        self.Paddle_stop = True
+
   def CalcPaddle(self):
     """The paddle code in the 'Determine Event' loop communicates with the motor control object by
        calling StartPaddle and StopPaddle. These functions in turn set the motor control attributes:
           self.up, self.down                     #ramp up/down time in ticks
           Paddle_start, Paddle_stop              #Booleans
-          self.max_vel                           #plateau velocity in steps/tick
-          self.add_vel                           #ramp accel/decel in steps/tick/tick
+          self.max_vel                           #plateau velocity in sub-steps/tick
+          self.add_vel                           #ramp accel/decel in sub-steps/tick/tick
        This function, called once per tick as the motion control values are calculated, uses the
        above flags to calculate the current velocity components for this tick due to a hand-paddle slew,
        stored in self.jump.
@@ -125,59 +516,56 @@ class Axis(object):
        Note that the 'jump' attribute (self.jump) are used for profiled 'jumps' as
        well as hand-paddle motion, so these actions can not be carried out simultaneously.
     """
-    with self.lock:
-      if self.Paddle_start:               # if RA Button pressed
-        if self.up > 0:                   # if still accelerating
-          self.jump += self.add_vel       # Increase current velocity
-          self.up -= 1                    # Count down to the end of the acceleration time
-          self.down += 1                  # Keep track of how many ticks we've accelerated for
-        else:
-          self.jump = self.max_vel        # Reached max velocity, continue till paddle button released
+    if self.Paddle_start:               # if RA Button pressed
+      if self.up > 0:                   # if still accelerating
+        self.jump += self.add_vel       # Increase current velocity
+        self.up -= 1                    # Count down to the end of the acceleration time
+        self.down += 1                  # Keep track of how many ticks we've accelerated for
+      else:
+        self.jump = self.max_vel        # Reached max velocity, continue till paddle button released
 
-      if self.Paddle_stop:                # if RA Button has just been released
-        if self.down > 0:                 # if still decelerating
-          self.jump -= self.add_vel       # Decrease current velocity
-          self.down -= 1                  # Count down to the end of the deceleration time
-        else:
-          self.jump = 0.0                 # Set velocity to zero
-          self.Paddle_stop = False        # Flag that we have finished decelerating
-          self.Paddle_start = False       # Flag that we aren't accelerating either
-          self.Paddling = False
+    if self.Paddle_stop:                # if RA Button has just been released
+      if self.down > 0:                 # if still decelerating
+        self.jump -= self.add_vel       # Decrease current velocity
+        self.down -= 1                  # Count down to the end of the deceleration time
+      else:
+        self.jump = 0                   # Set velocity to zero
+        self.Paddle_stop = False        # Flag that we have finished decelerating
+        self.Paddle_start = False       # Flag that we aren't accelerating either
+        self.Paddling = False
 
   def CalcJump(self):
     """A telescope slew is initiated by a call to MotorControl.Jump, with parameters delRA, delDEC, and Rate.
-       That function sets up the actual motion by changing the motor control attributes:
-          self.up, self.down       #ramp up/down time in ticks
-          self.plateau             #time in ticks to stay at max velocity
-          self.max_vel             #plateau velocity in steps/tick
-          self.add_vel             #ramp accel/decel in steps/tick/tick
+       That function sets up the actual motion by calling StartJump (or Retarget) on each axis, which
+       sets the motor control attributes:
+          self.profile             #list of [frames, velocity] segments, velocities in sub-steps/tick
           self.remain              #Used to spread out 'leftover' slew pulses over entire slew duration
-          self.Jumping             #Set to True to start slew
-       This function, called once per tick as the motion control values are calculated, uses those
-       parameters to calculate the current self.jump velocity for each tick.
+          self.togo                #Sub-steps left to move in the jump
+          self.Jumping             #Set to True by the frame thread when it starts the slew
+       This function, called once per tick as the motion control values are calculated, takes the
+       next velocity from the profile and stores it in self.jump.
 
        Note that the AXIS.jump attributes are used for profiled 'jumps' as
        well as hand-paddle motion, so these actions can not be carried out simultaneously.
     """
-    with self.lock:
-      if self.up > 0:                  # If we are ramping up
-        self.jump += self.add_vel   # Increase current velocity
-        self.max = self.jump        # Save maximum velocity so far, in case slew is too short to have plateau
-        self.up -= 1                   # Count down to the end of the acceleration time
-      else:
-        if self.plateau > 0:           # If we've reached the plateau phase
-          self.jump = self.max_vel  # Reached plateau, set constant velocity
-          self.plateau -= 1            # Count down to the end of the plateau time
-        else:                            # Not ramping up or plateauing
-          if self.down > 0:            # if ramping down
-            self.jump = self.max - (self.scl * self.add_vel)    # decrease velocity
-            self.down -= 1             # count down to the end of the deceleration time
-            self.scl += 1              # count the number of ticks we've been decelerating for
-          else:                          # Finished jump in this axis
-            self.jump = 0.0            # Set jump velocity to zero
-            self.remain = 0            # Disable 'fudge velocity' used to store remainder of steps from profile during jump
-            self.scl = 0               # Clear deceleration counter
-            self.Jumping = False       # Flag end of jump in this axis
+    if self.profile:                 # If there are any frames left in the profile
+      segment = self.profile[0]
+      self.jump = segment[1]         # Velocity for this segment
+      if len(segment) > 2:
+        self.line = segment[2]       # Scan line ID for this segment
+      segment[0] -= 1                # Count down to the end of this segment
+      if segment[0] <= 0:
+        self.profile.popleft()
+    else:                            # Finished jump in this axis
+      self.jump = 0              # Set jump velocity to zero
+      self.remain = 0            # Disable 'fudge velocity' used to store remainder of steps from profile during jump
+      self.hold += self.togo     # Send the last few sub-steps left over from the profile, so the total is exact
+      self.togo = 0
+      self.line = 0
+      self.Jumping = False       # Flag end of jump in this axis
+      self.Scanning = False
+    if self.Jumping:
+      self.togo -= self.jump + self.remain
 
   def StartJump(self, delta, Rate):
     """This procedure calculates the profile parameters and starts a telescope jump
@@ -186,95 +574,74 @@ class Axis(object):
        Inputs are delta, the (signed) offset in steps, and
        'Rate', the peak velocity in steps/second. Returns None.
 
-       Outputs are the following attributes:
-          self.up, self.down       # ramp up/down time in ticks
-          self.plateau             # time in ticks to stay at max velocity
-          self.max_vel             # plateau velocity in steps/tick
-          self.add_vel             # ramp accell/decell in steps/tick/tick
-          self.remain              # Used to spread out 'leftover' slew pulses over entire slew duration
-          self.Jumping             # Set to True to start slew
-
-       A jump has three components: the ramp up, the plateau and the ramp
-       down. The size of the jump, the acceleration  and the maximum velocity
-       determine the values for the three jump component. Components are described in terms
-       of the number of pulses(interupts) and the number of motor steps per pulse.
+       The profile is calculated by JumpProfile() in the calling thread and posted to self.requests,
+       to be picked up by the frame thread at the start of the next frame. Jumps too small to need a
+       profile are added to self.hold instead, and sent in a single frame.
 
-       All parameters output from this procedure are in motor steps/time pulse.
+       The jump moves exactly 'delta' steps, to the nearest sub-step.
     """
     if Rate <= 0:
       logger.error('StartJump called with zero or negative Rate')
       return True
-    with self.lock:
-      #calculate max_vel.
-      max_vel = abs(Rate) * PULSE            # unsigned value steps/pulse
-
-      # number of time pulses in the ramp up.
-      ramp_time = abs(float(Rate)) / MOTOR_ACCEL     # MOTOR_ACCEL is in steps/sec/sec
-      num_pulses = math.trunc(ramp_time / PULSE)
-
-      if num_pulses > 0:
-        # speed increment per time pulse in motor steps/pulse:
-        add_to_vel = max_vel / num_pulses
-        # The number of motor steps in a ramp:
-        num_ramp_steps = add_to_vel * ((num_pulses * num_pulses / 2.0) + (num_pulses / 2.0))
-      else:
-        add_to_vel = max_vel
-        num_ramp_steps = 0
-
-      # Account for the direction of the jump.
-      if delta < 0:
-        self.add_vel = -add_to_vel
-        self.max_vel = -max_vel
-        sign = -1.0
-      else:
-        self.add_vel = add_to_vel
-        self.max_vel = max_vel
-        sign = 1.0
-
-      # Calculate the ramp and plateau values.
-      if delta == 0.0:
-        # no jump
-        self.up = 0
-        self.down = 0
-        self.plateau = 0
-        self.remain = 0
-        self.Jumping = False
-      elif abs(delta) < (2.0 * abs(self.add_vel)):
-        # Small jump - add delta to self.hold.
-        self.up = 0
-        self.down = 0
-        self.plateau = 0
-        self.remain = 0
-        self.Jumping = False
-        self.hold += delta
-      elif abs(delta) > (2.0 * num_ramp_steps):
-        # Jump is large enough to reach max velocity - has a Plateau
-        self.up = num_pulses
-        self.down = num_pulses
-        steps_plateau = delta - (2.0 * num_ramp_steps * sign)
-        pulses_plateau = steps_plateau / self.max_vel
-        self.plateau = math.trunc(pulses_plateau)      # number of pulses in the plateau
-        sum_of_pulses = (self.up * 2) + self.plateau
-        self.remain = (steps_plateau - (self.plateau * self.max_vel)) / sum_of_pulses
-        self.Jumping = True
-      else:
-        # Jump is to short to reach max velocity - no plateau
-        ramp_pulses_part = 0
-        num_steps_hold = abs(delta)
-        while True:
-          steps_used = 2.0 * add_to_vel * (ramp_pulses_part + 1)
-          num_steps_hold -= steps_used
-          if num_steps_hold < 0.0:
-            num_steps_hold += steps_used
-            break
-          else:
-            ramp_pulses_part += 1
-        self.up = ramp_pulses_part
-        self.down = ramp_pulses_part
-        self.plateau = 0
-        sum_of_pulses = self.up * 2
-        self.remain = (num_steps_hold * sign) / sum_of_pulses
-        self.Jumping = True
+    self.StartProfile(*PlanJump(delta, Rate))
+
+  def StartProfile(self, segments, left, delta, max_vel):
+    """Start a jump using a profile already planned by PlanJump(). The arguments are the
+       profile segments, the sub-steps left over, the total size of the jump in sub-steps
+       and the peak velocity in sub-steps/frame.
+    """
+    if delta == 0:
+      # no jump
+      return
+    if not segments:
+      # Small jump - add delta to self.hold.
+      self.requests.append(('hold', delta))
+    else:
+      self.requests.append(('jump', (segments, left, delta, max_vel)))
+
+  def StartScan(self, segments, delta, max_vel):
+    """Start a scan, using a profile calculated by the scan module. The arguments are the profile
+       segments, as (frames, velocity, line) tuples, the total motion in sub-steps (zero, if the
+       scan finishes where it started), and the peak velocity in sub-steps/frame.
+
+       Unlike a jump, the motion in a scan is added to the paddle log as it happens, so the current
+       position follows the telescope across the scan.
+    """
+    if not segments:
+      return
+    self.requests.append(('scan', (segments, delta, max_vel)))
+
+  def Retarget(self, delta, Rate):
+    """Change the destination of the jump in progress on this axis by 'delta' steps, with a new peak
+       velocity of 'Rate' steps/second. The new profile is planned by the frame thread at the start of
+       the next frame, starting from the current velocity and the steps still to go in the old profile,
+       so the handover never exceeds the ramp acceleration. If the axis isn't jumping when the request
+       is picked up, this is the same as StartJump.
+    """
+    if Rate <= 0:
+      logger.error('Retarget called with zero or negative Rate')
+      return True
+    add_vel, max_vel = RampRates(Rate)
+    self.requests.append(('retarget', (ToSubsteps(delta), add_vel, max_vel)))
+
+  def _startprofile(self, segments, left, delta, max_vel):
+    """Start a new jump profile. Called by the frame thread.
+    """
+    frames = sum([s[0] for s in segments])
+    if frames == 0:
+      self.hold += delta
+      self.profile = collections.deque()
+      self.togo = 0
+      self.remain = 0
+      self.Jumping = False
+      return
+    self.profile = collections.deque([list(s) for s in segments])
+    self.remain = abs(left) // frames
+    if left < 0:
+      self.remain = -self.remain
+    self.togo = delta
+    self.max_vel = max_vel
+    self.Jumping = True
 
   def StartPaddle(self, Rate):
     """
@@ -288,37 +655,31 @@ class Axis(object):
         self.up, self.down                     #ramp up/down time in ticks
         self.Paddle_start                      #True when button pressed - indicates ramp up or plateau
         self.Paddle_stop                       #True when button just released, indicates ramp down in progress
-        self.max_vel                           #plateau velocity in steps/tick
-        self.add_vel                           #ramp accel/decel in steps/tick/tick
-        self.Paddling                          #True if the telescope is performing hand-paddle motion in this axis
+        self.max_vel                           #plateau velocity in sub-steps/tick
+        self.add_vel                           #ramp accel/decel in sub-steps/tick/tick
     """
-    with self.lock:
-      #Test to see if the telescope is moving in this axis
-      if self.Paddling or self.Jumping:
-        logger.debug('motion.Axis.StartPaddle called when this axis is already in motion.')
-        return False
-
-      # number of pulses in ramp_up
-      ramp_time = abs(float(Rate)) / MOTOR_ACCEL
-      num_pulses = math.trunc(ramp_time / PULSE)
-      # maximum velocity in motor steps per pulse
-      max_vel = Rate * PULSE
-
-      # Increment velocity ramp by add_to_vel -  also error trap for num_pulses=0
-      if num_pulses > 0:
-        add_to_vel = max_vel / num_pulses
-      else:
-        add_to_vel = 0
+    #Test to see if the telescope is moving in this axis, or about to
+    if self.Paddling or self.Jumping or self.Pending:
+      logger.debug('motion.Axis.StartPaddle called when this axis is already in motion.')
+      return False
+
+    # number of pulses in ramp_up
+    ramp_time = abs(float(Rate)) / MOTOR_ACCEL
+    num_pulses = math.trunc(ramp_time / PULSE)
+    # maximum velocity in motor sub-steps per pulse
+    max_vel = ToSubsteps(Rate * PULSE)
+
+    # Increment velocity ramp by add_to_vel -  also error trap for num_pulses=0
+    if num_pulses > 0:
+      add_to_vel = abs(max_vel) // num_pulses
+      if max_vel < 0:
+        add_to_vel = -add_to_vel
+    else:
+      add_to_vel = 0
 
-      #Set motion values for the motor
-      self.up = num_pulses
-      self.down = 0
-      self.Paddle_start = True
-      self.Paddle_stop = False
-      self.max_vel = max_vel
-      self.add_vel = add_to_vel
-      self.Paddling = True               # signal telescope in motion in this axis
-      return True
+    #Post motion values for the motor to the frame thread, which sets self.Paddling when it starts the motion
+    self.requests.append(('paddle', (num_pulses, max_vel, add_to_vel)))
+    return True
 
   def StopPaddle(self):
     """
@@ -329,60 +690,183 @@ class Axis(object):
         self.Paddle_start                      # True when button pressed - indicates ramp up or plateau
         self.Paddle_stop                       # True when button just released, indicates ramp down in progress
     """
-    with self.lock:
+    self.requests.append(('stop', None))
+
+  def WarmRestart(self, dropped=0, reissue=True):
+    """Called by RunQueue after the controller has stopped, before it's restarted. There is no frame
+       thread running at this point, so the profile attributes can be changed directly.
+
+       'dropped' is the number of steps that were queued for this axis but never moved, because of the
+       shutdown. Any jump in progress is abandoned, and the steps remaining in it (plus the dropped steps)
+       are re-issued as a new jump starting from rest. Hand paddle motion is stopped. If 'reissue' is
+       False (eg, after hitting a hardware limit), the motion is not re-issued, and the dropped steps are
+       subtracted from the paddle log instead so that the current position stays correct. A scan in
+       progress is always abandoned, not re-issued, because its motion is logged as paddle motion.
+
+       Returns the number of steps re-issued (or logged).
+    """
+    self._apply_requests()
+    delta = dropped * SUBSTEPS
+    Rate = prefs.SlewRate
+    scanning = self.Scanning
+    if self.Jumping:
+      Rate = abs(self.max_vel) / float(SUBSTEPS) / PULSE
+      if not scanning:
+        delta += self.togo        # The number of sub-steps left in the jump
+      self.profile.clear()
+      self.togo = 0
+      self.line = 0
+      self.Jumping = False
+      self.Scanning = False
+    if self.Paddling:
+      self.up = self.down = 0
       self.Paddle_start = False
-      self.Paddle_stop = True
+      self.Paddle_stop = False
+      self.Paddling = False
+    self.jump = 0
+    self.remain = 0
+    self._guidersteps_last = 0    # The controller counters are reset when the exception is cleared
 
-  def getframe(self, Frozen=None, CutFrac=None):
+    if reissue and not scanning:
+      self.StartJump(delta / float(SUBSTEPS), Rate)
+    else:
+      self._padtotal -= delta
+      self._publish()
+    return delta / float(SUBSTEPS)
+
+  def CatchUp(self, frames, move=True):
+    """Called by the frame thread in the first frame after a warm restart, with the number of frames of tracking
+       that were missed while the controller was stopped (negative if the motion re-issued by WarmRestart covers
+       more frames than that). If 'move' is True, the sidereal, non-sidereal and refraction motion for those
+       frames is made up with a jump, added to any re-issued jump still waiting in self.requests, and the
+       non-sidereal and refraction motion is logged as usual. If 'move' is False (after a hardware limit, or if
+       the telescope is Frozen), the telescope isn't moved, and the sidereal motion is logged as backwards paddle
+       motion instead, so the current position stays correct.
+
+       Returns the number of steps made up (or logged).
+    """
+    command = self.command
+    if move:
+      delta = frames * (self.subsidereal + command.subtrack + command.subrefraction)
+      self._padtotal += frames * command.subtrack
+      self._reftotal += frames * command.subrefraction
+      if delta:
+        add_vel, max_vel = RampRates(prefs.SlewRate)
+        self.requests.append(('retarget', (delta, add_vel, max_vel)))
+    else:
+      delta = -frames * self.subsidereal
+      self._padtotal += delta
+    self._publish()
+    return delta / float(SUBSTEPS)
+
+  def AbandonMotion(self):
+    """Throw away any jump, scan or hand paddle motion in progress, and any held offsets. Jumps and held
+       offsets have already been added to the current position, so the motion that won't now happen is
+       subtracted from the paddle log. Scan and paddle motion is only logged as it happens, so nothing needs
+       to be corrected for those. Returns the number of sub-steps subtracted. Called by the frame thread.
+    """
+    lost = self.hold
+    if self.Jumping and not self.Scanning:
+      lost += self.togo             # The number of sub-steps left in the jump
+    self._padtotal -= lost
+    self.profile.clear()
+    self.togo = 0
+    self.hold = 0
+    self.line = 0
+    self.Jumping = False
+    self.Scanning = False
+    self.up = self.down = 0
+    self.Paddle_start = False
+    self.Paddle_stop = False
+    self.Paddling = False
+    self.jump = 0
+    self.remain = 0
+    return lost
+
+  def getframe(self, Frozen=None, Stop=None):
     """Called by the controller thread when new data needs to be calculated to send to the
        controller queue for this axis.
 
-       Returns the number of steps to travel in the next 50ms frame.
-    """
-    with self.lock:
+       Returns the (integer) number of steps to travel in the next 50ms frame. All the velocities are
+       added up in sub-steps, and whatever is left over after rounding to the nearest whole step is
+       carried into the next frame in self.frac.
+
+       If 'Stop' is given, it's the deceleration (in sub-steps/frame/frame) for an emergency stop, because a
+       hardware limit is active. Any motion in progress is abandoned, and the axis slows down from the
+       velocity in the last frame by 'Stop' every frame (the shortest stop the controller allows), then
+       stays at rest until getframe is called without 'Stop'. The motion in each stop frame relative to
+       the sky is added to the paddle log, so the current position stays exact.
 
-      # MIX VELOCITIES for next pulse - sidereal rate, motion profile velocities, non-sidereal and refraction tracking
-      # Start with sidereal rate, or zero if frozen
-      if Frozen:
-        send = 0.0                      # No sidereal motion, but:
-        self.padlog -= self.sidereal    # Log fictitious backwards paddle motion instead of sidereal tracking (changes current sky coordinates)
+       This method never blocks - any motion requests posted by other threads are applied
+       first, then the log totals are published at the end for ReadLogs.
+    """
+    self._apply_requests()
+    if Stop:
+      if not self.Stopping:
+        self.Stopping = True
+        lost = self.AbandonMotion()
+        logger.info('motion.Axis.getframe: emergency stop from %d steps/frame, %d steps of motion abandoned.' % (
+                    self.velocity // SUBSTEPS, lost // SUBSTEPS))
       else:
-        send = self.sidereal            # Start with sidereal rate in RA
-
-      # Add in telescope jump or paddle motion velocities
-      if self.Jumping:      # If currently moving in a profiled (ramp-up/plateau/ramp-down) jump
-        self.CalcJump()      # Use jump profile attributes to calculate RA_jump and DEC_jump for this tick
-        send += self.jump + self.remain
-      elif self.Paddling:                  # We aren't in a profiled jump
-        self.CalcPaddle()            # Use paddle move profile attributes to calculate RA_jump and DEC_jump for this tick, if any
-        send += self.jump
-        self.padlog += self.jump     # Log jump motion as paddle movement
+        self.AbandonMotion()        # In case any new motion was started since the last frame
+      if self.velocity > 0:
+        send = max(self.velocity - Stop, 0)
       else:
-        # If we're not slewing and not Frozen, add refraction motion, autoguider motion and non-sidereal tracking, for this tick
-        if not Frozen:
-          send += self.refraction         # Add in refraction correction velocity
-          self.reflog += self.refraction     # Log refraction correction motion
-          send += self.track            # Add in non-sidereal motion for moving targets
-          self.padlog += self.track     # Log non-sidereal motion as paddle movement
-
-      #Add any 'held' values for this axis, containing small offsets that can bypass the ramp calculations
-      if self.hold != 0:
-        send += self.hold
-        self.hold = 0
+        send = min(self.velocity + Stop, 0)
+      self._padtotal += send - self.subsidereal     # Sidereal tracking has stopped too
+    else:
+      self.Stopping = False
+      send = self._mix(Frozen=Frozen)
+    self.velocity = send
+
+    #Round the final velocity for this tick (plus the leftover from previous frames) to the nearest whole step
+    send += self.frac
+    int_send = (send + SUBSTEPS // 2) // SUBSTEPS
+    self.frac = send - int_send * SUBSTEPS      # Keep the leftover sub-steps for the next frame
+
+    self._publish()
+    # Now send it to the controller queue!
+    return int_send
+
+  def _mix(self, Frozen=None):
+    """Add up the sidereal rate, motion profile velocities, tracking rates and held offsets for the next frame,
+       logging each of them, and return the total velocity in sub-steps. Called by the frame thread.
+    """
+    command = self.command       # Take a single reference to the current tracking rates for this frame
 
-      self.padlog -= send * (CutFrac / 100.0)   # Subtract the cut portion of motion  this frame from the paddle log
-      send *= (1 - (CutFrac / 100.0))
+    # MIX VELOCITIES for next pulse - sidereal rate, motion profile velocities, non-sidereal and refraction tracking
+    # Start with sidereal rate, or zero if frozen
+    if Frozen:
+      send = 0                        # No sidereal motion, but:
+      self._padtotal -= self.subsidereal    # Log fictitious backwards paddle motion instead of sidereal tracking (changes current sky coordinates)
+    else:
+      send = self.subsidereal         # Start with sidereal rate in RA
+
+    # Add in telescope jump or paddle motion velocities
+    if self.Jumping:      # If currently moving in a profiled (ramp-up/plateau/ramp-down) jump
+      scanning = self.Scanning
+      self.CalcJump()      # Use jump profile attributes to calculate RA_jump and DEC_jump for this tick
+      send += self.jump + self.remain
+      if scanning:
+        self._padtotal += self.jump + self.remain     # Log scan motion as paddle movement
+    elif self.Paddling:                  # We aren't in a profiled jump
+      self.CalcPaddle()            # Use paddle move profile attributes to calculate RA_jump and DEC_jump for this tick, if any
+      send += self.jump
+      self._padtotal += self.jump     # Log jump motion as paddle movement
+    else:
+      # If we're not slewing and not Frozen, add refraction motion, autoguider motion and non-sidereal tracking, for this tick
+      if not Frozen:
+        send += command.subrefraction         # Add in refraction correction velocity
+        self._reftotal += command.subrefraction     # Log refraction correction motion
+        send += command.subtrack            # Add in non-sidereal motion for moving targets
+        self._padtotal += command.subtrack     # Log non-sidereal motion as paddle movement
 
-      #Break final velocity for this tick into integer & fraction
-      fracpart, int_send = math.modf(send)
-      self.frac += fracpart    # Accumulate the fractional part
-      # if the absolute value of the accumulated self.frac is greater than 1.0, update int_send
-      if abs(self.frac) > 1.0:
-        int_send += math.trunc(self.frac)
-        self.frac -= math.trunc(self.frac)
+    #Add any 'held' values for this axis, containing small offsets that can bypass the ramp calculations
+    if self.hold != 0:
+      send += self.hold
+      self.hold = 0
 
-      # Now send it to the controller queue!
-      return int_send
+    return send
 
 
 class MotorControl(object):
@@ -393,19 +877,28 @@ class MotorControl(object):
   def __init__(self, limits=None):
     logger.debug('motion.MotorControl.__init__: Initializing Global variables')
     self.Jumping = False        # True if a 'Jump' (precalculated slew) is in progress for either axis
+    self.Scanning = False       # True if the precalculated slew in progress is a scan
+    self.scanline = 0           # Scan line ID of the last frame calculated, or 0 if not on a scan line
     self.Paddling = False       # True if hand-paddle movement is in progress for either axis
-    self.Moving = False         # True if the telescope is moving (other than sidereal, non-sidereal offset, flexure and refraction tracking)
+    self.Moving = False         # True if the telescope is moving (other than sidereal, non-sidereal offset, flexure and refraction tracking), or motion is queued
     self.PosDirty = False       # Set to True when a move (jump or paddle) finishes, to indicate move has finished. Reset to False by detevent.
     self.ticks = 0              # Counts time since startup in ms. Increased by 50 as each velocity value is calculated and sent to the queue.
     self.Frozen = False         # If set to true, sidereal and non-sidereal tracking disabled. Slew and hand paddle motion not affected
     self.RA = Axis(sidereal=prefs.RAsid)
     self.DEC = Axis()
     self.limits = limits
-    self.lock = threading.RLock()
+    self.lock = TimedLock(name='MotorControl')
     self.Driver = None
-    self.CutFrac = 0            # Fraction of steps to throw away during emergency stop - 0 (none) to 100 (100%)
+    self.Stopping = False       # True if an emergency stop is in progress (or finished) because of a hardware limit
+    self.stopdistance = (0, 0)  # Distance in steps (RA, DEC) needed to stop, at the start of the last emergency stop
+    self.stoptime = None        # Time that the last emergency stop started
     self.Autoguiding = False    # True if the autoguider has been enabled
     self._guidelogfile = None       # File to log guide motion to
+    self.queue = collections.deque()   # MotionCommand objects waiting for the current motion to finish
+    self.queuestats = {'queued':0, 'started':0, 'merged':0, 'dropped':0, 'maxdepth':0, 'waited':0.0, 'maxwait':0.0}
+    self.lost = (0, 0)          # Total steps lost (negative) or gained in each axis, found by comparing the counters with the frame log
+    self.steperror = (0, 0)     # Lost or gained steps that haven't been corrected in the current position
+    self.restart = None         # (stop time, frames re-issued, motion re-issued) from WarmRestart, until the first new frame
     logger.debug('motion.MotorControl.__init__: finished global vars')
 
   def __getstate__(self):
@@ -413,9 +906,11 @@ class MotorControl(object):
        not functions.
     """
     d = {}
-    for n in ['Jumping', 'Paddling', 'Moving', 'PosDirty', 'ticks', 'Frozen', 'Autoguiding']:
+    for n in ['Jumping', 'Scanning', 'scanline', 'Paddling', 'Moving', 'PosDirty', 'ticks', 'Frozen', 'Autoguiding',
+              'lost', 'steperror', 'Stopping', 'stopdistance', 'stoptime']:
       d[n] = self.__dict__[n]
     d['guidelog'] = (self.RA.guidelog, self.DEC.guidelog)
+    d['queuedepth'] = len(self.queue)
     return d
 
   def __repr__(self):
@@ -423,12 +918,16 @@ class MotorControl(object):
     flags = []
     if self.Jumping:
       flags.append("Jumping")
+    if self.Scanning:
+      flags.append("Scanning:%d" % self.scanline)
     if self.Moving:
       flags.append("Moving")
     if self.Paddling:
       flags.append("Paddling")
     if self.Frozen:
       flags.append("Frozen")
+    if self.Stopping:
+      flags.append("Stopping")
     if self.PosDirty:
       flags.append("PosDirty")
     mesg += "  Flags: [%s]\n" % (', '.join(flags))
@@ -437,6 +936,12 @@ class MotorControl(object):
     mesg += '>\n'
     return mesg
 
+  def LockStats(self):
+    """Return a dictionary of hold and wait time statistics for the motion control locks. None
+       of these locks are ever taken by the USB frame thread.
+    """
+    return {'MotorControl':self.lock.stats(), 'RA':self.RA.lock.stats(), 'DEC':self.DEC.lock.stats()}
+
   def Autoguide(self, on):
     """If the argument 'on' is True, turn the autoguider mode on, and start logging the
        guider steps taken. If the the argument is False, turn the autoguider mode off.
@@ -446,10 +951,6 @@ class MotorControl(object):
       self.Driver.enable_guider()
       self._guidelogfile.write('%f ON\n' % time.time())
       self._guidelogfile.flush()
-      with self.RA.lock:
-        self.RA._guidelog_last = 0
-      with self.DEC.lock:
-        self.DEC._guidelog_last = 0
       self.Autoguiding = True
     elif (not on) and (self.Autoguiding):
       self.Driver.disable_guider()
@@ -459,30 +960,153 @@ class MotorControl(object):
     else:   # tried to turn it off when it's already off, or on when it's already on.
       pass
 
-  def Jump(self, delRA, delDEC, Rate, force=False):
+  def Jump(self, delRA, delDEC, Rate, force=False, offset=False, plans=None):
     """This procedure calculates the profile parameters for a telescope jump.
     
        Inputs are delRA and delDEC, the (signed) offsets in steps, and
-       'Rate', the peak velocity in steps/second. Returns None.
-
-       Calls RA.StartJump() and DEC.StartJump to start the slews in each axis
+       'Rate', the peak velocity in steps/second. If 'offset' is True, this is a small
+       offset, and can be merged with other offsets waiting in the queue. If 'plans' is given, it's
+       a tuple of (RA, DEC) profiles already calculated by PlanJump(), used instead of planning the jump here.
+       Returns False if the jump was started or queued, True if there was an error.
+
+       Calls RA.StartJump() and DEC.StartJump to start the slews in each axis. If the telescope is
+       already moving, the jump is added to the motion queue instead, and started by the frame thread
+       in the first frame after the current motion finishes.
     """
-    # Determine motor speeds and displacements.
-    # If slewing (paddle or Jump) exit and return True as an error
-    if (self.Jumping or self.Paddling):
-      logger.error('motion.MotorControl.Jump called while telescope is already moving')
-      return True
     if self.limits.HWLimit:
       logger.error('motion.MotorControl.Jump called when hardware limit is active.')
       return True
-    if safety.Active.is_set() or force:
-      with self.lock:
+    if not (safety.Active.is_set() or force):
+      logger.error('ERROR: motion.motors.Jump called when safety interlock is on')
+      return True
+    command = MotionCommand(delRA=delRA, delDEC=delDEC, Rate=Rate, force=force, offset=offset, plans=plans)
+    with self.lock:
+      if self.queue or self._busy():
+        return self._enqueue(command)
+      command.start(self)
+      return False
+
+  def Retarget(self, delRA, delDEC, Rate, force=False):
+    """Change the destination of the jump in progress by delRA and delDEC steps, with a new peak
+       velocity of 'Rate' steps/second. Each axis plans a new profile starting from its current velocity,
+       in the next frame, instead of finishing the old jump and starting a new one. If the telescope
+       isn't moving, this is the same as Jump().
+
+       Returns False if the new target was accepted, True if there was an error. Retargeting isn't
+       allowed during hand paddle motion, or if there are other jumps waiting in the motion queue,
+       because their offsets are relative to the current destination.
+    """
+    if self.limits.HWLimit:
+      logger.error('motion.MotorControl.Retarget called when hardware limit is active.')
+      return True
+    if not (safety.Active.is_set() or force):
+      logger.error('ERROR: motion.motors.Retarget called when safety interlock is on')
+      return True
+    with self.lock:
+      if self.queue or self.Paddling or self.RA.Paddling or self.DEC.Paddling:
+        logger.error('motion.MotorControl.Retarget called with hand paddle motion or queued jumps.')
+        return True
+      if self.Scanning or self.RA.Scanning or self.DEC.Scanning:
+        logger.error('motion.MotorControl.Retarget called during a scan.')
+        return True
+      if not (self.Jumping or self.RA.Jumping or self.DEC.Jumping or self.RA.Pending or self.DEC.Pending):
         self.RA.StartJump(delRA, Rate)
         self.DEC.StartJump(delDEC, Rate)
         return False
-    else:
-      logger.error('ERROR: motion.motors.Jump called when safety interlock is on')
+      self.RA.Retarget(delRA, Rate)
+      self.DEC.Retarget(delDEC, Rate)
+      return False
+
+  def Scan(self, plans, force=False):
+    """Start a scan, using the (RA, DEC) profiles calculated by the scan module. If the telescope is
+       already moving, the scan is added to the motion queue instead. Returns False if the scan was
+       started or queued, True if there was an error.
+    """
+    if self.limits.HWLimit:
+      logger.error('motion.MotorControl.Scan called when hardware limit is active.')
+      return True
+    if not (safety.Active.is_set() or force):
+      logger.error('ERROR: motion.motors.Scan called when safety interlock is on')
+      return True
+    command = MotionCommand(Rate=abs(plans[0][2]) / float(SUBSTEPS) / PULSE, force=force, plans=plans, scan=True)
+    with self.lock:
+      if self.queue or self._busy():
+        return self._enqueue(command)
+      command.start(self)
+      return False
+
+  def _busy(self):
+    """Return True if either axis is moving, or has motion requests that the frame thread hasn't started yet.
+       The axis flags are checked as well as the aggregate flags, because those aren't updated until the end of
+       the next frame.
+    """
+    return (self.Jumping or self.Paddling or self.RA.Jumping or self.DEC.Jumping or self.RA.Paddling or
+            self.DEC.Paddling or self.RA.Pending or self.DEC.Pending)
+
+  def _enqueue(self, command):
+    """Add a command to the end of the motion queue, merging it with the last queued command if they
+       are both offsets. Returns True if the queue is full, False otherwise. Must be called with self.lock held.
+
+       The frame thread only ever removes commands from the left of the queue, so if the last command has
+       already been taken when we try to merge with it, the new command is just queued on its own.
+    """
+    self.queuestats['queued'] += 1
+    if command.offset and (command.plans is None) and self.queue and self.queue[-1].offset:
+      try:
+        last = self.queue.pop()
+      except IndexError:   # Taken by the frame thread since we looked
+        last = None
+      if last is not None:
+        command.delRA += last.delRA
+        command.delDEC += last.delDEC
+        command.Rate = max(command.Rate, last.Rate)
+        command.force = command.force or last.force
+        command.queued = last.queued
+        self.queuestats['merged'] += 1
+    if len(self.queue) >= prefs.MotionQueueLength:
+      logger.error('motion.MotorControl.Jump called with the motion queue full, %s dropped' % command)
+      self.queuestats['dropped'] += 1
       return True
+    self.queue.append(command)
+    self.queuestats['maxdepth'] = max(self.queuestats['maxdepth'], len(self.queue))
+    logger.info('motion.MotorControl.Jump: telescope is moving, %s queued' % command)
+    return False
+
+  def _startqueued(self):
+    """Start the next command in the motion queue. Called by the frame thread when neither axis is moving.
+       If the hardware limits or safety interlock are active, the queue is emptied instead.
+    """
+    try:
+      command = self.queue.popleft()
+    except IndexError:
+      return
+    if self.limits.HWLimit or not (safety.Active.is_set() or command.force):
+      logger.error('motion.MotorControl: hardware limit or safety interlock active, motion queue cleared')
+      self.queuestats['dropped'] += 1 + len(self.queue)
+      self.queue.clear()
+      return
+    wait = time.time() - command.queued
+    self.queuestats['started'] += 1
+    self.queuestats['waited'] += wait
+    self.queuestats['maxwait'] = max(self.queuestats['maxwait'], wait)
+    command.start(self)
+
+  def QueueStats(self):
+    """Return a dictionary with the current motion queue depth and the statistics since startup: the number of
+       commands queued, started, merged into an earlier offset and dropped, the maximum queue depth,
+       and the mean and maximum time (in seconds) commands waited in the queue.
+    """
+    d = self.queuestats.copy()
+    d['depth'] = len(self.queue)
+    d['meanwait'] = d['waited'] / max(d['started'], 1)
+    return d
+
+  def ClearQueue(self):
+    """Throw away all the jumps and offsets waiting in the motion queue.
+    """
+    with self.lock:
+      self.queuestats['dropped'] += len(self.queue)
+      self.queue.clear()
 
   def getframe(self):
     """Called asynchrnously by driver (in USB comms thread) whenever a spot in the controller input
@@ -494,31 +1118,46 @@ class MotorControl(object):
        integers (holding over any fractional part for next time), sets various flags, and sends the
        pair of numbers to the controller.
     """
+    stop = None
     if SITE == 'NZ':
       ovrd = self.limits.LimOverride
       if self.limits.PowerOff or self.limits.HorizLim or self.limits.MeshLim:
         ovrd = False     # Only allow east and west limits to be overriden
-      if self.limits.HWLimit and (not ovrd) and (self.CutFrac < 100):
-        self.CutFrac += 10
-      if (not self.limits.HWLimit) or ovrd:
-        self.CutFrac = 0
+      if self.limits.HWLimit and (not ovrd):
+        stop = usbcon.SHUTDOWN_ACCELERATION * SUBSTEPS     # Stop as fast as the controller would
+        if not self.Stopping:
+          self.stopdistance = (StopDistance(abs(self.RA.velocity), stop) / float(SUBSTEPS),
+                               StopDistance(abs(self.DEC.velocity), stop) / float(SUBSTEPS))
+          self.stoptime = time.time()
+          logger.error('motion.MotorControl.getframe: hardware limit, emergency stop in (%d, %d) steps.' %
+                       self.stopdistance)
+      self.Stopping = stop is not None
 
     self.ticks += 50
 
+    if self.restart is not None:
+      self._catchup(move=stop is None)
+
     was_moving = self.Moving
-    int_RA = self.RA.getframe(Frozen=self.Frozen, CutFrac=self.CutFrac)
-    int_DEC = self.DEC.getframe(Frozen=self.Frozen, CutFrac=self.CutFrac)
+    # Apply any motion requests started directly by other threads first, so they're seen by the queue check
+    self.RA._apply_requests()
+    self.DEC._apply_requests()
+    if self.queue and not (self.RA.Jumping or self.DEC.Jumping or self.RA.Paddling or self.DEC.Paddling):
+      self._startqueued()      # Start the next queued jump, in the first frame after the last motion finished
+
+    int_RA = self.RA.getframe(Frozen=self.Frozen, Stop=stop)
+    int_DEC = self.DEC.getframe(Frozen=self.Frozen, Stop=stop)
 
     self.Paddling = (self.RA.Paddling or self.DEC.Paddling)
     self.Jumping = (self.RA.Jumping or self.DEC.Jumping)
-    self.Moving = (self.Paddling or self.Jumping)
+    self.Scanning = (self.RA.Scanning or self.DEC.Scanning)
+    self.scanline = self.RA.line
+    self.Moving = (self.Paddling or self.Jumping or (len(self.queue) > 0) or self.RA.Pending or self.DEC.Pending)
 
     if was_moving and (not self.Moving):
       self.PosDirty = True                     # Flag that the log file position needs to be updated
-      with self.RA.lock:
-        self.RA.reflog = 0                       # Zero the refraction/flexure tracking log
-      with self.DEC.lock:
-        self.DEC.reflog = 0                      # Zero the refraction/flexure tracking log
+      self.RA.DiscardRefLog()                  # Zero the refraction/flexure tracking log
+      self.DEC.DiscardRefLog()                 # Zero the refraction/flexure tracking log
 
     if prefs.EastOfPier:
       int_DEC = -int_DEC      # Invert DEC direction if tel. east of pier
@@ -526,42 +1165,188 @@ class MotorControl(object):
     # Now send word_RA and word_DEC to the controller queue!
     return (int_RA, int_DEC)
 
+  def _catchup(self, move=True):
+    """Called by the frame thread in the first frame after a warm restart, to make up the tracking that should
+       have happened between the time the old controller stopped and this frame. The contents of the frames that
+       were dropped in the shutdown have already been re-issued by WarmRestart, so those frames aren't counted.
+       The motion is only made up if the old driver didn't stop because of a hardware limit, and 'move' is True
+       (no emergency stop is in progress) - otherwise it's just logged (see Axis.CatchUp).
+    """
+    last, dropped, reissue = self.restart
+    self.restart = None
+    missed = int(round((time.time() - last) / PULSE)) - dropped
+    if missed == 0:
+      return
+    move = move and reissue and not self.Frozen
+    ra = self.RA.CatchUp(missed, move=move)
+    dec = self.DEC.CatchUp(missed, move=move)
+    if move:
+      logger.info("Warm restart, %d frames of tracking missed, (%d, %d) steps made up." % (missed, ra, dec))
+    else:
+      logger.info("Warm restart, %d frames of tracking missed, (%d, %d) steps logged." % (missed, ra, dec))
+
+  def getline(self):
+    """Called by the driver (in the USB comms thread) after each call to getframe, to get the scan line
+       ID for the frame, to save in the frame log.
+    """
+    return self.scanline
+
+  def WarmRestart(self, olddriver):
+    """Called by RunQueue after the controller loop has exited, to restart motion where it left off. The
+       MotorControl object is kept across the restart, so non-sidereal and refraction rates, the Frozen state,
+       fractional steps and any held offsets are preserved. Motion that was dropped in the shutdown (the
+       contents of frames that were queued but never moved) is re-issued, along with the remainder of any jump
+       that was in progress. The tracking missed while the controller was stopped is made up in the first frame
+       sent by the new driver (see _catchup), once the length of the gap is known.
+    """
+    dropped_a, dropped_b = (0, 0)
+    if olddriver.dropped_frames is not None:
+      dropped_a, dropped_b = olddriver.dropped_frames
+    if prefs.EastOfPier:
+      dropped_b = -dropped_b     # The frame log holds the DEC values actually sent, inverted if east of pier
+    reissue = (olddriver.exception is None) or (olddriver.exception.exception not in usbcon.LIMIT_EXCEPTIONS)
+    ra = self.RA.WarmRestart(dropped=dropped_a, reissue=reissue)
+    dec = self.DEC.WarmRestart(dropped=dropped_b, reissue=reissue)
+    if self.restart is not None:     # No frames were sent by the old driver, so the gap started in the run before
+      self.restart = (self.restart[0], self.restart[1], self.restart[2] and reissue)
+    elif olddriver.stopped_at is not None:
+      self.restart = (olddriver.stopped_at, olddriver.dropped_count, reissue)
+    elif olddriver.FrameLog.lasttime() is not None:
+      self.restart = (olddriver.FrameLog.lasttime(), 0, reissue)
+    if reissue:
+      logger.info("Warm restart, re-issuing (%d, %d) steps of motion." % (ra, dec))
+    else:
+      logger.info("Warm restart after hardware limit, (%d, %d) steps of motion abandoned." % (ra, dec))
+
   def newcounters(self, counters):
     """Called aynchronously whenever new counter data is available from the controller
        hardware. Updates the autoguider logs.
+
+       This is called in the USB frame thread, so it can update the axis logs directly.
     """
-    with self.RA.lock:
-      self.RA.guidelog += counters.a_guider_steps - self.RA._guidersteps_last
-      self.RA._guidersteps_last = counters.a_guider_steps
+    self.RA.AddGuide(counters.a_guider_steps - self.RA._guidersteps_last)
+    self.RA._guidersteps_last = counters.a_guider_steps
 
-    with self.DEC.lock:
-      self.DEC.guidelog += counters.b_guider_steps - self.DEC._guidersteps_last
-      self.DEC._guidersteps_last = counters.b_guider_steps
+    self.DEC.AddGuide(counters.b_guider_steps - self.DEC._guidersteps_last)
+    self.DEC._guidersteps_last = counters.b_guider_steps
 
+    self.Reconcile(counters)
 
-def RunQueue():
-  """Starts the motion control queue running.
+  def Reconcile(self, counters):
+    """Compare the new controller counters with the frames sent, to find any steps that were lost (or
+       gained) by the controller or motors. If prefs.AutoCorrect is True, the current position is corrected
+       by adding the difference to the paddle logs. If not, the difference is accumulated in self.steperror,
+       and errors.StepError is set if it exceeds prefs.ReconcileThreshold steps in either axis.
 
-     This function only exits if stop() was called with an exception, indicating an
-     unrecoverable error that means the main program must exit.
+       Called in the USB frame thread, when new counters are available.
+    """
+    r = self.Driver.reconcile(counters)
+    if r is None:
+      return
+    da, db = r.new
+    if prefs.EastOfPier:
+      db = -db     # Invert DEC direction if tel. east of pier
+    if (da == 0) and (db == 0):
+      return
+    self.lost = (self.lost[0] + da, self.lost[1] + db)
+    if prefs.AutoCorrect:
+      self.RA.AddCorrection(da)
+      self.DEC.AddCorrection(db)
+      logger.warning('motion.MotorControl.Reconcile: %d, %d steps lost, current position corrected: %s' % (da, db, r))
+    else:
+      self.steperror = (self.steperror[0] + da, self.steperror[1] + db)
+      if (abs(self.steperror[0]) > prefs.ReconcileThreshold) or (abs(self.steperror[1]) > prefs.ReconcileThreshold):
+        if not errors.StepError:
+          logger.error('motion.MotorControl.Reconcile: %d, %d steps lost, position now wrong: %s' % (self.steperror[0],
+                                                                                                       self.steperror[1],
+                                                                                                       r))
+        errors.StepError = True
+
+  def ClearStepError(self):
+    """Called when the current position is reset, to forget any uncorrected lost steps.
+    """
+    self.steperror = (0, 0)
+    errors.StepError = False
+
+
+class Mount(object):
+  """A telescope mount, with its own controller card - the LimitStatus and MotorControl objects for that mount,
+     and the thread running the controller loop. The main mount is created by KickStart(), and its MotorControl
+     and LimitStatus objects are also available as the module globals 'motors' and 'limits'. Extra mounts
+     (created with AddMount()) are only available through the 'mounts' dictionary.
+
+     The 'current' and 'dome' attributes are filled in by the higher level code (see detevent.InitMount).
   """
-  global motors
-  global limits
-  limits = usbcon.LimitStatus()
-  while True:
-    try:
-      oldmotors = motors    # Keep a  reference to the old object around, in case it takes time to clean itself up on exit
-      motors = MotorControl(limits=limits)
-      motors.Driver = usbcon.Driver(getframe=motors.getframe, newcounters=motors.newcounters, limits=limits)
-      motors.Driver.run()
-    except:
-      print "controller.Controller.stop() was called with an exception:"
-      traceback.print_exc()
-      break
-    logger.info("Restarting controller.run().")
+  def __init__(self, name='main', device=None):
+    """'device' selects the controller for this mount, if there's more than one connected - an index into the
+       list of connected controllers, a USB serial number, or a "bus:address" string. If None, there must only
+       be one controller connected.
+    """
+    self.name = name
+    self.device = device
+    self.limits = usbcon.LimitStatus()
+    self.motors = MotorControl(limits=self.limits)
+    self.current = None      # detevent.CurrentPosition object for this mount
+    self.dome = None         # Dome object for this mount, or None if it doesn't have one
+    self.fastloop = None     # detevent.EventLoop objects for this mount
+    self.slowloop = None
+    self.thread = None       # Thread running self.RunQueue
+    self.process = None      # rtproc.FrameProcess object running the controller, if prefs.FrameProcess is True
+    self.finished = False    # Set to True to stop RunQueue restarting the controller after the next shutdown
+    mounts[name] = self
+
+  def __repr__(self):
+    running = ((self.thread is not None) and self.thread.is_alive()) or ((self.process is not None) and
+                                                                         self.process.is_alive())
+    return "<Mount %s: device=%s, running=%s>" % (self.name, self.device, running)
+
+  def KickStart(self):
+    """Start the motion control thread for this mount, or if prefs.FrameProcess is True, start a separate frame
+       process to run the controller (see rtproc.py), and replace self.motors and self.limits with proxies for the
+       objects in that process.
+    """
+    if prefs.FrameProcess:
+      import rtproc       # Imported here, because rtproc imports this module
+      self.process = rtproc.FrameProcess(self)
+      self.process.start()
+      self.motors, self.limits = self.process.motors, self.process.limits
+      return
+    self.thread = threading.Thread(target=self.RunQueue, name='USB-controller-thread-%s' % self.name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def RunQueue(self, getframe=None):
+    """Starts the motion control queue running. If 'getframe' is given, the driver calls it instead of
+       self.motors.getframe for each new frame (see rtproc.FrameServer).
+
+       This function only exits if stop() was called with an exception, indicating an
+       unrecoverable error that means the main program must exit, or if self.finished was set before
+       the controller stopped. Otherwise the same MotorControl object is kept, and the controller is
+       restarted with a new Driver.
+    """
+    motors = self.motors
+    if getframe is None:
+      getframe = motors.getframe
+    realtime.Apply(name='mount %s' % self.name)
+    while not self.finished:
+      try:
+        olddriver = motors.Driver
+        if olddriver is not None:
+          motors.WarmRestart(olddriver)
+        motors.Driver = usbcon.Driver(getframe=getframe, newcounters=motors.newcounters, limits=self.limits,
+                                      previous=olddriver, getline=motors.getline, device=self.device)
+        motors.Driver.run()
+      except:
+        print "controller.Controller.stop() was called with an exception on mount %s:" % self.name
+        traceback.print_exc()
+        break
+      if not self.finished:
+        logger.info("Restarting controller.run() on mount %s." % self.name)
 
 
 #Main init routine for unit
 
+mounts = {}     # Mount objects, by name, including the main mount
+mount = None    # The main Mount object
 limits = None
 motors = None
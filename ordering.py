@@ -0,0 +1,252 @@
+
+"""Target ordering for observing lists. Given a batch of targets (for a scripted run, or a sequence of
+   TJbox commands), 'Optimise()' finds an order that visits them all with the least total overhead - the
+   time spent slewing, waiting for the dome and settling, and waiting for targets to come into their
+   visibility windows.
+
+   Slew times come from motion.SlewTimer, which gives exactly the same jump durations as the real motion
+   profile code, and dome times from the same dome rotation model as detevent.SlewTime. A matrix of the
+   overhead between every pair of targets is calculated first, then the order is found with a nearest
+   neighbour tour, improved by 2-opt moves (reversing part of the order) until no more improvement can be
+   found, or the time limit runs out.
+
+   Each target can have a dwell time (the time spent on that target, eg for the exposures), a visibility
+   window (the earliest and latest times the telescope can arrive at it), and the pier side it needs. Changing
+   pier side needs the telescope to be reconfigured by hand, so it costs PIERCHANGE seconds.
+"""
+
+import time
+
+from globals import *
+import detevent
+import motion
+
+if SITE == 'PERTH':
+  import pdome as dome
+elif SITE == 'NZ':
+  import nzdome as dome
+
+TIMELIMIT = 0.5          # Default time limit for the optimisation, in seconds, not counting the overhead matrix
+PIERCHANGE = 900.0       # Overhead, in seconds, for changing from one pier side to the other
+LATEPENALTY = 100000.0   # Added to the total overhead for each target reached after the end of its window
+
+
+class Target(object):
+  """A target in an observing list, with the constraints used when ordering it.
+  """
+  def __init__(self, pos, dwell=0.0, window=None, pier=None):
+    """'pos' is the target position (a correct.CalcPosition object), 'dwell' is the time to spend on the target,
+       in seconds, 'window' is a tuple of (earliest, latest) arrival times (as Unix times, either can be None)
+       or None if the target can be observed at any time, and 'pier' is the pier side the target needs to be
+       observed on ('east' or 'west'), or None if either side will do.
+    """
+    self.pos = pos
+    self.dwell = float(dwell)
+    self.window = window
+    self.pier = pier
+
+  def __repr__(self):
+    return "<Target: %s, dwell=%d sec, window=%s, pier=%s>" % (self.pos, self.dwell, self.window, self.pier)
+
+
+class Plan(object):
+  """The result of an optimisation - the new order, and the total overhead in the original and new orders.
+  """
+  def __init__(self, targets, indices, given, overhead, late, elapsed):
+    self.order = [targets[i] for i in indices]   # Targets, in the new order
+    self.indices = indices   # Index of each target in the original list, in the new order
+    self.given = given       # Total overhead for the original order, in seconds
+    self.overhead = overhead   # Total overhead for the new order, in seconds
+    self.saved = given - overhead    # Overhead saved by the new order, in seconds
+    self.late = late         # Indices (in the original list) of targets that will be reached after their window closes
+    self.elapsed = elapsed   # Time taken by the optimisation, in seconds
+
+  def __repr__(self):
+    return "<Plan: %d targets, overhead %d sec (was %d sec), %d sec saved, %d late, took %4.2f sec>" % (
+        len(self.indices), self.overhead, self.given, self.saved, len(self.late), self.elapsed)
+
+
+class _Node(object):
+  """Everything needed to calculate the overhead between two targets, worked out once per target.
+  """
+  def __init__(self, pos, azi, dwell=0.0, window=None, pier=None):
+    self.RaC, self.DecC = pos.RaC, pos.DecC
+    self.azi = azi
+    self.dwell = dwell
+    self.window = window
+    self.pier = pier
+
+
+def _matrix(nodes, timer):
+  """Return a list of lists containing the overhead in seconds (slew, dome and settle time, and any pier change)
+     between each pair of nodes. The overheads are symmetric, so each pair is only calculated once.
+  """
+  n = len(nodes)
+  cost = [[0.0] * n for i in range(n)]
+  for i in range(n):
+    a = nodes[i]
+    row = cost[i]
+    for j in range(i + 1, n):
+      b = nodes[j]
+      DelRA, DelDEC = detevent.JumpSteps(a, b)
+      slew = max(timer.frames(DelRA), timer.frames(DelDEC)) * PULSE
+      c = slew
+      if (a.azi is not None) and (b.azi is not None):
+        c = max(slew, detevent.DomeTime(a.azi, b.azi))
+      if slew > 0:
+        c += prefs.SettleTime
+      if a.pier and b.pier and (a.pier != b.pier):
+        c += PIERCHANGE
+      row[j] = c
+      cost[j][i] = c
+  return cost
+
+
+def _arrive(node, t):
+  """Return the time the telescope can start on 'node', arriving at time 't' (later than t, if it has to
+     wait for the visibility window to open), and True if it's arrived after the window closed.
+  """
+  if node.window is None:
+    return t, False
+  start, end = node.window
+  late = (end is not None) and (t > end)
+  if (start is not None) and (t < start):
+    t = start
+  return t, late
+
+
+def _evaluate(order, nodes, cost, now):
+  """Return the total overhead (in seconds) for visiting the nodes in the given order, starting from node 0
+     (the starting position) at time 'now', including any waits for visibility windows to open, and the
+     list of nodes reached after their window closes.
+  """
+  t = now
+  late = []
+  last = 0
+  dwell = 0.0
+  for i in order:
+    t, islate = _arrive(nodes[i], t + cost[last][i])
+    if islate:
+      late.append(i)
+    t += nodes[i].dwell
+    dwell += nodes[i].dwell
+    last = i
+  return t - now - dwell, late
+
+
+def _score(order, nodes, cost, now):
+  """Return the total overhead for the given order, with LATEPENALTY added for each late target.
+  """
+  overhead, late = _evaluate(order, nodes, cost, now)
+  return overhead + LATEPENALTY * len(late)
+
+
+def _nearest(nodes, cost, now):
+  """Build an order by always going to the target with the least overhead (including any wait for its window
+     to open) from the current one, avoiding targets that would be reached late, if possible.
+  """
+  left = set(range(1, len(nodes)))
+  order = []
+  t = now
+  last = 0
+  while left:
+    best, bestscore, bestt = None, None, None
+    for i in left:
+      start, islate = _arrive(nodes[i], t + cost[last][i])
+      score = start - t + LATEPENALTY * islate
+      if (bestscore is None) or (score < bestscore):
+        best, bestscore, bestt = i, score, start
+    order.append(best)
+    left.remove(best)
+    t = bestt + nodes[best].dwell
+    last = best
+  return order
+
+
+def _twoopt(order, nodes, cost, now, deadline):
+  """Improve the order by reversing sections of it, for as long as that shortens the total overhead, or
+     until time.time() passes 'deadline'. If none of the targets have windows, only the overheads at
+     each end of the reversed section change, so each move can be checked in constant time.
+  """
+  windows = [node for node in nodes if node.window is not None]
+  route = [0] + order
+  n = len(route)
+  best = _score(order, nodes, cost, now)
+  improved = True
+  while improved and (time.time() < deadline):
+    improved = False
+    for i in range(1, n - 1):
+      if time.time() > deadline:
+        break
+      a, b = route[i - 1], route[i]
+      for k in range(i + 1, n):
+        if windows:
+          trial = route[1:i] + route[k:i - 1:-1] + route[k + 1:]
+          c = _score(trial, nodes, cost, now)
+          if c < best - 1e-6:
+            best = c
+            route = [0] + trial
+            improved = True
+            a, b = route[i - 1], route[i]
+        else:
+          d, e = route[k], None
+          delta = cost[a][d] - cost[a][b]
+          if k + 1 < n:
+            e = route[k + 1]
+            delta += cost[b][e] - cost[d][e]
+          if delta < -1e-6:
+            route[i:k + 1] = route[i:k + 1][::-1]
+            best += delta
+            improved = True
+            a, b = route[i - 1], route[i]
+  return route[1:]
+
+
+def Optimise(targets, From=None, Rate=None, timelimit=None, now=None):
+  """Find the order for visiting a list of targets (Target objects, or correct.CalcPosition objects) with the least
+     total overhead, starting from the position 'From' (the current position, if None), jumping at a peak velocity
+     of 'Rate' steps/second, and starting at time 'now' (defaults to the current time). The search stops after
+     'timelimit' seconds (TIMELIMIT, if None) and returns the best order found so far.
+
+     Returns a Plan object, with the new order, and the overhead saved compared to the original order.
+  """
+  t0 = time.time()
+  if Rate is None:
+    Rate = prefs.SlewRate
+  if timelimit is None:
+    timelimit = TIMELIMIT
+  if now is None:
+    now = t0
+  targets = [t if isinstance(t, Target) else Target(t) for t in targets]
+  if From is None:
+    From = detevent.current
+  else:
+    From.update()
+  autodome = dome.dome.AutoDome
+
+  pier = {False:'west', True:'east'}[prefs.EastOfPier]
+  azi = None
+  if autodome:
+    if (From is detevent.current) and (dome.dome.DomeAzi >= 0):
+      azi = dome.dome.DomeAzi
+    else:
+      azi = dome.dome.CalcAzi(From)
+  nodes = [_Node(From, azi, pier=pier)]
+  for t in targets:
+    t.pos.update()
+    azi = None
+    if autodome:
+      azi = dome.dome.CalcAzi(t.pos)
+    nodes.append(_Node(t.pos, azi, dwell=t.dwell, window=t.window, pier=t.pier))
+  cost = _matrix(nodes, motion.SlewTimer(Rate))
+
+  given = range(1, len(nodes))
+  order = _twoopt(_nearest(nodes, cost, now), nodes, cost, now, deadline=time.time() + timelimit)
+  if _score(order, nodes, cost, now) > _score(given, nodes, cost, now):
+    order = given      # Never make it worse
+  givencost, givenlate = _evaluate(given, nodes, cost, now)
+  ordercost, orderlate = _evaluate(order, nodes, cost, now)
+  plan = Plan(targets, [i - 1 for i in order], given=givencost, overhead=ordercost, late=[i - 1 for i in orderlate],
+              elapsed=time.time() - t0)
+  logger.info('ordering.Optimise: %s' % plan)
+  return plan
@@ -0,0 +1,293 @@
+
+"""Post-mortem records of controller shutdowns. Whenever the controller stops with an exception, usbcon.Driver
+   saves a PostMortem file in prefs.LogDirName, holding the decoded exception details from the controller (the
+   axis trace for a velocity or acceleration limit, or the FPGA error bits), the controller's motion limits,
+   and the last prefs.PostMortemSeconds seconds of the frame log - the frame number, the time each frame was
+   enqueued, the velocity in each axis, the controller queue depth and the scan line ID.
+
+   The controller only reports a single axis trace record for each exception, not a trace of every step, so the
+   motion leading up to the shutdown comes from the frame log. The velocity in each frame is in steps/frame,
+   the acceleration is the change in velocity from the previous frame (steps/frame/frame), and the time each
+   frame reached the motors is estimated from the time it was enqueued, plus the time taken by the frames ahead
+   of it in the queue. The controller spreads the steps in a frame evenly across it, so the interval between
+   steps is PULSE divided by the velocity.
+
+   Each file is a one line JSON header, followed by the raw frame log arrays, so a 30 second post-mortem takes
+   about 15 kilobytes. Run 'python postmortem.py [-s seconds] [-p] [file ...]' to summarise (and with -p, plot)
+   the last few seconds before each shutdown - with no files, every post-mortem in prefs.LogDirName is used.
+"""
+
+import array
+import glob
+import json
+import os
+import sys
+import threading
+
+from globals import *
+
+MAGIC = 'TJPM1'      # First word of the header line in a post-mortem file
+SUMMARYSECONDS = 5   # Default length of the period before the shutdown covered by the summary, in seconds
+
+# Frame log arrays saved in each file, in order, with their array type codes (see usbcon.FrameLog)
+FIELDS = [('frames', 'L'), ('times', 'd'), ('va', 'h'), ('vb', 'h'), ('depth', 'H'), ('lines', 'H')]
+
+
+class PostMortem(object):
+  """The exception details and recent frame history for one controller shutdown.
+  """
+  def __init__(self, header, columns):
+    self.header = header     # Dictionary of exception details, limits and shutdown values
+    for name, code in FIELDS:
+      setattr(self, name, columns[name])
+    self.filename = None
+
+  def __len__(self):
+    return len(self.frames)
+
+  def __repr__(self):
+    return "<PostMortem %s: %s, %d frames, stopped after frame %s>" % (self.filename, self.header['description'],
+                                                                       len(self), self.header['frame'])
+
+  def motortimes(self):
+    """Return an array of the estimated time each frame reached the motors.
+    """
+    return array.array('d', [t + d * PULSE for t, d in zip(self.times, self.depth)])
+
+  def velocity(self, axis):
+    """Return the array of velocities (steps/frame) for axis 0 (A, RA) or 1 (B, DEC).
+    """
+    return [self.va, self.vb][axis]
+
+  def acceleration(self, axis):
+    """Return an array of the change in velocity from the previous frame (steps/frame/frame) for the given axis,
+       zero for the first frame.
+    """
+    v = self.velocity(axis)
+    result = array.array('l', [0]) * len(v)
+    for i in xrange(1, len(v)):
+      result[i] = v[i] - v[i - 1]
+    return result
+
+  def stopindex(self):
+    """Return the index of the last frame moved before the shutdown ramp (the reference frame of the counters
+       read after the exception), or the last frame in the record if that frame isn't in it.
+    """
+    frame = self.header['frame']
+    first = self.header['firstindex']
+    for i in xrange(len(self.frames) - 1, -1, -1):
+      if (self.frames[i] == frame) and (first + i >= self.header['runstart']):
+        return i
+    return len(self.frames) - 1
+
+  def summary(self, seconds=SUMMARYSECONDS):
+    """Return a dictionary describing the 'seconds' seconds before the shutdown - the number of frames, and for
+       each axis, the final, largest and largest change in velocity (steps/frame), the shortest interval between
+       steps (ms), and the number of frames over the controller's velocity or acceleration limits, as well as
+       the smallest queue depth and longest interval between frames being enqueued (ms).
+    """
+    end = self.stopindex() + 1
+    start = max(end - int(seconds / PULSE), 0)
+    result = {'frames':end - start, 'mindepth':None, 'maxinterval':0.0, 'axes':[]}
+    if end <= start:
+      return result
+    result['mindepth'] = min(self.depth[start:end])
+    for i in xrange(start + 1, end):
+      result['maxinterval'] = max(result['maxinterval'], (self.times[i] - self.times[i - 1]) * 1000)
+    for axis in range(2):
+      v = self.velocity(axis)[start:end]
+      a = self.acceleration(axis)[start:end]
+      vlimit = self.header['velocity_limit'][axis]
+      alimit = self.header['acceleration_limit'][axis]
+      vmax = max([abs(x) for x in v])
+      result['axes'].append({'final':v[-1],
+                             'maxvelocity':vmax,
+                             'maxacceleration':max([abs(x) for x in a]),
+                             'minstepinterval':(PULSE / vmax * 1000) if vmax else None,
+                             'overvelocity':len([x for x in v if vlimit and abs(x) > vlimit]),
+                             'overacceleration':len([x for x in a if alimit and abs(x) > alimit])})
+    return result
+
+  def save(self, filename):
+    """Write the post-mortem to the given file.
+    """
+    f = open(filename, 'wb')
+    try:
+      f.write('%s %s\n' % (MAGIC, json.dumps(self.header)))
+      for name, code in FIELDS:
+        getattr(self, name).tofile(f)
+    finally:
+      f.close()
+    self.filename = filename
+
+
+def Create(driver, counters, seconds=None, device=None):
+  """Return a new PostMortem for the usbcon.Driver 'driver', which has just stopped with an exception, given the
+     counters read after the stop. Copies the last 'seconds' seconds of the frame log (prefs.PostMortemSeconds,
+     if seconds is None).
+  """
+  if seconds is None:
+    seconds = prefs.PostMortemSeconds
+  log = driver.FrameLog
+  count = min(int(seconds / PULSE), len(log))
+  columns = dict([(name, array.array(code)) for name, code in FIELDS])
+  firstindex = log.count - count
+  for s0, s1 in log._slices(firstindex, log.count):
+    for name, code in FIELDS:
+      columns[name].extend(getattr(log, name)[s0:s1])
+  details = driver.exception
+  header = {'time':time.time(),
+            'device':device,
+            'exception':None,
+            'description':'none',
+            'details':{},
+            'frame':counters.reference_frame_number,
+            'total_steps':(counters.a_total_steps, counters.b_total_steps),
+            'guider_steps':(counters.a_guider_steps, counters.b_guider_steps),
+            'shutdown_distance':driver.shutdown_distance,
+            'dropped_steps':driver.dropped_frames,
+            'velocity_limit':(0, 0),
+            'acceleration_limit':(0, 0),
+            'shutdown_acceleration':(0, 0),
+            'count':count,
+            'firstindex':firstindex,      # Frame log index of the first frame in the record
+            'runstart':log.runstart}      # Frame log index of the start of the controller run that stopped
+  if details is not None:
+    header['exception'] = details.exception
+    header['description'] = details.description()
+    header['details'] = details.properties
+  c = driver.configuration
+  if c is not None:
+    header['velocity_limit'] = (c.mc_a_velocity_limit, c.mc_b_velocity_limit)
+    header['acceleration_limit'] = (c.mc_a_acceleration_limit, c.mc_b_acceleration_limit)
+    header['shutdown_acceleration'] = (c.mc_a_shutdown_acceleration, c.mc_b_shutdown_acceleration)
+  return PostMortem(header, columns)
+
+
+def Filename(pm):
+  """Return the file name for a new post-mortem in prefs.LogDirName.
+  """
+  stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(pm.header['time']))
+  device = pm.header['device']
+  if device is None:
+    return os.path.join(prefs.LogDirName, 'postmortem-%s.tpm' % stamp)
+  return os.path.join(prefs.LogDirName, 'postmortem-%s-%s.tpm' % (str(device).replace(':', '.'), stamp))
+
+
+def SaveInBackground(pm):
+  """Save a post-mortem in prefs.LogDirName, in a new thread, so the controller thread isn't held up writing
+     the file.
+  """
+  def save():
+    filename = Filename(pm)
+    try:
+      pm.save(filename)
+      logger.info('postmortem: controller shutdown post-mortem saved in %s' % filename)
+    except (IOError, OSError) as error:
+      logger.error('postmortem: could not save %s: %s' % (filename, error))
+  t = threading.Thread(target=save, name='postmortem-save')
+  t.daemon = True
+  t.start()
+  return t
+
+
+def Load(filename):
+  """Read a PostMortem from a file.
+  """
+  f = open(filename, 'rb')
+  try:
+    magic, header = f.readline().split(' ', 1)
+    if magic != MAGIC:
+      raise ValueError("%s is not a teljoy post-mortem file" % filename)
+    header = json.loads(header)
+    columns = {}
+    for name, code in FIELDS:
+      columns[name] = array.array(code)
+      columns[name].fromfile(f, header['count'])
+  finally:
+    f.close()
+  pm = PostMortem(header, columns)
+  pm.filename = filename
+  return pm
+
+
+def Report(pm, seconds=SUMMARYSECONDS):
+  """Return a human readable summary of the last 'seconds' seconds before the shutdown in a post-mortem.
+  """
+  h = pm.header
+  s = pm.summary(seconds)
+  lines = ["%s: %s at %s UT" % (pm.filename, h['description'], time.strftime('%Y-%m-%d %H:%M:%S',
+                                                                               time.gmtime(h['time'])))]
+  if h['details']:
+    lines.append("  Details: %s" % ', '.join(['%s=%s' % (k, h['details'][k]) for k in sorted(h['details'])]))
+  lines.append("  Stopped after frame %s, shutdown ramp %s steps, %s steps queued but not moved" % (
+      h['frame'], h['shutdown_distance'], h['dropped_steps']))
+  lines.append("  Last %.1f seconds (%d frames): min queue depth %s, longest enqueue interval %.1f ms" % (
+      seconds, s['frames'], s['mindepth'], s['maxinterval']))
+  for name, axis, vlimit, alimit in zip(['A', 'B'], s['axes'], h['velocity_limit'], h['acceleration_limit']):
+    if axis['minstepinterval'] is None:
+      interval = 'none'
+    else:
+      interval = '%.3f ms' % axis['minstepinterval']
+    lines.append("  Axis %s: final %d, max %d (limit %d) steps/frame, max change %d (limit %d), shortest step "
+                 "interval %s, %d frames over velocity limit, %d over acceleration limit" % (
+                     name, axis['final'], axis['maxvelocity'], vlimit, axis['maxacceleration'], alimit, interval,
+                     axis['overvelocity'], axis['overacceleration']))
+  return '\n'.join(lines)
+
+
+def Plot(pm, seconds=SUMMARYSECONDS):
+  """Plot the velocity, acceleration and queue depth in the last 'seconds' seconds before the shutdown, if
+     matplotlib is available.
+  """
+  try:
+    import matplotlib.pyplot as plt
+  except ImportError:
+    logger.error('postmortem.Plot: matplotlib is not installed, summary only.')
+    return
+  end = pm.stopindex() + 1
+  start = max(end - int(seconds / PULSE), 0)
+  t = pm.motortimes()[start:end]
+  t = [x - t[-1] for x in t]
+  fig, axes = plt.subplots(3, 1, sharex=True)
+  for axis, name in enumerate(['A', 'B']):
+    axes[0].plot(t, pm.velocity(axis)[start:end], label=name)
+    axes[1].plot(t, pm.acceleration(axis)[start:end], label=name)
+  axes[2].plot(t, pm.depth[start:end])
+  axes[0].set_ylabel('steps/frame')
+  axes[1].set_ylabel('steps/frame/frame')
+  axes[2].set_ylabel('queue depth')
+  axes[2].set_xlabel('seconds before shutdown')
+  axes[0].legend()
+  axes[0].set_title('%s - %s' % (os.path.basename(pm.filename), pm.header['description']))
+  plt.show()
+
+
+def Run(args):
+  """Summarise (and if '-p' is given, plot) each post-mortem file in args, or all of those in prefs.LogDirName.
+     '-s seconds' sets the length of the period summarised.
+  """
+  seconds = SUMMARYSECONDS
+  plot = False
+  files = []
+  args = list(args)
+  while args:
+    arg = args.pop(0)
+    if arg == '-p':
+      plot = True
+    elif arg == '-s':
+      seconds = float(args.pop(0))
+    else:
+      files.append(arg)
+  if not files:
+    files = sorted(glob.glob(os.path.join(prefs.LogDirName, 'postmortem-*.tpm')))
+  for filename in files:
+    pm = Load(filename)
+    print Report(pm, seconds)
+    print
+    if plot:
+      Plot(pm, seconds)
+
+
+if __name__ == '__main__':
+  Run(sys.argv[1:])
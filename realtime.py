@@ -0,0 +1,119 @@
+
+"""Optional Linux real-time settings for the frame thread (or frame process - see rtproc.py), from the
+   [Realtime] section of teljoy.ini:
+
+     Priority    - SCHED_FIFO priority (1-99) for the frame thread, or 0 to leave it as a normal thread
+     Affinity    - CPU numbers to pin the frame thread to, as a comma separated list, or 'none'
+     LockMemory  - if true, lock all of the process's memory into RAM with mlockall(), so the frame path never
+                   waits for a page fault. In the normal (frame thread) mode, this locks the whole teljoy process.
+
+   Python 2 has no wrappers for these system calls, so they're called through ctypes. The scheduling policy and
+   CPU affinity apply to the calling thread only (on Linux, each thread has its own), so Apply() must be called
+   from the frame thread itself. If a setting can't be applied (usually because the process doesn't have the
+   CAP_SYS_NICE or CAP_IPC_LOCK capability, or an RLIMIT_RTPRIO/RLIMIT_MEMLOCK limit), an error is logged and
+   the thread carries on without it.
+
+   Use usbcon.Driver.Jitter() to measure the effect of each setting on frame timing.
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+from globals import *
+
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+class _SchedParam(ctypes.Structure):
+  _fields_ = [('sched_priority', ctypes.c_int)]
+
+
+try:
+  libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  libc.sched_setscheduler          # Raises AttributeError if it's not available (not Linux)
+except (OSError, AttributeError):
+  libc = None
+
+
+def _error(call):
+  """Return a description of the last system call error, for the log.
+  """
+  errno = ctypes.get_errno()
+  return "%s failed: %s" % (call, os.strerror(errno))
+
+
+def SetPriority(priority):
+  """Set the calling thread's scheduling policy to SCHED_FIFO with the given priority, or back to SCHED_OTHER
+     if the priority is zero. Returns True if there was an error.
+  """
+  if libc is None:
+    logger.error('realtime.SetPriority: real-time scheduling not available on this system.')
+    return True
+  if priority:
+    policy = SCHED_FIFO
+    low, high = libc.sched_get_priority_min(SCHED_FIFO), libc.sched_get_priority_max(SCHED_FIFO)
+    if not (low <= priority <= high):
+      logger.error('realtime.SetPriority: priority %d out of range (%d-%d)' % (priority, low, high))
+      return True
+  else:
+    policy = SCHED_OTHER
+  param = _SchedParam(priority)
+  if libc.sched_setscheduler(0, policy, ctypes.byref(param)) != 0:
+    logger.error('realtime.SetPriority: %s' % _error('sched_setscheduler(%d, %d)' % (policy, priority)))
+    return True
+  return False
+
+
+def SetAffinity(cpus):
+  """Pin the calling thread to the given list of CPU numbers. Returns True if there was an error.
+  """
+  if libc is None:
+    logger.error('realtime.SetAffinity: CPU affinity not available on this system.')
+    return True
+  mask = (ctypes.c_ulong * 16)()       # Room for 1024 CPUs, the same as the glibc cpu_set_t
+  bits = ctypes.sizeof(ctypes.c_ulong) * 8
+  for cpu in cpus:
+    if not (0 <= cpu < 16 * bits):
+      logger.error('realtime.SetAffinity: CPU number %d out of range' % cpu)
+      return True
+    mask[cpu // bits] |= 1 << (cpu % bits)
+  if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+    logger.error('realtime.SetAffinity: %s' % _error('sched_setaffinity(%s)' % (cpus,)))
+    return True
+  return False
+
+
+def LockMemory():
+  """Lock all current and future memory pages of this process into RAM. Returns True if there was an error.
+  """
+  if libc is None:
+    logger.error('realtime.LockMemory: mlockall not available on this system.')
+    return True
+  if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+    logger.error('realtime.LockMemory: %s' % _error('mlockall'))
+    return True
+  return False
+
+
+def Apply(name=''):
+  """Apply the real-time settings in prefs to the calling thread (and for LockMemory, the whole process).
+     Called at the start of the frame thread (or in the frame process) by motion.Mount.RunQueue. Returns a
+     list of the settings that were applied successfully.
+  """
+  applied = []
+  if prefs.RTAffinity:
+    if not SetAffinity(prefs.RTAffinity):
+      applied.append('Affinity=%s' % (prefs.RTAffinity,))
+  if prefs.RTLockMemory:
+    if not LockMemory():
+      applied.append('LockMemory')
+  if prefs.RTPriority:
+    if not SetPriority(prefs.RTPriority):
+      applied.append('SCHED_FIFO priority %d' % prefs.RTPriority)
+  if applied:
+    logger.info('Real-time settings for %s: %s' % (name, ', '.join(applied)))
+  return applied
@@ -0,0 +1,833 @@
+
+"""Optional real-time frame process. If prefs.FrameProcess is True, each mount's controller loop (controller.run,
+   usbcon.Driver and the motion.MotorControl frame generation) runs in its own process, instead of a thread in the
+   main process, so it never has to wait for the Pyro4 daemon, the detevent loops, SQL calls or the console to
+   release the interpreter lock.
+
+   The two processes share a memory-mapped block, created before the frame process is forked:
+
+     - A command ring, holding fixed-size COMMAND records written by the main process (jumps, paddle motion,
+       tracking rates, flag changes, etc). The main process only writes the ring head, and the frame process only
+       writes the tail, so neither side ever takes a lock to use it. The frame process applies any new commands at
+       the start of each frame, and writes the result of each command back into its slot.
+
+     - A status record (STATUS), written by the frame process after every frame: the motion flags, the motion log
+       totals for each axis, the limit flags, inputs, counters and queue statistics. It's protected by a sequence
+       counter (odd while the record is being written), so the main process can always read a consistent copy
+       without blocking the frame process.
+
+     - A plan area (PLANHEADER and up to PLANSEGMENTS SEGMENT records per axis), holding the precalculated
+       profiles for a jump (from motion.PlanJump) or a scan (from the scan module). The main process writes one
+       plan at a time, with a plan sequence number in the header, then sends a JUMPPLAN or SCAN command carrying
+       the same number, and waits for the frame process to apply it.
+
+     - Areas the frame process copies the driver's statistics into on request (the JitterLog, UnderflowMonitor and
+       CounterStats), and the scan line records from the frame log (see usbcon.FrameLog.scanlines). The frame log
+       itself stays in the frame process.
+
+   Everything on the hot path is packed and unpacked with precompiled struct.Struct objects - nothing is ever
+   pickled. In the main process, the mount's 'motors' and 'limits' attributes (and so motion.motors and
+   motion.limits for the main mount) are replaced by RemoteMotors and RemoteLimits objects, which have the same
+   interface as the MotorControl and LimitStatus objects used by the rest of the code, so jumps, dither patterns
+   and scans all work the same way in either mode.
+"""
+
+import array
+import collections
+import mmap
+import multiprocessing
+import os
+import signal
+import struct
+
+from globals import *
+import motion
+import usbcon
+
+RINGSIZE = 64          # Number of command slots in the ring
+CALLTIMEOUT = 1.0      # Time to wait for the frame process to apply a command, in seconds
+SYNCINTERVAL = 0.1     # How often the main process copies the safety interlock state and pier side to the frame process
+PARENTCHECK = 20       # Check that the main process is still alive every this many frames
+PLANSEGMENTS = 16384   # Largest number of profile segments in each axis of a jump or scan plan
+MAXSCANLINES = 4096    # Largest number of scan line records copied back from the frame log
+
+# Commands
+(JUMP, RETARGET, PADDLE, STOPPADDLE, TRACK, REFRACTION, FROZEN, AUTOGUIDE, SETOUTPUTS, CLEAROUTPUTS, CLEARQUEUE,
+ CLEARSTEPERROR, LIMIT, POSDIRTY, SAFETY, PIER, SHUTDOWN, JITTER, UNDERFLOW, COUNTERSTATS, JUMPPLAN,
+ SCAN, SCANLINES) = range(1, 24)
+
+HEAD = struct.Struct('<I')          # Number of commands written to the ring by the main process
+TAIL = struct.Struct('<I')          # Number of commands applied by the frame process
+SEQ = struct.Struct('<I')           # Status record sequence counter, odd while the frame process is writing the record
+COMMAND = struct.Struct('<IHhQddd')  # seq, command, axis (0=RA, 1=DEC) or flag index, integer argument, float arguments
+RESULT = struct.Struct('<i')        # Result of a command, written by the frame process after the COMMAND in each slot
+PLANHEADER = struct.Struct('<III6q')  # plan seq, RA and DEC segment counts, (left, delta, max_vel) for RA then DEC
+SEGMENT = struct.Struct('<iqi')     # frames, velocity in sub-steps/frame, scan line (0 for a jump)
+
+# Bits in the status 'flags' field
+FLAGS = ['Jumping', 'Scanning', 'Paddling', 'Moving', 'PosDirty', 'Stopping', 'RA.Jumping', 'RA.Paddling',
+         'RA.Scanning', 'RA.Stopping', 'DEC.Jumping', 'DEC.Paddling', 'DEC.Scanning', 'DEC.Stopping', 'StepError',
+         'Frozen', 'running', 'guider_enabled', 'counters', 'underflowrisk']
+LIMITFLAGS = ['HWLimit', 'OldLim', 'PowerOff', 'HorizLim', 'MeshLim', 'EastLim', 'WestLim', 'WantsOverride',
+              'LimOverride']
+FLAGBITS = dict([(name, 1 << i) for i, name in enumerate(FLAGS + LIMITFLAGS)])
+
+STATUSFIELDS = [('applied', 'I'), ('ticks', 'q'), ('flags', 'Q'), ('scanline', 'i'), ('queuedepth', 'i'),
+                ('ra_logs', '5q'), ('dec_logs', '5q'), ('ra_velocity', 'q'), ('dec_velocity', 'q'),
+                ('inputs', 'Q'), ('reference_frame_number', 'I'), ('counters', '6q'),
+                ('lost', '2q'), ('steperror', '2q'), ('stopdistance', '2d'), ('stoptime', 'd'),
+                ('frames', 'q'), ('lowframes', 'q'), ('mindepth', 'i'), ('underflows', 'q'),
+                ('queuetarget', 'i'), ('timerlate', 'd'), ('timermaxlate', 'd'), ('underfloweta', 'd'),
+                ('underflowdepth', 'i')]
+STATUS = struct.Struct('<' + ''.join([f for n, f in STATUSFIELDS]))
+Status = collections.namedtuple('Status', [n for n, f in STATUSFIELDS])
+JITTERSTATS = struct.Struct('<q4d%dL' % usbcon.JITTERBINS)   # Copy of the JitterLog, written by the frame process on request
+UNDERFLOWSTATS = struct.Struct('<qd%dL' % usbcon.DEPTHBINS)   # Copy of the UnderflowMonitor histogram, written on request
+COUNTERKEYS = ['reads', 'failures', 'rate', 'bandwidth', 'latency', 'maxlatency', 'busyinterval', 'idleinterval']
+COUNTERSUMMARY = struct.Struct('<%dd' % len(COUNTERKEYS))   # Summary of the driver's CounterStats, written on request
+LINECOUNT = struct.Struct('<I')     # Number of scan line records that follow, written on request
+LINE = struct.Struct('<iIIdd')      # line, first and last frame number, start and end time (see usbcon.FrameLog.scanlines)
+
+HEADOFFSET = 0
+TAILOFFSET = 8
+STATUSOFFSET = 64
+SLOTOFFSET = STATUSOFFSET + ((SEQ.size + STATUS.size) // 64 + 1) * 64
+SLOTSIZE = COMMAND.size + RESULT.size
+JITTEROFFSET = SLOTOFFSET + RINGSIZE * SLOTSIZE
+UNDERFLOWOFFSET = JITTEROFFSET + JITTERSTATS.size
+COUNTEROFFSET = UNDERFLOWOFFSET + UNDERFLOWSTATS.size
+PLANOFFSET = COUNTEROFFSET + COUNTERSUMMARY.size
+LINEOFFSET = PLANOFFSET + PLANHEADER.size + 2 * PLANSEGMENTS * SEGMENT.size
+SIZE = LINEOFFSET + LINECOUNT.size + MAXSCANLINES * LINE.size
+
+
+def _unflatten(values):
+  """Group the flat tuple of values unpacked from a STATUS record by field.
+  """
+  result = []
+  i = 0
+  for name, f in STATUSFIELDS:
+    n = int(f[:-1] or 1)
+    if n == 1:
+      result.append(values[i])
+    else:
+      result.append(values[i:i + n])
+    i += n
+  return Status._make(result)
+
+
+class FrameServer(object):
+  """Runs in the frame process. Applies the commands from the main process before each frame, and publishes
+     the status record after it.
+  """
+  def __init__(self, block, mount):
+    self.block = block
+    self.mount = mount
+    self.motors = mount.motors
+    self.limits = mount.limits
+    self.axes = [self.motors.RA, self.motors.DEC]
+    self.applied = 0           # Number of commands applied
+    self.parent = os.getppid()
+    self.count = 0             # Number of frames sent
+    sources = [(self.motors, 'Jumping'), (self.motors, 'Scanning'), (self.motors, 'Paddling'), (self.motors, 'Moving'),
+               (self.motors, 'PosDirty'), (self.motors, 'Stopping')]
+    for axis in self.axes:
+      sources += [(axis, 'Jumping'), (axis, 'Paddling'), (axis, 'Scanning'), (axis, 'Stopping')]
+    sources += [(errors, 'StepError'), (self.motors, 'Frozen')]
+    self._sources = [(obj, name, 1 << i) for i, (obj, name) in enumerate(sources)]
+    self._limitsources = [(name, FLAGBITS[name]) for name in LIMITFLAGS]
+
+  def getframe(self):
+    """Called by the driver instead of MotorControl.getframe.
+    """
+    self._commands()
+    frame = self.motors.getframe()
+    self.publish()
+    self.count += 1
+    if (self.count % PARENTCHECK == 0) and (os.getppid() != self.parent):
+      logger.error('rtproc.FrameServer: main process has exited, shutting down the controller.')
+      self._apply(SHUTDOWN, 0, 0, 0.0, 0.0, 0.0)
+    return frame
+
+  def _commands(self):
+    """Apply any commands written to the ring since the last frame.
+    """
+    block = self.block
+    head = HEAD.unpack_from(block, HEADOFFSET)[0]
+    while self.applied != head:
+      slot = SLOTOFFSET + (self.applied % RINGSIZE) * SLOTSIZE
+      seq, command, axis, value, a, b, c = COMMAND.unpack_from(block, slot)
+      try:
+        result = self._apply(command, axis, value, a, b, c)
+      except:
+        logger.error('rtproc.FrameServer: error applying command %d: %s' % (command, traceback.format_exc()))
+        result = True
+      RESULT.pack_into(block, slot + COMMAND.size, int(bool(result)))
+      self.applied += 1
+      TAIL.pack_into(block, TAILOFFSET, self.applied)
+
+  def _apply(self, command, axis, value, a, b, c):
+    """Carry out one command, and return True if there was an error.
+    """
+    motors = self.motors
+    if command == JUMP:
+      return motors.Jump(a, b, c, force=bool(value & 1), offset=bool(value & 2))
+    elif command == JUMPPLAN:
+      plans = self._readplan(value)
+      if plans is None:
+        return True
+      return motors.Jump(a, b, c, force=bool(axis & 1), offset=bool(axis & 2),
+                         plans=tuple([([s[:2] for s in segments], left, delta, max_vel)
+                                      for segments, left, delta, max_vel in plans]))
+    elif command == SCAN:
+      plans = self._readplan(value)
+      if plans is None:
+        return True
+      return motors.Scan(tuple([(segments, delta, max_vel) for segments, left, delta, max_vel in plans]),
+                         force=bool(axis & 1))
+    elif command == RETARGET:
+      return motors.Retarget(a, b, c, force=bool(value & 1))
+    elif command == PADDLE:
+      self.axes[axis].StartPaddle(a)
+    elif command == STOPPADDLE:
+      self.axes[axis].StopPaddle()
+    elif command == TRACK:
+      self.axes[axis].SetTrack(a)
+    elif command == REFRACTION:
+      self.axes[axis].SetRefraction(a)
+    elif command == FROZEN:
+      motors.Frozen = bool(value)
+    elif command == AUTOGUIDE:
+      if value:
+        motors.Driver.enable_guider()
+      else:
+        motors.Driver.disable_guider()
+      motors.Autoguiding = bool(value)
+    elif command == SETOUTPUTS:
+      motors.Driver.set_outputs(value)
+    elif command == CLEAROUTPUTS:
+      motors.Driver.clear_outputs(value)
+    elif command == CLEARQUEUE:
+      motors.ClearQueue()
+    elif command == CLEARSTEPERROR:
+      motors.ClearStepError()
+    elif command == LIMIT:
+      setattr(self.limits, LIMITFLAGS[axis], bool(value))
+    elif command == POSDIRTY:
+      motors.PosDirty = bool(value)
+    elif command == SAFETY:
+      if value:
+        safety.Active.set()       # Just copy the state - the stop and start functions run in the main process
+      else:
+        safety.Active.clear()
+    elif command == PIER:
+      prefs.EastOfPier = bool(value)
+    elif command == JITTER:
+      if motors.Driver is None:
+        return True
+      j = motors.Driver.JitterLog
+      JITTERSTATS.pack_into(self.block, JITTEROFFSET, j.count, j.total, j.totalsq, j.min, j.max, *j.bins)
+      if value:
+        j.reset()
+    elif command == UNDERFLOW:
+      if motors.Driver is None:
+        return True
+      u = motors.Driver.UnderflowMonitor
+      UNDERFLOWSTATS.pack_into(self.block, UNDERFLOWOFFSET, u.warnings, u.maxgap, *u.depths)
+      if value:
+        u.reset()
+    elif command == COUNTERSTATS:
+      if motors.Driver is None:
+        return True
+      summary = motors.Driver.CounterStatistics(reset=bool(value))
+      COUNTERSUMMARY.pack_into(self.block, COUNTEROFFSET, *[summary[key] for key in COUNTERKEYS])
+    elif command == SCANLINES:
+      if motors.Driver is None:
+        return True
+      seconds = None
+      if value:
+        seconds = a
+      lines = motors.Driver.ScanLines(seconds)[-MAXSCANLINES:]
+      for i, record in enumerate(lines):
+        LINE.pack_into(self.block, LINEOFFSET + LINECOUNT.size + i * LINE.size, *record)
+      LINECOUNT.pack_into(self.block, LINEOFFSET, len(lines))
+    elif command == SHUTDOWN:
+      self.mount.finished = True
+      if motors.Driver is not None:
+        motors.Driver.shutdown()
+    else:
+      logger.error('rtproc.FrameServer: unknown command %d' % command)
+      return True
+    return False
+
+  def _readplan(self, planseq):
+    """Read the plan written to the plan area by FrameProcess.writeplan, and return it as a tuple of
+       (segments, left, delta, max_vel) for each axis, with the segments as (frames, velocity, line) tuples.
+       Returns None if the plan area doesn't hold plan number 'planseq' (because the main process gave up
+       waiting for this command and has since started writing another plan).
+    """
+    block = self.block
+    header = PLANHEADER.unpack_from(block, PLANOFFSET)
+    if header[0] != planseq:
+      logger.error('rtproc.FrameServer: plan %d has been overwritten, ignoring it.' % planseq)
+      return None
+    plans = []
+    offset = PLANOFFSET + PLANHEADER.size
+    for i in range(2):
+      segments = [SEGMENT.unpack_from(block, offset + j * SEGMENT.size) for j in range(header[1 + i])]
+      plans.append((segments,) + header[3 + 3 * i:6 + 3 * i])
+      offset += PLANSEGMENTS * SEGMENT.size
+    if PLANHEADER.unpack_from(block, PLANOFFSET)[0] != planseq:
+      logger.error('rtproc.FrameServer: plan %d was overwritten while it was being read, ignoring it.' % planseq)
+      return None
+    return tuple(plans)
+
+  def publish(self):
+    """Write the status record, with the sequence counter odd while it's being written.
+    """
+    motors, limits, driver = self.motors, self.limits, self.motors.Driver
+    flags = 0
+    for obj, name, bit in self._sources:
+      if getattr(obj, name):
+        flags |= bit
+    for name, bit in self._limitsources:
+      if getattr(limits, name):
+        flags |= bit
+    inputs, frame, counters, stats = 0, 0, (0, 0, 0, 0, 0, 0), {'frames':0, 'lowframes':0, 'mindepth':None, 'underflows':0}
+    target, timerlate, timermaxlate, eta, estimate = 0, 0.0, 0.0, -1.0, 0
+    if driver is not None:
+      inputs = driver.inputs
+      stats = driver.framestats
+      target = driver.QueueControl.target
+      timerlate, timermaxlate = driver.timerstats.mean_lateness() * 1000, driver.timerstats.max_lateness * 1000
+      monitor = driver.UnderflowMonitor
+      if monitor.risk:
+        flags |= FLAGBITS['underflowrisk']
+      if monitor.eta is not None:
+        eta = monitor.eta
+      estimate = monitor.estimate
+      if driver.running:
+        flags |= FLAGBITS['running']
+      if driver.guider_enabled:
+        flags |= FLAGBITS['guider_enabled']
+      c = driver.counters
+      if c is not None:
+        flags |= FLAGBITS['counters']
+        frame = c.reference_frame_number
+        counters = (c.a_total_steps, c.b_total_steps, c.a_guider_steps, c.b_guider_steps, c.a_measured_steps,
+                    c.b_measured_steps)
+    mindepth = stats['mindepth']
+    if mindepth is None:
+      mindepth = -1
+    block = self.block
+    seq = SEQ.unpack_from(block, STATUSOFFSET)[0]
+    SEQ.pack_into(block, STATUSOFFSET, (seq + 1) & 0xffffffff)
+    STATUS.pack_into(block, STATUSOFFSET + SEQ.size, self.applied, motors.ticks, flags, motors.scanline, len(motors.queue),
+                     *(motors.RA.logs + motors.DEC.logs +
+                       (motors.RA.velocity, motors.DEC.velocity, inputs, frame) + counters + motors.lost +
+                       motors.steperror + motors.stopdistance +
+                       (motors.stoptime or 0.0, stats['frames'], stats['lowframes'], mindepth, stats['underflows'],
+                        target, timerlate, timermaxlate, eta, estimate)))
+    SEQ.pack_into(block, STATUSOFFSET, (seq + 2) & 0xffffffff)
+
+
+class FrameProcess(object):
+  """Runs the controller loop for a motion.Mount object in a separate process, and provides the RemoteMotors and
+     RemoteLimits objects the main process uses to talk to it.
+  """
+  def __init__(self, mount):
+    self.mount = mount
+    self.block = mmap.mmap(-1, SIZE)     # Anonymous shared memory, inherited by the frame process
+    self.lock = threading.Lock()         # Only one thread in the main process writes to the ring at a time
+    self.planlock = threading.Lock()     # Only one thread in the main process uses the plan area at a time
+    self.planseq = 0                     # Number of plans written to the plan area
+    self.head = 0                        # Number of commands written to the ring
+    self.process = None
+    self.motors = RemoteMotors(self)
+    self.limits = RemoteLimits(self)
+    self.motors.limits = self.limits
+    self._safety = None     # Safety interlock state last sent to the frame process
+    self._pier = None       # prefs.EastOfPier value last sent to the frame process
+    self._died = False
+
+  def __repr__(self):
+    return "<FrameProcess for mount %s: pid=%s, alive=%s>" % (self.mount.name,
+                                                             (self.process is not None) and self.process.pid,
+                                                             self.is_alive())
+
+  def start(self):
+    """Fork the frame process, and start the thread that keeps it in step with the main process.
+    """
+    logger.info("Starting frame process for mount %s" % self.mount.name)
+    self.process = multiprocessing.Process(target=self._run, name='frame-process-%s' % self.mount.name)
+    self.process.daemon = True
+    self.process.start()
+    t = threading.Thread(target=self._sync, name='rtproc-sync-%s' % self.mount.name)
+    t.daemon = True
+    t.start()
+
+  def is_alive(self):
+    return (self.process is not None) and self.process.is_alive()
+
+  def _run(self):
+    """The frame process - run the controller loop until it's shut down.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # Ctrl-C at the console is for the main process
+    server = FrameServer(self.block, self.mount)
+    server.publish()
+    self.mount.RunQueue(getframe=server.getframe)
+    logger.info("Frame process for mount %s exiting." % self.mount.name)
+
+  def _sync(self):
+    """Copy the safety interlock state and the pier side to the frame process whenever they change, and copy any
+       StepError back, every SYNCINTERVAL seconds. Runs in its own thread in the main process.
+    """
+    while True:
+      active = safety.Active.is_set()
+      if active != self._safety:
+        self.post(SAFETY, value=int(active))
+        self._safety = active
+      if prefs.EastOfPier != self._pier:
+        self.post(PIER, value=int(prefs.EastOfPier))
+        self._pier = prefs.EastOfPier
+      if self.flag('StepError') and not errors.StepError:
+        errors.StepError = True
+      if (not self._died) and (self.process is not None) and (not self.process.is_alive()):
+        if not self.mount.finished:
+            logger.critical("Frame process for mount %s has exited, exit code %s." % (self.mount.name,
+                                                                                    self.process.exitcode))
+        self._died = True
+      time.sleep(SYNCINTERVAL)
+
+  def status(self):
+    """Return a consistent copy of the status record, as a Status tuple.
+    """
+    block = self.block
+    while True:
+      seq = SEQ.unpack_from(block, STATUSOFFSET)[0]
+      values = STATUS.unpack_from(block, STATUSOFFSET + SEQ.size)
+      if (not (seq & 1)) and (SEQ.unpack_from(block, STATUSOFFSET)[0] == seq):
+        return _unflatten(values)
+
+  def flag(self, name, status=None):
+    """Return the value of one of the FLAGS or LIMITFLAGS in the status record.
+    """
+    if status is None:
+      status = self.status()
+    return bool(status.flags & FLAGBITS[name])
+
+  def post(self, command, axis=0, value=0, a=0.0, b=0.0, c=0.0):
+    """Write a command to the ring, and return its sequence number, or None if the ring is full.
+    """
+    with self.lock:
+      seq = self.head
+      if seq - TAIL.unpack_from(self.block, TAILOFFSET)[0] >= RINGSIZE:
+        logger.error('rtproc.FrameProcess.post: command ring full, frame process not responding.')
+        return None
+      slot = SLOTOFFSET + (seq % RINGSIZE) * SLOTSIZE
+      COMMAND.pack_into(self.block, slot, seq, command, axis, value, a, b, c)
+      self.head = seq + 1
+      HEAD.pack_into(self.block, HEADOFFSET, self.head)
+    return seq
+
+  def writeplan(self, plans):
+    """Write a jump or scan plan to the plan area, and return its plan sequence number, or None if it's too
+       big. 'plans' is a tuple of (segments, left, delta, max_vel) for each axis, with the segments as (frames,
+       velocity, line) tuples. Must be called with planlock held, and the number passed to the frame process
+       in the JUMPPLAN or SCAN command that uses it.
+    """
+    for segments, left, delta, max_vel in plans:
+      if len(segments) > PLANSEGMENTS:
+        logger.error('rtproc.FrameProcess.writeplan: plan has %d segments, only %d fit in the plan area.' % (len(segments),
+                                                                                                            PLANSEGMENTS))
+        return None
+    block = self.block
+    self.planseq += 1
+    PLANHEADER.pack_into(block, PLANOFFSET, 0, 0, 0, 0, 0, 0, 0, 0, 0)    # No valid plan while it's being written
+    offset = PLANOFFSET + PLANHEADER.size
+    for segments, left, delta, max_vel in plans:
+      for j, (frames, velocity, line) in enumerate(segments):
+        SEGMENT.pack_into(block, offset + j * SEGMENT.size, frames, velocity, line)
+      offset += PLANSEGMENTS * SEGMENT.size
+    (sa, la, da, ma), (sb, lb, db, mb) = plans
+    PLANHEADER.pack_into(block, PLANOFFSET, self.planseq, len(sa), len(sb), la, da, ma, lb, db, mb)
+    return self.planseq
+
+  def callplan(self, command, plans, flags=0, a=0.0, b=0.0, c=0.0):
+    """Write 'plans' to the plan area (see writeplan), then send 'command' with the plan sequence number and
+       wait for the frame process to apply it. Returns True if there was an error.
+    """
+    with self.planlock:
+      planseq = self.writeplan(plans)
+      if planseq is None:
+        return True
+      return self.call(command, axis=flags, value=planseq, a=a, b=b, c=c)
+
+  def call(self, command, axis=0, value=0, a=0.0, b=0.0, c=0.0):
+    """Write a command to the ring, wait for the frame process to apply it, and return True if there
+       was an error.
+    """
+    seq = self.post(command, axis=axis, value=value, a=a, b=b, c=c)
+    if seq is None:
+      return True
+    deadline = time.time() + CALLTIMEOUT
+    while self.status().applied <= seq:
+      if time.time() > deadline:
+        logger.error('rtproc.FrameProcess.call: timeout waiting for the frame process to apply command %d' % command)
+        return True
+      time.sleep(0.005)
+    slot = SLOTOFFSET + (seq % RINGSIZE) * SLOTSIZE
+    return bool(RESULT.unpack_from(self.block, slot + COMMAND.size)[0])
+
+
+class RemoteLimits(object):
+  """Stands in for the usbcon.LimitStatus object in the main process. The flags are read from the status
+     record, and setting a flag sends it to the frame process.
+  """
+  def __init__(self, process):
+    self.__dict__['_process'] = process
+
+  def __getattr__(self, name):
+    if name in LIMITFLAGS:
+      return self._process.flag(name)
+    raise AttributeError(name)
+
+  def __setattr__(self, name, value):
+    if name in LIMITFLAGS:
+      self._process.call(LIMIT, axis=LIMITFLAGS.index(name), value=int(bool(value)))
+    else:
+      self.__dict__[name] = value
+
+  def __getstate__(self):
+    status = self._process.status()
+    d = {}
+    for n in ['HWLimit', 'PowerOff', 'HorizLim', 'MeshLim', 'EastLim', 'WestLim', 'WantsOverride', 'LimOverride']:
+      d[n] = self._process.flag(n, status)
+    return d
+
+  def __repr__(self):
+    return usbcon.LimitStatus._reprf % self.__getstate__()
+
+  def __str__(self):
+    return usbcon.LimitStatus._strf % self.__getstate__()
+
+  def check(self, inputs=None):
+    """The limit inputs are checked in the frame process, whenever they change.
+    """
+    pass
+
+  CanEast = usbcon.LimitStatus.CanEast.im_func
+  CanWest = usbcon.LimitStatus.CanWest.im_func
+  override = usbcon.LimitStatus.override.im_func
+
+
+class RemoteAxis(object):
+  """Stands in for a motion.Axis object in the main process.
+  """
+  def __init__(self, process, index, sidereal=0.0):
+    self._process = process
+    self.index = index         # 0 for RA, 1 for DEC
+    self.name = ['RA', 'DEC'][index]
+    self.sidereal = sidereal
+    self.command = motion.AxisCommand()
+    self._consumed = (0, 0, 0, 0, 0)
+    self.lock = TimedLock(name='Axis')
+
+  def __repr__(self):
+    return "  <RemoteAxis %s: Jumping=%s, Paddling=%s>\n" % (self.name, self.Jumping, self.Paddling)
+
+  def _flag(self, name):
+    return self._process.flag('%s.%s' % (self.name, name))
+
+  Jumping = property(lambda self: self._flag('Jumping'))
+  Paddling = property(lambda self: self._flag('Paddling'))
+  Scanning = property(lambda self: self._flag('Scanning'))
+  Stopping = property(lambda self: self._flag('Stopping'))
+  track = property(lambda self: self.command.track)
+  refraction = property(lambda self: self.command.refraction)
+
+  @property
+  def logs(self):
+    return self._process.status()[5 + self.index]
+
+  @property
+  def velocity(self):
+    return self._process.status()[7 + self.index]
+
+  @property
+  def padlog(self):
+    return (self.logs[0] - self._consumed[0]) / float(motion.SUBSTEPS)
+
+  @property
+  def reflog(self):
+    logs = self.logs
+    if logs[3] != self._consumed[3]:
+      return (logs[1] - logs[4]) / float(motion.SUBSTEPS)
+    return (logs[1] - self._consumed[1]) / float(motion.SUBSTEPS)
+
+  @property
+  def guidelog(self):
+    return (self.logs[2] - self._consumed[2]) / float(motion.SUBSTEPS)
+
+  def SetTrack(self, track):
+    with self.lock:
+      self.command = motion.AxisCommand(track=track, refraction=self.command.refraction)
+      self._process.post(TRACK, axis=self.index, a=track)
+
+  def SetRefraction(self, refraction):
+    with self.lock:
+      self.command = motion.AxisCommand(track=self.command.track, refraction=refraction)
+      self._process.post(REFRACTION, axis=self.index, a=refraction)
+
+  def ReadLogs(self):
+    """See motion.Axis.ReadLogs.
+    """
+    with self.lock:
+      logs = self.logs
+      last = self._consumed
+      padlog = logs[0] - last[0]
+      if logs[3] != last[3]:      # The refraction log was discarded since the last read
+        reflog = logs[1] - logs[4]
+      else:
+        reflog = logs[1] - last[1]
+      guidelog = logs[2] - last[2]
+      self._consumed = logs
+    return padlog, reflog, guidelog
+
+  def StartPaddle(self, Rate):
+    self._process.post(PADDLE, axis=self.index, a=Rate)
+
+  def StopPaddle(self):
+    self._process.post(STOPPADDLE, axis=self.index)
+
+
+class RemoteDriver(object):
+  """Stands in for the usbcon.Driver object in the main process.
+  """
+  def __init__(self, process):
+    self._process = process
+    self.FrameLog = None       # The frame log is only kept in the frame process, see ScanLines
+
+  inputs = property(lambda self: self._process.status().inputs)
+  running = property(lambda self: self._process.flag('running'))
+  guider_enabled = property(lambda self: self._process.flag('guider_enabled'))
+
+  @property
+  def counters(self):
+    status = self._process.status()
+    if not self._process.flag('counters', status):
+      return None
+    counters = usbcon.controller.CounterDetails()
+    counters.reference_frame_number = status.reference_frame_number
+    (counters.a_total_steps, counters.b_total_steps, counters.a_guider_steps, counters.b_guider_steps,
+     counters.a_measured_steps, counters.b_measured_steps) = status.counters
+    return counters
+
+  def FrameStats(self):
+    status = self._process.status()
+    mindepth = status.mindepth
+    if mindepth < 0:
+      mindepth = None
+    return {'frames':status.frames, 'lowframes':status.lowframes, 'mindepth':mindepth, 'underflows':status.underflows,
+            'target':status.queuetarget, 'timerlate':status.timerlate, 'timermaxlate':status.timermaxlate}
+
+  def Jitter(self, reset=False):
+    """See usbcon.Driver.Jitter - the frame process copies its JitterLog to the shared block on request.
+    """
+    if self._process.call(JITTER, value=int(bool(reset))):
+      return None
+    j = usbcon.JitterLog()
+    values = JITTERSTATS.unpack_from(self._process.block, JITTEROFFSET)
+    j.count, j.total, j.totalsq, j.min, j.max = values[:5]
+    j.bins = array.array('L', values[5:])
+    return j.summary()
+
+  def Underflow(self, reset=False):
+    """See usbcon.Driver.Underflow - the current prediction comes from the status record, and the frame process
+       copies the rest of its UnderflowMonitor to the shared block on request.
+    """
+    if self._process.call(UNDERFLOW, value=int(bool(reset))):
+      return None
+    status = self._process.status()
+    values = UNDERFLOWSTATS.unpack_from(self._process.block, UNDERFLOWOFFSET)
+    eta = status.underfloweta
+    if eta < 0:
+      eta = None
+    return {'risk':self._process.flag('underflowrisk', status), 'eta':eta, 'depth':status.underflowdepth,
+            'warnings':values[0], 'maxgap':values[1] * 1000,
+            'histogram':dict([(i, c) for i, c in enumerate(values[2:]) if c])}
+
+  def UnderflowRisk(self):
+    return self._process.flag('underflowrisk')
+
+  def CounterStatistics(self, reset=False):
+    """See usbcon.Driver.CounterStatistics - the frame process copies the summary to the shared block on request.
+    """
+    if self._process.call(COUNTERSTATS, value=int(bool(reset))):
+      return None
+    result = dict(zip(COUNTERKEYS, COUNTERSUMMARY.unpack_from(self._process.block, COUNTEROFFSET)))
+    result['reads'], result['failures'] = int(result['reads']), int(result['failures'])
+    return result
+
+  def ScanLines(self, seconds=None):
+    """See usbcon.Driver.ScanLines - the frame process copies the most recent MAXSCANLINES scan line records to
+       the shared block on request. Returns None if there was an error.
+    """
+    if seconds is None:
+      error = self._process.call(SCANLINES)
+    else:
+      error = self._process.call(SCANLINES, value=1, a=seconds)
+    if error:
+      return None
+    block = self._process.block
+    count = LINECOUNT.unpack_from(block, LINEOFFSET)[0]
+    return [LINE.unpack_from(block, LINEOFFSET + LINECOUNT.size + i * LINE.size) for i in range(count)]
+
+  def set_outputs(self, bitfield):
+    self._process.post(SETOUTPUTS, value=bitfield)
+
+  def clear_outputs(self, bitfield):
+    self._process.post(CLEAROUTPUTS, value=bitfield)
+
+  def stop(self):
+    logger.error('rtproc.RemoteDriver.stop: the controller in the frame process restarts itself.')
+
+  def shutdown(self):
+    """Shut down the controller, and stop the frame process.
+    """
+    self._process.mount.finished = True
+    self._process.post(SHUTDOWN)
+
+
+class RemoteMotors(object):
+  """Stands in for the motion.MotorControl object in the main process. Motion flags and logs are read from
+     the status record, and commands are sent to the frame process through the command ring.
+  """
+  def __init__(self, process):
+    self._process = process
+    self.RA = RemoteAxis(process, 0, sidereal=prefs.RAsid)
+    self.DEC = RemoteAxis(process, 1)
+    self.Driver = RemoteDriver(process)
+    self.limits = None
+    self.lock = TimedLock(name='MotorControl')
+    self.Autoguiding = False
+    self._guidelogfile = None
+
+  def _flag(self, name):
+    return self._process.flag(name)
+
+  Jumping = property(lambda self: self._flag('Jumping'))
+  Scanning = property(lambda self: self._flag('Scanning'))
+  Paddling = property(lambda self: self._flag('Paddling'))
+  Moving = property(lambda self: self._flag('Moving'))
+  Stopping = property(lambda self: self._flag('Stopping'))
+  ticks = property(lambda self: self._process.status().ticks)
+  scanline = property(lambda self: self._process.status().scanline)
+  lost = property(lambda self: self._process.status().lost)
+  steperror = property(lambda self: self._process.status().steperror)
+  stopdistance = property(lambda self: self._process.status().stopdistance)
+  stoptime = property(lambda self: self._process.status().stoptime or None)
+
+  @property
+  def queue(self):
+    """Only the length of the motion queue in the frame process is available.
+    """
+    return [None] * self._process.status().queuedepth
+
+  def _getposdirty(self):
+    return self._flag('PosDirty')
+
+  def _setposdirty(self, value):
+    self._process.call(POSDIRTY, value=int(bool(value)))
+
+  PosDirty = property(_getposdirty, _setposdirty)
+
+  def _getfrozen(self):
+    return self._flag('Frozen')
+
+  def _setfrozen(self, value):
+    self._process.call(FROZEN, value=int(bool(value)))
+
+  Frozen = property(_getfrozen, _setfrozen)
+
+  def __getstate__(self):
+    d = {}
+    for n in ['Jumping', 'Scanning', 'scanline', 'Paddling', 'Moving', 'PosDirty', 'ticks', 'Frozen', 'Autoguiding',
+              'lost', 'steperror', 'Stopping', 'stopdistance', 'stoptime']:
+      d[n] = getattr(self, n)
+    d['guidelog'] = (self.RA.guidelog, self.DEC.guidelog)
+    d['queuedepth'] = len(self.queue)
+    return d
+
+  def __repr__(self):
+    return "<RemoteMotors: %s>" % self.__getstate__()
+
+  def LockStats(self):
+    return {'MotorControl':self.lock.stats(), 'RA':self.RA.lock.stats(), 'DEC':self.DEC.lock.stats()}
+
+  def QueueStats(self):
+    """Only the current depth of the motion queue is available from the frame process.
+    """
+    return {'depth':len(self.queue)}
+
+  def Autoguide(self, on):
+    """See motion.MotorControl.Autoguide.
+    """
+    if on and not (self.Autoguiding):
+      self._guidelogfile = file(prefs.LogDirName + '/guider.log', 'a')
+      self._process.post(AUTOGUIDE, value=1)
+      self._guidelogfile.write('%f ON\n' % time.time())
+      self._guidelogfile.flush()
+      self.Autoguiding = True
+    elif (not on) and (self.Autoguiding):
+      self._process.post(AUTOGUIDE, value=0)
+      self._guidelogfile.write('%f OFF\n' % time.time())
+      self._guidelogfile.close()
+      self.Autoguiding = False
+
+  def Jump(self, delRA, delDEC, Rate, force=False, offset=False, plans=None):
+    """See motion.MotorControl.Jump. Any precalculated 'plans' are sent to the frame process through the
+       plan area, otherwise the frame process plans the jump itself.
+    """
+    if self.limits.HWLimit:
+      logger.error('rtproc.RemoteMotors.Jump called when hardware limit is active.')
+      return True
+    if not (safety.Active.is_set() or force):
+      logger.error('ERROR: rtproc.RemoteMotors.Jump called when safety interlock is on')
+      return True
+    flags = int(bool(force)) | (int(bool(offset)) << 1)
+    if plans is not None:
+      return self._process.callplan(JUMPPLAN, tuple([([(n, v, 0) for n, v in segments], left, delta, max_vel)
+                                                     for segments, left, delta, max_vel in plans]),
+                                    flags=flags, a=delRA, b=delDEC, c=Rate)
+    return self._process.call(JUMP, value=flags, a=delRA, b=delDEC, c=Rate)
+
+  def Retarget(self, delRA, delDEC, Rate, force=False):
+    """See motion.MotorControl.Retarget.
+    """
+    if self.limits.HWLimit:
+      logger.error('rtproc.RemoteMotors.Retarget called when hardware limit is active.')
+      return True
+    if not (safety.Active.is_set() or force):
+      logger.error('ERROR: rtproc.RemoteMotors.Retarget called when safety interlock is on')
+      return True
+    return self._process.call(RETARGET, value=int(bool(force)), a=delRA, b=delDEC, c=Rate)
+
+  def Scan(self, plans, force=False):
+    """See motion.MotorControl.Scan. The scan profiles are sent to the frame process through the plan area.
+    """
+    if self.limits.HWLimit:
+      logger.error('rtproc.RemoteMotors.Scan called when hardware limit is active.')
+      return True
+    if not (safety.Active.is_set() or force):
+      logger.error('ERROR: rtproc.RemoteMotors.Scan called when safety interlock is on')
+      return True
+    return self._process.callplan(SCAN, tuple([(segments, 0, delta, max_vel) for segments, delta, max_vel in plans]),
+                                  flags=int(bool(force)))
+
+  def ClearQueue(self):
+    self._process.post(CLEARQUEUE)
+
+  def ClearStepError(self):
+    self._process.post(CLEARSTEPERROR)
+    errors.StepError = False
@@ -0,0 +1,221 @@
+
+"""Raster scan mode, for drift-scanning and mapping. A scan sweeps the telescope across a rectangle on the
+   sky at a constant sky speed, one line at a time, in alternating directions, then returns to where it started.
+   It's started with 'Start()' (or the 'scan' Pyro4 call).
+
+   The whole scan is calculated in advance as a stream of per-frame velocities for each axis: the move to
+   the start of the first line, a ramp up to the scan speed before each line, the constant speed scan line
+   itself, a ramp down after it, a move across to the start of the ramp for the next line, and the move back
+   to the starting position at the end. Scan lines are split into CHUNK frame sections, each with its own
+   velocity, so the speed on the sky stays constant even though the RA steps per arcsecond change with
+   declination along the line.
+
+   Every frame sent to the controller is tagged in the frame log with the scan line ID (1 for the first line,
+   and so on, or 0 between lines), so exposures can be matched up with sky position afterwards - see
+   'Lines()'. Scan motion is logged as paddle motion as it happens, so the current position follows
+   the telescope across the scan.
+"""
+
+import math
+
+from globals import *
+import detevent
+import motion
+
+CHUNK = 20     # Number of frames (one second) in each constant velocity section of a scan line
+
+scan = None    # The most recent Scan object, set by Start()
+
+
+def _expand(segments, left):
+  """Return a list of per-frame velocities for a profile returned by motion.JumpProfile, with the 'left'
+     sub-steps spread out over the frames so that the total is exact.
+  """
+  frames = []
+  for n, v in segments:
+    frames += [v] * n
+  if not frames:
+    if left:
+      return [left]       # Small enough to send in a single frame
+    return []
+  q = left // len(frames)
+  frames = [v + q for v in frames]
+  frames[0] += left - q * len(frames)
+  return frames
+
+
+def _compress(frames, lines):
+  """Turn lists of per-frame velocities and line IDs into a list of (frames, velocity, line) segments.
+  """
+  segments = []
+  for v, line in zip(frames, lines):
+    if segments and (segments[-1][1] == v) and (segments[-1][2] == line):
+      segments[-1][0] += 1
+    else:
+      segments.append([1, v, line])
+  return [tuple(s) for s in segments]
+
+
+def _rampframes(velocity, add_vel):
+  """Return the number of frames needed to ramp up to 'velocity' (in sub-steps/frame, signed) at
+     'add_vel' sub-steps/frame/frame.
+  """
+  return max(-(-abs(velocity) // add_vel), 1)
+
+
+class Scan(object):
+  """A raster scan of a rectangle on the sky, and the motion profiles needed to carry it out.
+  """
+  def __init__(self, width, height, pa=0.0, speed=10.0, spacing=10.0, dx=0.0, dy=0.0):
+    """Create a new scan of a rectangle 'width' by 'height' arcseconds, centred 'dx' arcseconds east and 'dy'
+       arcseconds north of the starting position. Scan lines are 'width' arcseconds long and 'spacing'
+       arcseconds apart, scanned at 'speed' arcseconds/second on the sky.
+
+       'pa' is the position angle of the rectangle in degrees, north through east - at pa=0 the scan lines
+       run east-west, and successive lines move north.
+    """
+    if (width <= 0) or (height < 0) or (speed <= 0) or (spacing <= 0):
+      raise ValueError("Scan width, speed and line spacing must be greater than zero")
+    self.width = float(width)
+    self.height = float(height)
+    self.pa = float(pa)
+    self.speed = float(speed)
+    self.spacing = float(spacing)
+    self.dx = float(dx)
+    self.dy = float(dy)
+    self.nlines = int(math.floor(self.height / self.spacing + 1e-9)) + 1
+    self.ends = []         # (start, end) (east, north) offsets of each line from the starting position, in arcseconds
+    theta = math.radians(self.pa)
+    ux, uy = math.cos(theta), -math.sin(theta)     # Unit vector along the scan lines
+    wx, wy = math.sin(theta), math.cos(theta)      # Unit vector from one scan line to the next
+    hx, hy = self.width / 2.0 * ux, self.width / 2.0 * uy
+    for i in range(self.nlines):
+      off = (i - (self.nlines - 1) / 2.0) * self.spacing
+      cx, cy = self.dx + off * wx, self.dy + off * wy
+      if i % 2:
+        self.ends.append(((cx + hx, cy + hy), (cx - hx, cy - hy)))
+      else:
+        self.ends.append(((cx - hx, cy - hy), (cx + hx, cy + hy)))
+    self.dec = None        # Declination (in arcseconds) that the profiles were calculated for
+    self.plans = None      # (RA, DEC) scan profiles for motion.MotorControl.Scan
+    self.frames = 0        # Total number of frames in the scan
+    self.linestarts = []   # Frame offset (from the start of the scan) of the first frame in each scan line
+    self.started = None    # Time the scan was started (or queued)
+
+  def __repr__(self):
+    return "<Scan: %4.1fx%4.1f arcsec at PA %5.1f, %d lines at %4.1f arcsec/sec, %d sec>" % (self.width,
+                                                                                            self.height,
+                                                                                            self.pa,
+                                                                                            self.nlines,
+                                                                                            self.speed,
+                                                                                            self.frames * PULSE)
+
+  def _tosteps(self, x, y):
+    """Convert an (east, north) offset from the starting position, in arcseconds on the sky, to (RA, DEC)
+       in sub-steps.
+    """
+    cosdec = math.cos(math.radians((self.dec + y) / 3600.0))
+    return motion.ToSubsteps(20 * x / cosdec), motion.ToSubsteps(20 * y)
+
+  def _append(self, fa, fb, line):
+    """Add per-frame velocities for each axis, all with the same line ID, to the end of the scan.
+    """
+    self._va += fa
+    self._vb += fb
+    self._lines += [line] * len(fa)
+    self._pos = (self._pos[0] + sum(fa), self._pos[1] + sum(fb))
+
+  def _move(self, target):
+    """Add a jump from the current position in the scan to 'target' (RA, DEC) in sub-steps, with both
+       axes starting and finishing together, followed by a frame at rest. The scan must be at rest before
+       the jump starts.
+    """
+    fa = _expand(*motion.JumpProfile(target[0] - self._pos[0], 0, self._add_vel, self._max_vel))
+    fb = _expand(*motion.JumpProfile(target[1] - self._pos[1], 0, self._add_vel, self._max_vel))
+    n = max(len(fa), len(fb))
+    if n:
+      self._append(fa + [0] * (n - len(fa) + 1), fb + [0] * (n - len(fb) + 1), 0)
+
+  def prepare(self, dec, Rate=None):
+    """Calculate the scan profiles for a declination of 'dec' arcseconds. Moves between lines are made at a
+       peak velocity of 'Rate' steps/second. Raises ValueError if the scan speed is too high for the motors.
+    """
+    if Rate is None:
+      Rate = prefs.SlewRate
+    self.dec = dec
+    self._add_vel, self._max_vel = motion.RampRates(Rate)
+    self._va, self._vb, self._lines = [], [], []
+    self._pos = (0, 0)
+    self.linestarts = []
+    nframes = max(int(round(self.width / self.speed / PULSE)), 1)
+    for i in range(self.nlines):
+      (x0, y0), (x1, y1) = self.ends[i]
+      fa, fb = [], []
+      p0 = self._tosteps(x0, y0)
+      start = p0
+      for k0 in range(0, nframes, CHUNK):
+        k1 = min(k0 + CHUNK, nframes)
+        f = float(k1) / nframes
+        p1 = self._tosteps(x0 + (x1 - x0) * f, y0 + (y1 - y0) * f)
+        n = k1 - k0
+        for d, frames in [(p1[0] - p0[0], fa), (p1[1] - p0[1], fb)]:
+          q = d // n
+          r = d - q * n
+          frames += [q + 1] * r + [q] * (n - r)
+        p0 = p1
+      if max(abs(v) for v in fa + fb) > self._max_vel:
+        raise ValueError("Scan speed of %4.1f arcsec/sec is too fast for the motors at this declination" % self.speed)
+
+      # Ramp up to the line velocity, so that we reach it at the start of the line
+      n = max(_rampframes(fa[0], self._add_vel), _rampframes(fb[0], self._add_vel))
+      ua = [fa[0] * k // n for k in range(1, n)]
+      ub = [fb[0] * k // n for k in range(1, n)]
+      self._move((start[0] - sum(ua), start[1] - sum(ub)))
+      self._append(ua, ub, 0)
+      self.linestarts.append(len(self._va))
+      self._append(fa, fb, i + 1)
+
+      # Ramp down to rest after the end of the line
+      n = max(_rampframes(fa[-1], self._add_vel), _rampframes(fb[-1], self._add_vel))
+      self._append([fa[-1] * (n - k) // n for k in range(1, n + 1)], [fb[-1] * (n - k) // n for k in range(1, n + 1)], 0)
+
+    self._move((0, 0))      # Back to the starting position
+    self.frames = len(self._va)
+    self.plans = ((_compress(self._va, self._lines), self._pos[0], self._max_vel),
+                  (_compress(self._vb, self._lines), self._pos[1], self._max_vel))
+    del self._va, self._vb, self._lines
+
+
+def Start(width, height, pa=0.0, speed=10.0, spacing=10.0, dx=0.0, dy=0.0):
+  """Calculate a new scan (see Scan.__init__ for the arguments), starting at the current position, and start it,
+     or add it to the motion queue if the telescope is moving. Returns the new Scan object, or None if there was
+     an error.
+  """
+  global scan
+  try:
+    s = Scan(width=width, height=height, pa=pa, speed=speed, spacing=spacing, dx=dx, dy=dy)
+    s.prepare(detevent.current.DecC)
+  except ValueError as error:
+    logger.error('scan.Start: %s' % error)
+    return None
+  s.started = time.time()
+  if motion.motors.Scan(s.plans):
+    return None
+  scan = s
+  logger.info("scan.Start: started %s" % s)
+  return s
+
+
+def Lines(seconds=None):
+  """Return a list of (line, first frame number, last frame number, start time, end time) tuples for each scan
+     line in the frame log, oldest first, covering the last 'seconds' seconds (or the time since the last scan was
+     started, if seconds is None). The times are the estimated times that each frame reached the motors - the
+     time it was enqueued, plus the time taken by the frames ahead of it in the controller queue.
+  """
+  if (seconds is None) and (scan is not None):
+    seconds = time.time() - scan.started + 1.0
+  result = motion.motors.Driver.ScanLines(seconds)
+  if result is None:
+    logger.error('scan.Lines: the frame log is not available.')
+    return []
+  return result
@@ -0,0 +1,202 @@
+
+"""Long-run check of the integer sub-step accounting in motion.py - no steps are ever lost or invented by rounding,
+   however long the system runs. Run it with 'python stepcheck.py [frames]', or call 'Run()'.
+
+   A MotorControl object (with no driver or hardware attached) is driven through FRAMES frames (12 hours of
+   telescope time, by default), with non-sidereal and refraction tracking rates that change every RATEINTERVAL
+   seconds, a random jump every JUMPINTERVAL seconds, small offsets (sent as held values, without a ramp) and
+   hand paddle motion in between. At the end, in each axis, the total steps sent to the controller plus the
+   sub-steps still carried over in Axis.frac must exactly equal the sidereal motion, plus the jumps and offsets
+   requested, plus the non-sidereal and refraction tracking, plus the hand paddle motion.
+
+   The tracking motion expected is worked out here, from the rates passed to SetTrack and SetRefraction and the
+   number of frames each was in force for, not taken from the logs kept by the code under test - tracking is
+   suspended while an axis is jumping or paddling, so each frame is classified by watching the axis state at the
+   point Axis._mix decides what to add. Only the hand paddle motion, whose length the script doesn't control, is
+   taken from the paddle log (in the paddle frames). The paddle and refraction logs are then checked against the
+   same totals.
+"""
+
+import random
+import sys
+
+from globals import *
+import motion
+import usbcon
+
+FRAMES = 864000          # Number of frames (12 hours of telescope time) to run by default
+RATEINTERVAL = 600       # Interval between changes of the tracking and refraction rates, in seconds
+JUMPINTERVAL = 1000      # Interval between random jumps, in seconds
+OFFSETINTERVAL = 77      # Interval between small offsets, in seconds
+PADDLEINTERVAL = 311     # Interval between hand paddle presses, in seconds
+PADDLEFRAMES = 100       # Number of frames each hand paddle button is held down for
+JUMPDEGREES = 20.0       # Largest random jump in each axis, in degrees
+SEED = 1                 # Random number seed, so each run is the same
+
+
+class StepCheck(object):
+  """A MotorControl object, and the totals needed to check its accounting, for one run.
+  """
+  def __init__(self, seed=SEED):
+    self.random = random.Random(seed)
+    self.limits = usbcon.LimitStatus()
+    self.motors = motion.MotorControl(limits=self.limits)
+    self.frame = 0
+    self.sent = [0, 0]          # Total steps sent to the controller in each axis
+    self.requested = [0, 0]     # Total jumps and offsets requested in each axis, in sub-steps
+    self.rates = [(0, 0), (0, 0)]   # Current (track, refraction) rates set in each axis, in sub-steps/frame
+    self.tracked = [0, 0]       # Total non-sidereal tracking expected in each axis, in sub-steps
+    self.refracted = [0, 0]     # Total refraction tracking expected in each axis, in sub-steps
+    self.paddled = [0, 0]       # Total hand paddle motion in each axis (from the paddle log), in sub-steps
+    self.padlast = [0, 0]       # Paddle log total after the last frame, in each axis
+    self.kinds = [None, None]   # What each axis did in the current frame - 'jump', 'paddle' or 'track'
+    for i, axis in enumerate([self.motors.RA, self.motors.DEC]):
+      self._watch(i, axis)
+    self.jumps = 0
+    self.offsets = 0
+    self.paddles = 0
+
+  def _watch(self, i, axis):
+    """Wrap axis._mix, to record whether the axis is jumping, paddling or tracking in each frame - the same
+       test _mix uses to decide whether to add the tracking rates.
+    """
+    mix = axis._mix
+    def watched(Frozen=None):
+      if axis.Jumping:
+        self.kinds[i] = 'jump'
+      elif axis.Paddling:
+        self.kinds[i] = 'paddle'
+      else:
+        self.kinds[i] = 'track'
+      return mix(Frozen=Frozen)
+    axis._mix = watched
+
+  def _setrates(self, i, axis, track, refraction):
+    """Set the tracking rates (in steps/frame) for one axis, and remember them, rounded to the nearest sub-step.
+    """
+    axis.SetTrack(track)
+    axis.SetRefraction(refraction)
+    self.rates[i] = (int(round(track * motion.SUBSTEPS)), int(round(refraction * motion.SUBSTEPS)))
+
+  def _jump(self, delRA, delDEC, Rate, offset=False):
+    """Start (or queue) a jump, and add it to the requested totals if it was accepted.
+    """
+    if not self.motors.Jump(delRA, delDEC, Rate, force=True, offset=offset):
+      self.requested[0] += motion.ToSubsteps(delRA)
+      self.requested[1] += motion.ToSubsteps(delDEC)
+      return True
+    return False
+
+  def prepare(self):
+    """Post any motion requests and rate changes for the next frame, as the other threads would.
+    """
+    motors = self.motors
+    r = self.random
+    if self.frame % int(RATEINTERVAL / PULSE) == 0:
+      self._setrates(0, motors.RA, r.uniform(-0.5, 0.5), r.uniform(-0.01, 0.01))
+      self._setrates(1, motors.DEC, r.uniform(-0.5, 0.5), r.uniform(-0.01, 0.01))
+    if self.frame % int(JUMPINTERVAL / PULSE) == int(JUMPINTERVAL / PULSE) // 2:
+      steps = JUMPDEGREES * 3600 * 20
+      if self._jump(r.uniform(-steps, steps), r.uniform(-steps, steps), prefs.SlewRate):
+        self.jumps += 1
+    if self.frame % int(OFFSETINTERVAL / PULSE) == 0:
+      if self._jump(r.uniform(-5, 5), r.uniform(-5, 5), prefs.SlewRate, offset=True):
+        self.offsets += 1
+    paddleframes = int(PADDLEINTERVAL / PULSE)
+    if self.frame % paddleframes == 0:
+      if motors.RA.StartPaddle(r.choice([-1, 1]) * prefs.FineSetRate):
+        self.paddles += 1
+    elif self.frame % paddleframes == PADDLEFRAMES:
+      motors.RA.StopPaddle()
+
+  def step(self):
+    """Calculate the next frame, and add it to the totals sent, and to the tracking or paddle totals for whatever
+       each axis did in this frame.
+    """
+    self.kinds = [None, None]
+    a, b = self.motors.getframe()
+    if prefs.EastOfPier:
+      b = -b      # Undo the DEC inversion, to get the steps in the axis direction
+    self.sent[0] += a
+    self.sent[1] += b
+    for i, axis in enumerate([self.motors.RA, self.motors.DEC]):
+      padtotal = axis.logs[0]
+      if self.kinds[i] == 'track':
+        self.tracked[i] += self.rates[i][0]
+        self.refracted[i] += self.rates[i][1]
+      elif self.kinds[i] == 'paddle':
+        self.paddled[i] += padtotal - self.padlast[i]
+      self.padlast[i] = padtotal
+    self.frame += 1
+
+  def finish(self, limit=72000):
+    """Keep sending frames, with no new requests, until all the motion has finished (or 'limit' frames).
+    """
+    motors = self.motors
+    for i in xrange(limit):
+      if not (motors.Moving or motors.RA.hold or motors.DEC.hold or motors.RA.Pending or motors.DEC.Pending):
+        break
+      self.step()
+
+  def errors(self):
+    """Return the difference (in sub-steps) between the motion sent and the motion expected, in each axis.
+    """
+    result = []
+    for i, axis in enumerate([self.motors.RA, self.motors.DEC]):
+      sent = self.sent[i] * motion.SUBSTEPS + axis.frac
+      expected = (self.frame * axis.subsidereal + self.requested[i] + self.tracked[i] + self.refracted[i] +
+                  self.paddled[i])
+      result.append(sent - expected)
+    return tuple(result)
+
+  def logerrors(self):
+    """Return the difference (in sub-steps) between the paddle and refraction logs and the motion expected in
+       them, as ((RA paddle, RA refraction), (DEC paddle, DEC refraction)).
+    """
+    result = []
+    for i, axis in enumerate([self.motors.RA, self.motors.DEC]):
+      padtotal, reftotal = axis.logs[0], axis.logs[1]
+      result.append((padtotal - self.paddled[i] - self.tracked[i], reftotal - self.refracted[i]))
+    return tuple(result)
+
+
+def Check(frames=FRAMES, seed=SEED):
+  """Run the check for 'frames' frames, and return a dictionary of results - the number of frames run, jumps,
+     offsets and paddle presses, the steps sent in each axis ('sent'), the accounting error in each axis in
+     sub-steps ('errors'), which should be (0, 0), and the errors in the paddle and refraction logs ('logerrors',
+     see StepCheck.logerrors), which should all be zero.
+  """
+  c = StepCheck(seed=seed)
+  for i in xrange(frames):
+    c.prepare()
+    c.step()
+  c.finish()
+  return {'frames':c.frame,
+          'jumps':c.jumps,
+          'offsets':c.offsets,
+          'paddles':c.paddles,
+          'sent':tuple(c.sent),
+          'errors':c.errors(),
+          'logerrors':c.logerrors(),
+          'frac':(c.motors.RA.frac, c.motors.DEC.frac)}
+
+
+def Run(frames=FRAMES):
+  """Run the check, print the results, and raise an AssertionError if any motion was lost or invented.
+  """
+  r = Check(frames=frames)
+  print "%(frames)d frames, %(jumps)d jumps, %(offsets)d offsets, %(paddles)d paddle presses" % r
+  print "Steps sent: RA %d, DEC %d" % r['sent']
+  print "Accounting error: RA %d, DEC %d sub-steps" % r['errors']
+  print "Log errors (paddle, refraction): RA %s, DEC %s sub-steps" % r['logerrors']
+  assert r['errors'] == (0, 0), "Motion lost or invented: %s sub-steps" % (r['errors'],)
+  assert r['logerrors'] == ((0, 0), (0, 0)), "Motion logged wrongly: %s sub-steps" % (r['logerrors'],)
+  assert max([abs(f) for f in r['frac']]) <= motion.SUBSTEPS // 2, "Carried remainder more than half a step"
+  return r
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    Run(frames=int(sys.argv[1]))
+  else:
+    Run()
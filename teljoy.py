@@ -36,18 +36,19 @@ from globals import *
 import usbcon
 import digio
 
-if __name__ == '__main__':
+if __name__ == '__main__' and not prefs.FakeController:
   logger.info('* Resetting controller hardware with hardware_reset()')
-  try:
-    instance = usbcon.controller.Controller(None)
-  except libusb1.USBError:
-    logger.critical("Can't open USB device for telescope controller. Make sure that the controller " +
-                    "is plugged in, and that there isn't another copy of teljoy running.")
-    sys.exit(-1)
-  instance.hardware_reset()
-  time.sleep(0.5)
-  del instance
-  time.sleep(0.5)
+  for device in [prefs.ControllerDevice] + [device for name, device in prefs.ExtraMounts]:
+    try:
+      instance = usbcon.controller.Controller(None, device)
+    except libusb1.USBError:
+      logger.critical("Can't open USB device for telescope controller. Make sure that the controller " +
+                      "is plugged in, and that there isn't another copy of teljoy running.")
+      sys.exit(-1)
+    instance.hardware_reset()
+    time.sleep(0.5)
+    del instance
+    time.sleep(0.5)
 
 import motion
 import detevent
@@ -106,13 +107,16 @@ def cleanup():
   logger.info("Exiting teljoy.py program - here's why: %s" % traceback.print_exc())
   try:
     digio.DomeStop()
-    while motion.motors.Moving or motion.motors.Paddling:
+    while [m for m in motion.mounts.values() if m.motors.Moving or m.motors.Paddling]:
       logger.info("Waiting for slew and hand paddle motion to finish")
       time.sleep(5)
   finally:
-    detevent.fastloop.shutdown()
-    detevent.slowloop.shutdown()
-    motion.motors.Driver.shutdown()
+    for m in motion.mounts.values():
+      for loop in [m.fastloop, m.slowloop]:
+        if loop is not None:
+          loop.shutdown()
+      if m.motors.Driver is not None:
+        m.motors.Driver.shutdown()
     detevent.fastthread.join()
     detevent.slowthread.join()
     time.sleep(1)
@@ -129,6 +133,10 @@ def _safety_shutdown():
   logger.info('Safety shutdown - freezing telescope')
   LastFrozen = motion.motors.Frozen
   freeze(force=True)
+  for m in motion.mounts.values():
+    if m is not motion.mount:
+      LastExtraFrozen[m.name] = m.motors.Frozen
+      m.motors.Frozen = True
   logger.info('Safety shutdown - closing dome shutter')
   LastDome = dome.IsShutterOpen
   dome.close(force=True)
@@ -154,6 +162,9 @@ def _safety_startup():
   else:
     logger.info('Safety startup - telescope already frozen when shut down, not un-freezing')
   LastFrozen = None
+  for name, frozen in LastExtraFrozen.items():
+    motion.mounts[name].motors.Frozen = frozen
+  LastExtraFrozen.clear()
 
 
 safety.register_stopfunction('Safety Shutdown', function=_safety_shutdown, args=[], kwargs={})
@@ -179,6 +190,7 @@ def i():
 if __name__ == '__main__':
   LastDome = None    # State of the dome.IsShutterOpen boolean, saved during safety shutdowns
   LastFrozen = None  # State of the motion.motors.Frozen boolean, saved during safety shutdowns
+  LastExtraFrozen = {}   # State of the Frozen boolean for each extra mount, by name, saved during safety shutdowns
   if SITE == 'PERTH':
     weather.Init()    #Initialise weather package, including SQL connection
   motion.KickStart()
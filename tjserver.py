@@ -21,7 +21,10 @@ import socket
 
 from globals import *
 import detevent
+import dither
 import motion
+import ordering
+import scan
 
 if SITE == 'NZ':
   import nzdome as dome
@@ -43,6 +46,18 @@ Pyro4.config.HMAC_KEY = hmac or Pyro4.config.HMAC_KEY
 
 PYROPORT = 9696
 
+
+def _Pos(spec):
+  """Convert a position passed over Pyro4 (an object name, a tuple of position arguments, or an (args, kws)
+     pair) to a position object, or return None if it can't be parsed.
+  """
+  if type(spec) in [str, unicode]:
+    return utils.Pos(spec)
+  if (len(spec) == 2) and (type(spec[1]) == dict):
+    return utils.Pos(*spec[0], **spec[1])
+  return utils.Pos(*spec)
+
+
 class Telescope(object):
   """Class representing RPC access to the internals of an active telescope control object.
   """
@@ -120,6 +135,30 @@ class Telescope(object):
   def GetInfo(self):
     return detevent.current.__repr__()
 
+  def GetFrameStats(self):
+    """Return the controller queue statistics (frames sent, frames sent with a low queue, the minimum queue
+       depth, and queue underflows) for the main mount, to compare the frame thread and frame process modes.
+    """
+    return motion.motors.Driver.FrameStats()
+
+  def GetJitter(self, reset=False):
+    """Return statistics on the intervals between frames sent to the controller for the main mount, in milliseconds,
+       and start again from scratch afterwards if 'reset' is True.
+    """
+    return motion.motors.Driver.Jitter(reset=reset)
+
+  def GetCounterStats(self, reset=False):
+    """Return the number, rate, USB bandwidth and latency of the controller counter reads for the main mount, and
+       start measuring again from scratch afterwards if 'reset' is True.
+    """
+    return motion.motors.Driver.CounterStatistics(reset=reset)
+
+  def GetUnderflow(self, reset=False):
+    """Return the controller queue underflow prediction and queue depth histogram for the main mount, and start
+       the histogram again from scratch afterwards if 'reset' is True.
+    """
+    return motion.motors.Driver.Underflow(reset=reset)
+
   def Active(self):
     return safety.Active.is_set()
 
@@ -137,6 +176,88 @@ class Telescope(object):
     else:
       return "ERROR: safety interlock set, can't jump telescope"
 
+  def slewtime(self, *args, **kws):
+    """Estimate how long a jump to the given position would take, without moving the telescope. Takes the same
+       arguments as jump(), plus an optional 'start' argument giving the starting position (an object name, or
+       a tuple of arguments for jump()) instead of the current position.
+
+       Returns a dictionary with the slew time in each axis ('ra', 'dec'), the slew time ('slew'), the dome
+       move time ('dome'), the settle time ('settle') and the total time ('total'), all in seconds.
+    """
+    start = kws.pop('start', None)
+    return self.slewtimes([(args, kws)], start=start)[0]
+
+  def slewtimes(self, targets, start=None):
+    """Estimate the slew times for a list of targets, in a single call. Each target is an object name, a
+       tuple of arguments for jump(), or an (args, kws) pair. Returns a list of dictionaries, one for each
+       target (see slewtime()), with None for any target that couldn't be parsed.
+    """
+    From = None
+    if start is not None:
+      From = _Pos(start)
+      if From is None:
+        return [None] * len(targets)
+    result = []
+    for target in targets:
+      ob = _Pos(target)
+      if ob is None:
+        result.append(None)
+      else:
+        result.append(detevent.SlewTime(ob, From=From))
+    return result
+
+  def ordertargets(self, targets, start=None, timelimit=None):
+    """Find the order for observing a list of targets with the least total overhead (slew, dome, settle and
+       waiting time), without moving the telescope. Each target is an object name, a tuple of arguments for
+       jump(), an (args, kws) pair, or a dictionary with the position as 'pos' and optional 'dwell' (seconds),
+       'window' ((earliest, latest) Unix times) and 'pier' ('east' or 'west') values. 'start' is the starting
+       position, as for slewtimes(), and 'timelimit' is the time limit for the search, in seconds.
+
+       Returns a dictionary with the new order ('order', a list of indices into the original list), the total
+       overhead in the original and new orders, in seconds ('given', 'overhead'), the time saved ('saved'), and
+       a list of indices of the targets that would be reached after their windows close ('late'), or an error
+       string if any of the positions couldn't be parsed.
+    """
+    From = None
+    if start is not None:
+      From = _Pos(start)
+      if From is None:
+        return "ERROR: Can't parse the starting position"
+    objs = []
+    for i in range(len(targets)):
+      target = targets[i]
+      if type(target) == dict:
+        ob = _Pos(target['pos'])
+        window = target.get('window', None)
+        if window is not None:
+          window = tuple(window)
+        objs.append(ordering.Target(ob, dwell=target.get('dwell', 0.0), window=window, pier=target.get('pier', None)))
+      else:
+        ob = _Pos(target)
+        objs.append(ob)
+      if ob is None:
+        return "ERROR: Can't parse target %d to get a valid position" % i
+    plan = ordering.Optimise(objs, From=From, timelimit=timelimit)
+    return {'order':plan.indices, 'given':plan.given, 'overhead':plan.overhead, 'saved':plan.saved, 'late':plan.late}
+
+  def retarget(self, *args, **kws):
+    """Send the slew in progress to a new position instead, starting from its current velocity. Takes the
+       same arguments as jump(), and is the same as jump() if the telescope isn't moving.
+    """
+    ob = utils.Pos(*args, **kws)
+    if ob is None:
+      return "ERROR: Can't parse those arguments to get a valid position"
+    if safety.Active.is_set():
+      mesg = "Retargeting to: %s\n" % ob
+      if detevent.current.Retarget(ob):
+        return "ERROR: can't retarget the telescope, see the log for details"
+      if dome.dome.AutoDome:
+        mesg += "Moving dome."
+        dome.dome.move(az=dome.dome.CalcAzi(ob))
+      return mesg
+    else:
+      return "ERROR: safety interlock set, can't jump telescope"
+
   def reset(self, *args, **kws):
     """Set the current RA and DEC to the values given.
        'ra' and 'dec' can be sexagesimal strings (in hours:minutes:seconds for RA and degrees:minutes:seconds
@@ -155,6 +276,45 @@ class Telescope(object):
     detevent.current.Offset(ora=ora, odec=odec)
     return "Moved small offset distance: %4.1f,%4.1f" % (ora,odec)
 
+  def dither(self, kind='spiral', n=9, size=10.0, seed=None):
+    """Set up a new dither pattern, starting at the current position. 'kind' is 'spiral', 'random' or 'grid',
+       'n' is the number of positions and 'size' is the spacing between positions (or the radius, for
+       'random'), in arcseconds.
+    """
+    try:
+      p = dither.Upload(kind=kind, n=n, size=size, seed=seed)
+    except ValueError:
+      return "ERROR: unknown dither pattern '%s', must be one of %s" % (kind, dither.KINDS)
+    return "New dither pattern: %s" % p
+
+  def dithernext(self):
+    """Move to the next position in the current dither pattern. Returns the new position index,
+       or None if there was an error.
+    """
+    return dither.Next()
+
+  def ditherreset(self):
+    """Move back to the start of the current dither pattern. Returns the new position index (0, or None if
+       the starting position isn't one of the pattern positions), or False if there was an error.
+    """
+    return dither.Reset()
+
+  def scan(self, width, height, pa=0.0, speed=10.0, spacing=10.0, dx=0.0, dy=0.0):
+    """Start a raster scan of a rectangle 'width' by 'height' arcseconds, centred 'dx' arcseconds east and 'dy'
+       arcseconds north of the current position, at position angle 'pa' degrees. Scan lines are 'spacing'
+       arcseconds apart, scanned at 'speed' arcseconds/second on the sky.
+    """
+    s = scan.Start(width=width, height=height, pa=pa, speed=speed, spacing=spacing, dx=dx, dy=dy)
+    if s is None:
+      return "ERROR: can't start the scan, see the log for details"
+    return "Scan started: %s" % s
+
+  def scanlines(self, seconds=None):
+    """Return a list of (line, first frame, last frame, start time, end time) tuples for each scan line
+       in the frame log, covering the last 'seconds' seconds (or since the last scan started).
+    """
+    return scan.Lines(seconds=seconds)
+
   def autoguide(self, on):
     """Turn the autoguider mode on or off.
     """
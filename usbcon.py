@@ -11,8 +11,13 @@
    be made world-readable and world-writeable.
 """
 
+import array
+import collections
+
 import controller
 import digio
+import fakeusb
+import postmortem
 from globals import *
 
 
@@ -24,10 +29,611 @@ def binstring(v):
                                          bs[32:40], bs[40:48], bs[48:56], bs[56:64])
 
 
+# Exceptions that are cleared and the controller restarted automatically, if prefs.AutoRestart is True. A
+# shutdown requested by the software, triggered by the shutdown input, or caused by a hardware limit always
+# needs a manual restart.
+AUTORESTART_EXCEPTIONS = [controller.TC_EXCEPTION_QUEUE_UNDERFLOW]
+
+# Hardware limit exceptions - motion that was dropped because of one of these is not re-issued on restart.
+LIMIT_EXCEPTIONS = [controller.TC_EXCEPTION_MCA_POSITIVE_LIMITED,
+                    controller.TC_EXCEPTION_MCA_NEGATIVE_LIMITED,
+                    controller.TC_EXCEPTION_MCB_POSITIVE_LIMITED,
+                    controller.TC_EXCEPTION_MCB_NEGATIVE_LIMITED]
+
+MIN_RESTART_INTERVAL = 10.0   # Don't automatically restart more than once in this many seconds
+
+SHUTDOWN_ACCELERATION = 250   # Deceleration used by the controller when shutting down, in steps/frame/frame
+
+LOWQUEUE = 4         # A frame enqueued with this many frames (or fewer) left in the controller queue was nearly an underflow
+
+ADAPTFRAMES = 200    # Length of each window over which the queue depth margin is measured, in frames (10 seconds)
+ADAPTHISTORY = 30    # Number of windows (5 minutes) used when deciding whether the queue depth can be reduced
+
+JITTERBIN = 0.0005   # Width of each bin in the jitter histogram, in seconds
+JITTERBINS = 400     # Number of bins in the jitter histogram - intervals longer than JITTERBIN*JITTERBINS go in the last one
+
+PREDICTFRAMES = 40   # Number of frames (2 seconds) over which the queue depth trend is measured to predict an underflow
+DEPTHBINS = 64       # Number of bins in the queue depth histogram - deeper queues go in the last one
+
+COUNTERBYTES = 8 + 28   # Bytes sent over USB for each counter read - the control request setup packet, and the counters
+
+
+def ShutdownDistance(velocity, accel=SHUTDOWN_ACCELERATION):
+  """Return the number of steps (signed) moved by the controller while ramping down to rest from 'velocity' steps/frame
+     in the last frame sent before a shutdown, slowing by 'accel' steps/frame/frame in each frame after that. Uses
+     the same ramp as the emergency stops planned by the motion control (motion.StopDistance), scaled to sub-steps.
+  """
+  import motion       # Imported here, because motion imports this module
+  d = motion.StopDistance(abs(velocity) * motion.SUBSTEPS, accel * motion.SUBSTEPS) // motion.SUBSTEPS
+  if velocity < 0:
+    return -d
+  return d
+
+
+def ShutdownFrames(velocity, accel=SHUTDOWN_ACCELERATION):
+  """Return the number of frames the controller takes to ramp down to rest from 'velocity' steps/frame, not counting
+     the last frame sent before the shutdown (see ShutdownDistance).
+  """
+  import motion       # Imported here, because motion imports this module
+  return motion.StopFrames(abs(velocity), accel)
+
+
 class DriverException(Exception):
   pass
 
 
+class FrameLog(object):
+  """Preallocated ring buffer holding the history of every frame sent to the controller - the frame number,
+     the time it was enqueued, the velocity pair (steps/frame in each axis), the number of frames in the
+     controller queue at the time, and the scan line ID (zero if the frame wasn't part of a scan line).
+
+     The storage is a set of fixed-size arrays, so appending a frame never allocates memory, and the buffer can
+     hold hours of frame history for post-mortems after a controller shutdown. Frame numbers are sequential within
+     each controller run, so a frame can be found by number in constant time.
+  """
+  def __init__(self, size=72000):
+    self.size = size
+    self.frames = array.array('L', [0]) * size    # Frame number for each slot
+    self.times = array.array('d', [0.0]) * size   # Timestamp when the frame was enqueued
+    self.va = array.array('h', [0]) * size        # Velocity in axis A (RA), in steps/frame
+    self.vb = array.array('h', [0]) * size        # Velocity in axis B (DEC), in steps/frame
+    self.depth = array.array('H', [0]) * size     # Number of frames in the controller queue when this one was enqueued
+    self.lines = array.array('H', [0]) * size     # Scan line ID for each frame, or zero
+    self.count = 0           # Total number of frames ever added to the log
+    self.runstart = 0        # Value of self.count when the current controller run started
+    self.firstframe = None   # Frame number of the first frame logged in the current controller run
+    self.tota = 0            # Total steps in axis A, in every frame logged in the current controller run
+    self.totb = 0            # Total steps in axis B, in every frame logged in the current controller run
+
+  def __len__(self):
+    return min(self.count, self.size)
+
+  def __repr__(self):
+    return "<FrameLog: %d of %d frames, run started at %d>" % (len(self), self.size, self.runstart)
+
+  def newrun(self):
+    """Called when the controller is (re)started. Frame numbers restart at zero after an exception is cleared,
+       so frames logged before this call can no longer be looked up by frame number, though they stay in the
+       buffer (until overwritten) for post-mortem use.
+    """
+    self.runstart = self.count
+    self.firstframe = None
+    self.tota = 0
+    self.totb = 0
+
+  def append(self, frame_number, timestamp, va, vb, depth, line=0):
+    """Add a new frame to the log, overwriting the oldest entry if the buffer is full.
+    """
+    i = self.count % self.size
+    self.frames[i] = frame_number
+    self.times[i] = timestamp
+    self.va[i] = va
+    self.vb[i] = vb
+    self.depth[i] = depth
+    self.lines[i] = line
+    if self.firstframe is None:
+      self.firstframe = frame_number
+    self.tota += va
+    self.totb += vb
+    self.count += 1
+
+  def index(self, frame_number):
+    """Return the log index (a count of frames since the log was created) for the given frame number in the
+       current controller run, or None if that frame isn't in the log.
+    """
+    if self.firstframe is None:
+      return None
+    i = self.runstart + ((frame_number - self.firstframe) % 0x100000000L)
+    if max(self.runstart, self.count - self.size) <= i < self.count:
+      return i
+    return None
+
+  def get(self, frame_number):
+    """Return a tuple of (frame number, timestamp, va, vb, queue depth, line) for the given frame number in the
+       current controller run, or None if that frame isn't in the log.
+    """
+    i = self.index(frame_number)
+    if i is None:
+      return None
+    i %= self.size
+    return self.frames[i], self.times[i], self.va[i], self.vb[i], self.depth[i], self.lines[i]
+
+  def _slices(self, start, end):
+    """Return a list of (first, last) slot ranges covering log indices start to end-1, split in two if
+       the range wraps around the end of the buffer.
+    """
+    start = max(start, self.count - self.size, 0)
+    end = min(end, self.count)
+    if start >= end:
+      return []
+    s0, s1 = start % self.size, end % self.size
+    if s1 > s0:
+      return [(s0, s1)]
+    elif s1 == 0:
+      return [(s0, self.size)]
+    else:
+      return [(s0, self.size), (0, s1)]
+
+  def sums(self, start, end=None):
+    """Return the total number of steps (in each axis) in all frames from log index start to end-1.
+    """
+    if end is None:
+      end = self.count
+    da, db = 0, 0
+    for s0, s1 in self._slices(start, end):
+      da += sum(self.va[s0:s1])
+      db += sum(self.vb[s0:s1])
+    return da, db
+
+  def since(self, frame_number):
+    """Return the total steps (in each axis) in all frames logged in this controller run AFTER the given frame
+       number, as well as the velocity pair for that frame. Used to find the steps that were queued, but never
+       sent to the motors, when the controller shuts down.
+
+       Returns a tuple (da, db, va, vb), where va and vb are zero if frame_number isn't in the log.
+    """
+    i = self.index(frame_number)
+    if i is None:     # Frame is not in the log, so count every frame in this controller run.
+      da, db = self.sums(self.runstart)
+      return da, db, 0, 0
+    da, db = self.sums(i + 1)
+    return da, db, self.va[i % self.size], self.vb[i % self.size]
+
+  def after(self, frame_number):
+    """Return the number of frames logged in this controller run after the given frame number (every frame in
+       this run, if that frame isn't in the log).
+    """
+    i = self.index(frame_number)
+    if i is None:
+      return self.count - self.runstart
+    return self.count - i - 1
+
+  def stoptime(self, frame_number, window=ADAPTFRAMES):
+    """Return an estimate of the time the controller finished moving the given frame number in this controller
+       run, or if that frame isn't in the log (no frames were moved), the time the first frame in this run was
+       enqueued. Returns None if no frames have been logged in this run.
+
+       Each frame is enqueued just after the controller reports a frame dequeued (frame number less queue depth),
+       so each of the last 'window' frames up to the given one puts an upper limit on the time the controller
+       started frame zero. Reports are only ever late, never early, so the earliest of those is used.
+    """
+    i = self.index(frame_number)
+    if i is None:
+      if self.count <= self.runstart:
+        return None
+      return self.times[self.runstart % self.size]
+    start = None
+    for s0, s1 in self._slices(max(i + 1 - window, self.runstart), i + 1):
+      for j in xrange(s0, s1):
+        t = self.times[j] - (self.frames[j] - 1 - self.depth[j]) * PULSE
+        if (start is None) or (t < start):
+          start = t
+    return start + (frame_number + 1) * PULSE
+
+  def lasttime(self):
+    """Return the time the last frame in this controller run was enqueued, or None if no frames have been
+       logged in this run.
+    """
+    if self.count <= self.runstart:
+      return None
+    return self.times[(self.count - 1) % self.size]
+
+  def commanded(self, frame_number):
+    """Return the total steps (in each axis) in all frames in this controller run, up to and including the
+       given frame number, or None if that frame isn't in the log.
+    """
+    i = self.index(frame_number)
+    if i is None:
+      return None
+    da, db = self.sums(i + 1)
+    return self.tota - da, self.totb - db
+
+  def records(self, seconds=None):
+    """Return a list of (frame number, timestamp, va, vb, queue depth, line) tuples for the most recent frames, oldest
+       first, covering the last 'seconds' seconds (or the entire log, if seconds is None).
+    """
+    if seconds is None:
+      start = 0
+    else:
+      start = self.count - int(seconds / PULSE)
+    result = []
+    for s0, s1 in self._slices(start, self.count):
+      result += zip(self.frames[s0:s1], self.times[s0:s1], self.va[s0:s1], self.vb[s0:s1], self.depth[s0:s1],
+                    self.lines[s0:s1])
+    return result
+
+  def scanlines(self, seconds=None):
+    """Return a list of (line, first frame number, last frame number, start time, end time) tuples for each scan
+       line in the most recent frames, oldest first, covering the last 'seconds' seconds (or the entire log, if
+       seconds is None). The times are the estimated times that each frame reached the motors - the time it was
+       enqueued, plus the time taken by the frames ahead of it in the controller queue. Only the line IDs are
+       scanned, so it's cheap enough to run in the frame thread.
+    """
+    if seconds is None:
+      start = 0
+    else:
+      start = self.count - int(seconds / PULSE)
+    spans = []        # [line, first slot, last slot] for each scan line
+    current = None
+    lines = self.lines
+    for s0, s1 in self._slices(start, self.count):
+      for i in xrange(s0, s1):
+        line = lines[i]
+        if line and (current is not None) and (current[0] == line):
+          current[2] = i
+        elif line:
+          current = [line, i, i]
+          spans.append(current)
+        else:
+          current = None
+    return [(line, self.frames[i], self.frames[j], self.times[i] + self.depth[i] * PULSE,
+             self.times[j] + self.depth[j] * PULSE) for line, i, j in spans]
+
+
+class QueueControl(object):
+  """Chooses the number of frames to keep in the controller queue - the shallowest depth that's safe on this host,
+     between prefs.QueueMinDepth and prefs.QueueMaxDepth. Every frame in the queue adds PULSE seconds to the time
+     between a new motion command (a paddle press, jump, or retarget) and the motors responding to it.
+
+     For each frame enqueued while the controller is running, the deficit is the number of frames the queue had
+     drained below the target depth by the time the frame was sent (normally one - the frame just dequeued), or the
+     number of frames that could have been dequeued since the last one was sent (from the enqueue interval), if
+     that's larger. The target depth needs to be at least the worst deficit, plus prefs.QueueMargin frames.
+
+     If the queue ever gets within prefs.QueueMargin frames of running dry, or underflows, the target goes straight
+     back up to the maximum. Otherwise, at the end of every ADAPTFRAMES frames, the target is moved one frame towards
+     the worst deficit seen over the last ADAPTHISTORY windows, plus the margin. So the depth drops slowly on a quiet
+     host, and backs off immediately under load.
+  """
+  def __init__(self):
+    self.mindepth = max(prefs.QueueMinDepth, 2)
+    self.maxdepth = max(prefs.QueueMaxDepth, self.mindepth)
+    self.margin = prefs.QueueMargin
+    self.target = self.maxdepth   # Current target depth, in frames
+    self.history = collections.deque(maxlen=ADAPTHISTORY)   # Worst deficit in each of the last ADAPTHISTORY windows
+    self.worst = 0                # Worst deficit in the current window
+    self.frames = 0               # Number of frames in the current window
+    self.changes = 0              # Number of times the target depth has changed
+
+  def __repr__(self):
+    return "<QueueControl: target=%d frames (%d-%d), margin=%d>" % (self.target, self.mindepth, self.maxdepth,
+                                                                   self.margin)
+
+  def add(self, depth, interval):
+    """Called for each frame enqueued while the controller is running, with the number of frames in the queue when
+       it was sent, and the time since the previous frame was sent, in seconds.
+    """
+    deficit = self.target - depth
+    late = int(interval / PULSE + 0.5)
+    if late > deficit:
+      deficit = late
+    if deficit > self.worst:
+      self.worst = deficit
+    if depth < self.margin:
+      self.backoff()
+      return
+    self.frames += 1
+    if self.frames >= ADAPTFRAMES:
+      self.history.append(self.worst)
+      self.frames = 0
+      self.worst = 0
+      needed = min(max(max(self.history) + self.margin, self.mindepth), self.maxdepth)
+      if needed > self.target:
+        self._set(needed)
+      elif (needed < self.target) and (len(self.history) == ADAPTHISTORY):
+        self._set(self.target - 1)
+
+  def backoff(self):
+    """Go straight back to the maximum depth, and forget the history - called when the queue nearly runs dry, or
+       underflows.
+    """
+    self.history.clear()
+    self.frames = 0
+    self.worst = 0
+    if self.target != self.maxdepth:
+      self._set(self.maxdepth)
+
+  def _set(self, target):
+    logger.info('usbcon.QueueControl: controller queue depth target changed from %d to %d frames.' % (self.target,
+                                                                                                  target))
+    self.target = target
+    self.changes += 1
+
+
+class JitterLog(object):
+  """Preallocated histogram of the intervals between frames enqueued by enqueue_frame_available, to measure
+     how steadily the frame thread is being run (ideally, once every PULSE seconds). Like the FrameLog, adding
+     an interval never allocates memory.
+  """
+  def __init__(self):
+    self.bins = array.array('L', [0]) * JITTERBINS   # Number of intervals in each JITTERBIN wide bin
+    self.reset()
+
+  def __repr__(self):
+    return "<JitterLog: %d intervals, mean %4.1f ms, max %4.1f ms>" % (self.count, self.total * 1000.0 / max(self.count, 1),
+                                                                       self.max * 1000.0)
+
+  def reset(self):
+    """Throw away all the intervals recorded so far, eg after changing a real-time setting.
+    """
+    for i in xrange(JITTERBINS):
+      self.bins[i] = 0
+    self.count = 0          # Number of intervals recorded
+    self.total = 0.0        # Sum of all the intervals, in seconds
+    self.totalsq = 0.0      # Sum of the squares of all the intervals
+    self.min = 0.0          # Shortest interval, in seconds
+    self.max = 0.0          # Longest interval, in seconds
+    self.last = None        # Time the last frame was enqueued (on controller.monotonic_time), or None at the start of a controller run
+
+  def newrun(self):
+    """Called when the controller is (re)started - the gap since the last frame of the previous run isn't counted.
+    """
+    self.last = None
+
+  def add(self, now):
+    """Record the interval since the last frame, given the time the current frame was enqueued, from
+       controller.monotonic_time, so a step in the system clock doesn't show up as a long or negative interval.
+    """
+    last = self.last
+    self.last = now
+    if last is None:
+      return
+    dt = now - last
+    self.bins[min(int(dt / JITTERBIN), JITTERBINS - 1)] += 1
+    if (self.count == 0) or (dt < self.min):
+      self.min = dt
+    if dt > self.max:
+      self.max = dt
+    self.count += 1
+    self.total += dt
+    self.totalsq += dt * dt
+
+  def percentile(self, p):
+    """Return the upper edge of the histogram bin containing the p'th percentile interval, in seconds.
+    """
+    target = self.count * p / 100.0
+    n = 0
+    for i in xrange(JITTERBINS):
+      n += self.bins[i]
+      if n >= target:
+        return (i + 1) * JITTERBIN
+    return JITTERBINS * JITTERBIN
+
+  def summary(self):
+    """Return a dictionary with the number of intervals, and the mean, standard deviation, minimum, maximum,
+       median, 99th and 99.9th percentile intervals in milliseconds, and the histogram (as a dictionary of bin
+       start time in milliseconds: count, for the non-empty bins).
+    """
+    n = max(self.count, 1)
+    mean = self.total / n
+    std = max(self.totalsq / n - mean * mean, 0.0) ** 0.5
+    return {'count':self.count, 'mean':mean * 1000, 'std':std * 1000, 'min':self.min * 1000, 'max':self.max * 1000,
+            'p50':self.percentile(50) * 1000, 'p99':self.percentile(99) * 1000, 'p999':self.percentile(99.9) * 1000,
+            'histogram':dict([(i * JITTERBIN * 1000, c) for i, c in enumerate(self.bins) if c])}
+
+
+class UnderflowMonitor(object):
+  """Predicts a controller queue underflow before it happens, from the frames enqueued by enqueue_frame_available.
+
+     The queue depth seen by the host is only updated when the controller reports a dequeued frame, so if those
+     reports stop arriving (a USB or host stall), the real queue is shallower than it looks. For each frame sent,
+     the estimated depth is the host's depth, less the frames that should have been dequeued since the last
+     report. The trend in the estimated depth over the last PREDICTFRAMES frames gives the time left before the
+     queue runs dry, if it keeps draining at that rate (or immediately, if it's down to LOWQUEUE frames). If that's
+     less than prefs.UnderflowHorizon seconds, the queue is at risk until the prediction has been clear of twice
+     the horizon for PREDICTFRAMES frames in a row.
+
+     Like the JitterLog, the histograms are preallocated, and adding a frame never allocates memory.
+  """
+  def __init__(self):
+    self.depths = array.array('L', [0]) * DEPTHBINS       # Number of frames sent at each estimated queue depth
+    self.times = array.array('d', [0.0]) * PREDICTFRAMES  # Ring buffer of the times the last frames were sent
+    self.values = array.array('l', [0]) * PREDICTFRAMES   # Ring buffer of the estimated depth when each was sent
+    self.horizon = prefs.UnderflowHorizon
+    self.risk = False         # True if an underflow is predicted within the horizon
+    self.eta = None           # Predicted time left before an underflow, in seconds, or None if the queue isn't draining
+    self.estimate = 0         # Estimated queue depth when the last frame was sent
+    self.clear = 0            # Number of frames in a row with no underflow predicted within twice the horizon
+    self.count = 0
+    self.reset()
+    self.newrun()
+
+  def __repr__(self):
+    if self.eta is None:
+      eta = 'none'
+    else:
+      eta = '%.2f s' % self.eta
+    return "<UnderflowMonitor: risk=%s, eta=%s, depth=%d, %d warnings>" % (self.risk, eta, self.estimate,
+                                                                          self.warnings)
+
+  def reset(self):
+    """Throw away the histogram and warning count so far.
+    """
+    for i in xrange(DEPTHBINS):
+      self.depths[i] = 0
+    self.warnings = 0         # Number of times an underflow has been predicted
+    self.maxgap = 0.0         # Longest time without a dequeued frame reported by the controller, in seconds
+
+  def newrun(self):
+    """Called when the controller is (re)started - frame numbers start again, and the depth trend is discarded.
+    """
+    self.count = 0            # Number of frames added in this controller run
+    self.risk = False
+    self.eta = None
+    self.clear = 0
+    self.dequeued = None      # Last dequeued frame number reported by the controller
+    self.dequeuetime = None   # Time that frame number was first seen, on controller.monotonic_time
+
+  def add(self, now, depth, dequeued):
+    """Record a frame sent at time 'now' (from controller.monotonic_time), with 'depth' frames in the controller
+       queue and 'dequeued' the last frame number reported dequeued by the controller. Returns True if this frame
+       starts a new underflow warning.
+    """
+    if (dequeued != self.dequeued) or (self.dequeuetime is None):
+      self.dequeued = dequeued
+      self.dequeuetime = now
+    gap = now - self.dequeuetime
+    if gap > self.maxgap:
+      self.maxgap = gap
+    estimate = depth - int(gap / PULSE)
+    if estimate < 0:
+      estimate = 0
+    self.estimate = estimate
+    self.depths[min(estimate, DEPTHBINS - 1)] += 1
+
+    i = self.count % PREDICTFRAMES
+    then, before = self.times[i], self.values[i]
+    self.times[i] = now
+    self.values[i] = estimate
+    self.count += 1
+    eta = None
+    if estimate <= LOWQUEUE:
+      eta = estimate * PULSE
+    elif (self.count > PREDICTFRAMES) and (estimate < before) and (now > then):
+      eta = estimate * (now - then) / (before - estimate)
+    self.eta = eta
+
+    if (eta is not None) and (eta < self.horizon):
+      self.clear = 0
+      if not self.risk:
+        self.risk = True
+        self.warnings += 1
+        logger.warning('usbcon.UnderflowMonitor: controller queue underflow predicted in %.2f seconds (%d frames left).' %
+                       (eta, estimate))
+        return True
+    elif self.risk:
+      if (eta is None) or (eta >= 2 * self.horizon):
+        self.clear += 1
+        if self.clear >= PREDICTFRAMES:
+          self.risk = False
+          logger.info('usbcon.UnderflowMonitor: controller queue no longer at risk of underflow.')
+      else:
+        self.clear = 0
+    return False
+
+  def summary(self):
+    """Return a dictionary with the current risk flag, predicted time to an underflow in seconds (or None), estimated
+       queue depth, number of warnings, the longest gap between dequeue reports from the controller in milliseconds,
+       and the queue depth histogram (as a dictionary of depth: count, for the non-empty bins).
+    """
+    return {'risk':self.risk, 'eta':self.eta, 'depth':self.estimate, 'warnings':self.warnings,
+            'maxgap':self.maxgap * 1000, 'histogram':dict([(i, c) for i, c in enumerate(self.depths) if c])}
+
+
+class CounterStats(object):
+  """Measures the cost of reading the controller counters: the number of reads, the USB bandwidth they use, the
+     round trip time of each read, and the mean interval between frames enqueued while a counter read was in
+     flight, compared with the mean interval between the other frames (the extra delay the reads add to the
+     frame stream).
+  """
+  def __init__(self):
+    self.reset()
+
+  def __repr__(self):
+    s = self.summary()
+    return "<CounterStats: %d reads, %.1f bytes/s, latency mean %.1f ms, max %.1f ms>" % (s['reads'], s['bandwidth'],
+                                                                                          s['latency'], s['maxlatency'])
+
+  def reset(self):
+    """Start measuring again from scratch.
+    """
+    self.start = controller.monotonic_time()  # Time the measurements started
+    self.reads = 0            # Number of counter reads completed
+    self.failures = 0         # Number of counter reads that failed
+    self.total = 0.0          # Sum of the round trip times of the completed reads, in seconds
+    self.max = 0.0            # Longest round trip time, in seconds
+    self.busyframes = 0       # Number of frames enqueued while a counter read was in flight
+    self.busytotal = 0.0      # Sum of the intervals before each of those frames, in seconds
+    self.idleframes = 0       # Number of frames enqueued with no counter read in flight
+    self.idletotal = 0.0      # Sum of the intervals before each of those frames, in seconds
+
+  def read(self, latency):
+    """Record a completed counter read, with its round trip time in seconds.
+    """
+    self.reads += 1
+    self.total += latency
+    if latency > self.max:
+      self.max = latency
+
+  def frame(self, interval, busy):
+    """Record the interval since the last frame was enqueued, and whether a counter read was in flight.
+    """
+    if busy:
+      self.busyframes += 1
+      self.busytotal += interval
+    else:
+      self.idleframes += 1
+      self.idletotal += interval
+
+  def summary(self):
+    """Return a dictionary with the number of reads and failures, the read rate (per second) and USB bandwidth
+       used (bytes per second), the mean and maximum round trip time of a read in milliseconds, and the mean
+       interval between frames enqueued with and without a counter read in flight, in milliseconds.
+    """
+    elapsed = max(controller.monotonic_time() - self.start, 1e-6)
+    return {'reads':self.reads, 'failures':self.failures, 'rate':self.reads / elapsed,
+            'bandwidth':self.reads * COUNTERBYTES / elapsed, 'latency':self.total * 1000 / max(self.reads, 1),
+            'maxlatency':self.max * 1000, 'busyinterval':self.busytotal * 1000 / max(self.busyframes, 1),
+            'idleinterval':self.idletotal * 1000 / max(self.idleframes, 1)}
+
+
+class Reconciliation(object):
+  """The result of comparing the steps commanded (the frames in the frame log) with the step counters
+     read from the controller, for one reference frame number.
+
+     The controller's total step counts include the autoguider steps, so the number of steps lost
+     (negative) or gained (positive) by the controller is total - guider - commanded, in each axis. The
+     measured step counters are only compared with the totals if they are non-zero (if the step
+     feedback inputs are connected).
+  """
+  def __init__(self, counters, commanded, run=0, previous=None):
+    self.time = time.time()
+    self.run = run                                   # Frame log index where this controller run started
+    self.frame = counters.reference_frame_number
+    self.commanded = commanded                       # (a, b) steps in all frames up to the reference frame
+    self.total = (counters.a_total_steps, counters.b_total_steps)
+    self.lost = (counters.a_total_steps - counters.a_guider_steps - commanded[0],
+                 counters.b_total_steps - counters.b_guider_steps - commanded[1])
+    self.slip = (0, 0)                               # (a, b) difference between measured and total steps
+    if counters.a_measured_steps or counters.b_measured_steps:
+      self.slip = (counters.a_measured_steps - counters.a_total_steps,
+                   counters.b_measured_steps - counters.b_total_steps)
+    if (previous is not None) and (previous.run == run):
+      # Only the change since the last comparison in this run is new
+      self.new = (self.lost[0] + self.slip[0] - previous.lost[0] - previous.slip[0],
+                  self.lost[1] + self.slip[1] - previous.lost[1] - previous.slip[1])
+    else:
+      self.new = (self.lost[0] + self.slip[0], self.lost[1] + self.slip[1])
+
+  def __repr__(self):
+    return "<Reconciliation: frame %d, commanded=%s, total=%s, lost=%s, slip=%s, new=%s>" % (self.frame,
+                                                                                           self.commanded,
+                                                                                           self.total,
+                                                                                           self.lost,
+                                                                                           self.slip,
+                                                                                           self.new)
+
+
 class LimitStatus(object):
   """Class to represent the hardware limit state/s.
 
@@ -130,20 +736,83 @@ class Driver(controller.Driver):
   """To use the controller, a driver class with callbacks must be
      defined to handle the asynchronous events:
   """
-  def __init__(self, getframe=None, newcounters=None, limits=None):
+  def __init__(self, getframe=None, newcounters=None, limits=None, previous=None, getline=None, device=None,
+               backend=None):
+    """If 'previous' is given, it's the Driver object from the last controller run, and this is a
+       warm restart - the frame log and guider state are carried over. If 'getline' is given, it's called
+       after each call to getframe, and returns the scan line ID to save in the frame log. 'device' selects
+       which controller to use, if more than one is connected (see controller.Controller._find_and_open_device).
+       'backend' replaces the usb1 module used to talk to the controller (see fakeusb.Backend) - if it's None
+       and prefs.FakeController is True, a new emulated controller card is used instead of the hardware.
+    """
     # (Keep some values to generate test steps)
     self._getframe = getframe
+    self._getline = getline
     self._newcounters = newcounters
     self.frame_number = 0
     self.inputs = 0L
     self.configuration = None
     self.running = False
     self.exception = None
-    self.FrameLog = []   # Log of the last few seconds of frame data, as a list of tuples
     self.dropped_frames = None
+    self.dropped_count = 0          # Number of frames queued but never moved, because of the last shutdown
+    self.stopped_at = None          # Estimated time the motors came to rest in the last shutdown
+    self.shutdown_distance = None   # Steps moved by the motors (in each axis) while ramping down in the last shutdown
     self.limits = limits
+    self.device = device
+    self.backend = backend   # USB library replacing usb1, or None to use the real hardware
+    if (backend is None) and prefs.FakeController:
+      self.backend = fakeusb.Backend()
+      self.device = None     # The emulated card stands in for whichever card was selected
     self.counters = None    # Last values read from the controller counters
+    self.reconciliation = None   # Last comparison between the frame log and the controller counters
     self.lock = threading.RLock()
+    self.guider_enabled = False   # True if the autoguider inputs have been enabled
+    self.stop_time = None         # Time that the controller last stopped with an exception
+    self.restart_time = None      # Time of the last automatic restart
+    self.framestats = {'frames':0, 'lowframes':0, 'mindepth':None, 'underflows':0}   # Queue statistics, see FrameStats()
+    self.JitterLog = JitterLog()  # Histogram of the intervals between frames, see Jitter()
+    self.QueueControl = QueueControl()   # Chooses the number of frames to keep in the controller queue
+    self.UnderflowMonitor = UnderflowMonitor()   # Predicts controller queue underflows, see Underflow()
+    self.timerstats = controller.TimerStatistics()   # How late the controller's timer callbacks ran, see FrameStats()
+    self.counter_timer = None     # Periodic timer that reads the controller counters if no frames are being sent
+    self.counters_pending = False   # True while a counter read is in progress
+    self.counters_time = 0.0      # Time the last counter read was started, on controller.monotonic_time
+    self.CounterStats = CounterStats()   # Cost of the counter reads, see CounterStats()
+    self.enqueue_window = prefs.EnqueueWindow   # Number of enqueue transfers allowed in flight in this controller run
+    if previous is None:
+      self.FrameLog = FrameLog(size=int(prefs.FrameLogMinutes * 60 / PULSE))   # Ring buffer of recent frame data
+    else:
+      self.FrameLog = previous.FrameLog
+      self.guider_enabled = previous.guider_enabled
+      self.reconciliation = previous.reconciliation
+      self.stop_time = previous.stop_time
+      self.restart_time = previous.restart_time
+      self.shutdown_distance = previous.shutdown_distance
+      self.framestats = previous.framestats
+      self.JitterLog = previous.JitterLog
+      self.QueueControl = previous.QueueControl
+      self.UnderflowMonitor = previous.UnderflowMonitor
+      self.CounterStats = previous.CounterStats
+      self.timerstats = previous.timerstats
+      self.backend = previous.backend
+      self.device = previous.device
+
+  def internal_attach_host(self, host):
+    """Called by controller.run() with the new controller.Controller object. Frame numbers start again at
+       zero for each new controller object, so mark the start of a new run in the frame log,
+       and set the number of enqueue transfers allowed in flight (prefs.EnqueueWindow). Each run starts at
+       the maximum queue depth, so the first fill always reaches the prefill level and the controller starts.
+       Timer lateness is recorded in this driver's statistics, so it's carried over controller restarts.
+    """
+    controller.Driver.internal_attach_host(self, host)
+    self.enqueue_window = prefs.EnqueueWindow
+    host.set_enqueue_window(self.enqueue_window)
+    host.timer_statistics = self.timerstats
+    self.FrameLog.newrun()
+    self.JitterLog.newrun()
+    self.UnderflowMonitor.newrun()
+    self.QueueControl.backoff()
 
   def get_expected_controller_version(self):
     """This code needs controller version 0.7
@@ -212,8 +881,9 @@ class Driver(controller.Driver):
     # Create a configuration for the controller:
     configuration = controller.ControllerConfiguration(self.host)
 
-    # The motor controller will start once 8 frames are enqueued:
-    configuration.mc_prefill_frames = 8
+    # The motor controller will start once 8 frames are enqueued (or the target queue
+    # depth, if that's less - enqueue_frame_available never fills the queue past it):
+    configuration.mc_prefill_frames = min(8, self.QueueControl.target)
 
     # Set the motor control output pin polarities and the function of the
     # "other" or "shutdown" pin. The other pin can be forced high or low
@@ -240,8 +910,8 @@ class Driver(controller.Driver):
     configuration.mc_b_acceleration_limit = 800   #  so up to six times MOTOR_ACCEL
 
     # Set the deceleration (in steps per frame per frame) to use when shutting down:
-    configuration.mc_a_shutdown_acceleration = 250
-    configuration.mc_b_shutdown_acceleration = 250
+    configuration.mc_a_shutdown_acceleration = SHUTDOWN_ACCELERATION
+    configuration.mc_b_shutdown_acceleration = SHUTDOWN_ACCELERATION
 
     # Set the pulse width, in cycles of the clock frequency (12MHz). In this
     # example the pulse width is 50 clock cycles, and the off time is 50 clock
@@ -345,8 +1015,14 @@ class Driver(controller.Driver):
     self.running = True
     self.lock.release()
     logger.debug('release in _initialise_finished')
-    # Schedule a timer to check the counters:
-    self.host.add_timer(1.0, self._check_counters)
+    if self.guider_enabled:
+      self.host.enable_guider()    # Re-enable the autoguider after a restart
+    if self.stop_time is not None:
+      logger.info("Controller restarted %.3f seconds after the last exception." % (time.time() - self.stop_time))
+      self.stop_time = None
+    # Counter reads are normally started after a frame is enqueued (see _counters_due), but schedule a periodic
+    # timer to check them too, in case no frames are being sent:
+    self.counter_timer = self.host.add_periodic_timer(prefs.CounterInterval, self._check_counters)
 
   def initialisation_error(self, failure):
     """Called by the controller.Controller object, not sure exactly when...
@@ -365,31 +1041,51 @@ class Driver(controller.Driver):
     logger.debug('release in initialise_error_occurred()')
     self.host.stop()
 
+  def _counters_due(self, now):
+    """Return True if it's time ('now', from controller.monotonic_time) to read the counters again - every prefs.GuideCounterInterval seconds while the
+       autoguider is enabled, so guider steps reach the position logs promptly, and every prefs.CounterInterval
+       seconds otherwise.
+    """
+    if self.counters_pending:
+      return False
+    if self.guider_enabled:
+      interval = prefs.GuideCounterInterval
+    else:
+      interval = prefs.CounterInterval
+    return now - self.counters_time >= interval
+
   def _check_counters(self):
     """Grab the counter data, and call _complete_check_counters when the
        data becomes available.
 
-       Called every 10 seconds, using a timer set up for the first time in
-       _initialise_outputs_set above, and re-called by _complete_check_counters
-       below.
+       Called by enqueue_frame_available just after a frame is enqueued, when _counters_due says
+       it's time, so the read follows the enqueue transfer without an extra wake-up of the USB
+       thread. Also called every prefs.CounterInterval seconds by a periodic timer set up in
+       _initialise_finished above, in case no frames are being sent. If the last read hasn't
+       finished yet, or the counters were read recently, the timer call does nothing.
     """
+    if not self._counters_due(controller.monotonic_time()):
+      return
     logger.debug('acq in _check_counters:')
     self.lock.acquire()
     logger.debug('acq in _check_counters success')
     if self.host._running:
+      self.counters_pending = True
+      self.counters_time = controller.monotonic_time()
       d = self.host.get_counters()
-      d.addCallback(self._complete_check_counters)
+      d.addCallbacks(self._complete_check_counters, self._check_counters_error)
     else:
       self.lock.release()
       logger.debug('release in _check_counters - host is not running')
 
   def _complete_check_counters(self, counters):
     """Update the counter log data using the values returned from the controller.
-       Set up another call to update the counters in 60 seconds.
 
        If the self._newcounters attribute was set in __init__, call that function with the
        new counter data, to pass it up to the code that created this driver.
     """
+    self.counters_pending = False
+    self.CounterStats.read(controller.monotonic_time() - self.counters_time)
     self.lock.release()
     logger.debug('release in _complete_check_counters')
     if DEBUG:
@@ -405,7 +1101,14 @@ class Driver(controller.Driver):
     if self._newcounters is not None:
       self._newcounters(counters)     # Pass the new counter values up to the higher level code
 
-    self.host.add_timer(10.0, self._check_counters)
+  def _check_counters_error(self, failure):
+    """Called if reading the counters fails - log it, and try again at the next interval.
+    """
+    self.counters_pending = False
+    self.CounterStats.failures += 1
+    self.lock.release()
+    logger.debug('release in _check_counters_error')
+    logger.error("Reading the controller counters failed: %s" % failure.getErrorMessage())
 
   def enqueue_frame_available(self, details):
     """This method is called when the queue changes (for example, when 
@@ -415,9 +1118,13 @@ class Driver(controller.Driver):
        enqueued, the controller will immediately call this method
        to enqueue another.
     """
-    if details.frames_in_queue < 12:
+    depth = details.frames_in_queue
+    if depth < self.QueueControl.target:
       #Get the next velocity value pair from the motion control system
       va,vb = self._getframe()
+      line = 0
+      if self._getline is not None:
+        line = self._getline()
       #And add those values to the hardware queue.
 #      logger.debug('acq in enqueue_frame_available:')
       self.lock.acquire()
@@ -426,9 +1133,25 @@ class Driver(controller.Driver):
       self.lock.release()
 #      logger.debug('release in enqueue_frame_available')
 
-      self.FrameLog.append((self.frame_number, va, vb))
-      if len(self.FrameLog) > 60:    # Log the last three seconds worth of frames
-        self.FrameLog =  self.FrameLog[1:]
+      # The frame log keeps the wall clock time of each frame, but intervals are measured on the monotonic
+      # clock, so a step in the system time can't look like a stall:
+      now = controller.monotonic_time()
+      last = self.JitterLog.last
+      self.FrameLog.append(self.frame_number, time.time(), va, vb, depth, line)
+      self.JitterLog.add(now)
+
+      if self.running and (self.frame_number >= self.QueueControl.maxdepth):     # Don't count the initial queue fill
+        if last is not None:
+          self.QueueControl.add(depth, now - last)
+          self.CounterStats.frame(now - last, self.counters_pending)
+        if self.UnderflowMonitor.add(now, depth, details.last_dequeued_frame) and prefs.UnderflowDeepen:
+          self._deepen()
+        stats = self.framestats
+        stats['frames'] += 1
+        if depth <= LOWQUEUE:
+          stats['lowframes'] += 1
+        if (stats['mindepth'] is None) or (depth < stats['mindepth']):
+          stats['mindepth'] = depth
 
       # Every "frame" of step data has a unique number, starting with
       # zero. Step counts and guider step counts when queried are
@@ -436,6 +1159,82 @@ class Driver(controller.Driver):
       if DEBUG and (self.frame_number % 1200 == 0):
         logger.debug("* Enqueued Frame (%s = %d, %d)" % (self.frame_number, va, vb))
 
+      # Piggyback a counter read on this enqueue, if one is due:
+      if self.running and self._counters_due(now):
+        self._check_counters()
+
+  def _deepen(self):
+    """Called when an underflow is predicted - go straight to the maximum queue depth, and if frames are reaching
+       the controller too slowly to keep it there, double the enqueue window for the rest of this controller run.
+    """
+    self.QueueControl.backoff()
+    if self.enqueue_window < controller.MAX_ENQUEUE_WINDOW:
+      self.enqueue_window = min(self.enqueue_window * 2, controller.MAX_ENQUEUE_WINDOW)
+      self.host.set_enqueue_window(self.enqueue_window)
+      logger.info('usbcon.Driver: enqueue window increased to %d transfers.' % self.enqueue_window)
+
+  def FrameStats(self):
+    """Return a dictionary of controller queue statistics since startup (carried over controller restarts): the
+       number of frames enqueued once the controller was running, how many of those were enqueued with LOWQUEUE
+       frames or fewer left in the queue, the smallest queue depth seen, the number of queue underflows, the
+       current target queue depth (see QueueControl), and the mean and maximum lateness of the controller's timer
+       callbacks (such as the counter reads), in milliseconds.
+    """
+    d = self.framestats.copy()
+    d['target'] = self.QueueControl.target
+    d['timerlate'] = self.timerstats.mean_lateness() * 1000
+    d['timermaxlate'] = self.timerstats.max_lateness * 1000
+    return d
+
+  def Jitter(self, reset=False):
+    """Return a dictionary of statistics on the intervals between frames enqueued since startup (or the last reset),
+       in milliseconds - see JitterLog.summary. If 'reset' is True, start recording again from scratch afterwards.
+    """
+    result = self.JitterLog.summary()
+    if reset:
+      self.JitterLog.reset()
+    return result
+
+  def Underflow(self, reset=False):
+    """Return a dictionary with the underflow prediction and queue depth histogram since startup (or the last
+       reset) - see UnderflowMonitor.summary. If 'reset' is True, start the histogram again afterwards.
+    """
+    result = self.UnderflowMonitor.summary()
+    if reset:
+      self.UnderflowMonitor.reset()
+    return result
+
+  def CounterStatistics(self, reset=False):
+    """Return a dictionary with the number, rate, USB bandwidth and latency of the counter reads since startup
+       (or the last reset) - see CounterStats.summary. If 'reset' is True, start measuring again afterwards.
+    """
+    result = self.CounterStats.summary()
+    if reset:
+      self.CounterStats.reset()
+    return result
+
+  def ScanLines(self, seconds=None):
+    """Return the scan lines in the frame log over the last 'seconds' seconds (or the whole log, if seconds is
+       None) - see FrameLog.scanlines.
+    """
+    return self.FrameLog.scanlines(seconds)
+
+  def UnderflowRisk(self):
+    """Return True if the controller queue is predicted to underflow soon.
+    """
+    return self.UnderflowMonitor.risk
+
+  def reconcile(self, counters):
+    """Compare the steps commanded in the frame log with the given controller counters, and return
+       a Reconciliation object (also saved in self.reconciliation), or None if the reference frame
+       isn't in the frame log.
+    """
+    commanded = self.FrameLog.commanded(counters.reference_frame_number)
+    if commanded is None:
+      return None
+    self.reconciliation = Reconciliation(counters, commanded, run=self.FrameLog.runstart, previous=self.reconciliation)
+    return self.reconciliation
+
   def state_changed(self, details):
     """Called when the controller run state changes. This is usually either on
        startup when the queue processing starts, or on shutdown when we've told
@@ -456,26 +1255,20 @@ class Driver(controller.Driver):
       d.addCallback(self._get_exception_completed)
 
   def enable_guider(self):
-    """Calls self.host.enable_guider with locking. Turns on the autoguider.
-    """
-    # Note that this isn't threadsafe, but I haven't been able to find a way to acquire/release the lock.
-    # The problem is that the call to self.lock.acquire() is by the calling thread (eg, the command line
-    # handler), and the call to release() in the callback will be by the motion control thread in the
-    # interrupt handler (?). That release call fails, because that thread never acquired the lock.
-    # Using a non-reentrant lock instead  breaks the entire driver thread.
-    d = self.host.enable_guider()
-    return d
+    """Turns on the autoguider. Safe to call from any thread - the controller call is run in the USB thread,
+       and a controller.ControllerFuture is returned.
+    """
+    f = self.host.call_in_loop(self.host.enable_guider)
+    self.guider_enabled = True
+    return f
 
   def disable_guider(self):
-    """Calls self.host.disable_guider with locking. Turns off the autoguider.
-    """
-    # Note that this isn't threadsafe, but I haven't been able to find a way to acquire/release the lock.
-    # The problem is that the call to self.lock.acquire() is by the calling thread (eg, the command line
-    # handler), and the call to release() in the callback will be by the motion control thread in the
-    # interrupt handler (?). That release call fails, because that thread never acquired the lock.
-    # Using a non-reentrant lock instead  breaks the entire driver thread.
-    d = self.host.disable_guider()
-    return d
+    """Turns off the autoguider. Safe to call from any thread - the controller call is run in the USB thread,
+       and a controller.ControllerFuture is returned.
+    """
+    f = self.host.call_in_loop(self.host.disable_guider)
+    self.guider_enabled = False
+    return f
 
   def _get_exception_completed(self, details):
     """Called when we have any exception details after a state change.
@@ -484,6 +1277,10 @@ class Driver(controller.Driver):
     logger.debug('release in get_exeption_completed')
     logger.info("Exception Details: %s" % details)
     self.exception = details
+    if details.exception == controller.TC_EXCEPTION_QUEUE_UNDERFLOW:
+      self.framestats['underflows'] += 1
+      self.QueueControl.backoff()
+    self.stop_time = time.time()
     # Get the counters to see the last frame before the shutdown began:
     logger.debug('acq in get_exception_completed:')
     self.lock.acquire()
@@ -505,42 +1302,46 @@ class Driver(controller.Driver):
 
     # Add up the contents of the frames that were queued to the controller, but not actually
     # sent to the motors because of the shutdown:
-    da, db = 0, 0    # Number of steps queued but not moved after the shutdown.
-    lastframe = counters.reference_frame_number    # Last frame number actually sent to the motors
-    fva, fvb = 0, 0
-    for (n,va,vb) in self.FrameLog:
-      if n == lastframe:
-        fva, fvb = va, vb     # Record the final velocity in each axis at the last frame before the shutdown
-      if n > lastframe:
-        da += va
-        db += vb    # Add the 'lost' velocities in each frame queued but not moved.
+    # da, db is the number of steps queued but not moved after the shutdown, and fva, fvb is the final velocity in
+    # each axis at the last frame actually sent to the motors before the shutdown.
+    da, db, fva, fvb = self.FrameLog.since(counters.reference_frame_number)
 
     # From this tally of dropped steps, subtract the number of steps taken by
     # the motor during the emergency shutdown, using the defined shutdown
     # accelleration in each axis.
-    if fva > 0:   # We were moving in a positive direction before the shutdown
-      while fva > self.configuration.mc_a_shutdown_acceleration:
-        fva -= self.configuration.mc_a_shutdown_acceleration
-        da -= self.configuration.mc_a_shutdown_acceleration
-      da -= fva
-    elif fva < 0:
-      while fva < -self.configuration.mc_a_shutdown_acceleration:
-        fva += self.configuration.mc_a_shutdown_acceleration
-        da += self.configuration.mc_a_shutdown_acceleration
-      da -= fva
-
-    if fvb > 0:   # We were moving in a positive direction before the shutdown
-      while fvb > self.configuration.mc_b_shutdown_acceleration:
-        fvb -= self.configuration.mc_b_shutdown_acceleration
-        db -= self.configuration.mc_b_shutdown_acceleration
-      db -= fvb
-    elif fvb < 0:
-      while fvb < -self.configuration.mc_b_shutdown_acceleration:
-        fvb += self.configuration.mc_b_shutdown_acceleration
-        db += self.configuration.mc_b_shutdown_acceleration
-      db -= fvb
+    sa = ShutdownDistance(fva, self.configuration.mc_a_shutdown_acceleration)
+    sb = ShutdownDistance(fvb, self.configuration.mc_b_shutdown_acceleration)
+    self.shutdown_distance = (sa, sb)
+    ramp = max(ShutdownFrames(fva, self.configuration.mc_a_shutdown_acceleration),
+               ShutdownFrames(fvb, self.configuration.mc_b_shutdown_acceleration))
+    self.stopped_at = self.FrameLog.stoptime(counters.reference_frame_number)
+    if self.stopped_at is not None:
+      self.stopped_at += ramp * PULSE     # Frames in the shutdown ramp
+    logger.info("Shutdown ramp from (%s, %s) steps/frame, (%s, %s) steps to stop." % (fva, fvb, sa, sb))
+    da -= sa
+    db -= sb
 
     self.dropped_frames = (da,db)    # Need to adjust the position by this amount before restarting the queue.
+    self.dropped_count = self.FrameLog.after(counters.reference_frame_number)
+    logger.info("Steps queued but not moved before shutdown: (%s, %s), in %d frames" % (da, db, self.dropped_count))
+
+    # Save the exception details and the last few seconds of the frame log for a post-mortem:
+    if prefs.PostMortemSeconds > 0:
+      postmortem.SaveInBackground(postmortem.Create(self, counters, device=self.device))
+
+    # Counters are reset when the exception is cleared, so pass the final guider steps up now
+    self.counters = counters
+    if self._newcounters is not None:
+      self._newcounters(counters)
+
+    if self.exception is not None and self.exception.exception in AUTORESTART_EXCEPTIONS and prefs.AutoRestart:
+      if (self.restart_time is None) or (time.time() - self.restart_time > MIN_RESTART_INTERVAL):
+        logger.info("Clearable exception - restarting the controller.")
+        self.restart_time = time.time()
+        self.stop()      # Exit controller.run(), so motion.Mount.RunQueue() can restart the controller
+      else:
+        logger.error("Not restarting the controller, last automatic restart was only %.1f seconds ago." %
+                     (time.time() - self.restart_time))
 
   def inputs_changed(self, inputs):
     """Called whenever any of the 'notifiable' binary inputs have changed state.
@@ -552,45 +1353,27 @@ class Driver(controller.Driver):
 
   def set_outputs(self, bitfield):
     """Given a 64-bit number, turn ON the output bit corresponding to every bit equal to '1' in 'bitfield'.
+       Safe to call from any thread - returns a controller.ControllerFuture.
     """
-    # Note that this isn't threadsafe, but I haven't been able to find a way to acquire/release the lock.
-    # The problem is that the call to self.lock.acquire() is by the calling thread (eg, the command line
-    # handler), and the call to release() in the callback will be by the motion control thread in the
-    # interrupt handler (?). That release call fails, because that thread never acquired the lock.
-    # Using a non-reentrant lock instead  breaks the entire driver thread.
-    d = self.host.set_outputs(bitfield)
-    return d
+    return self.host.call_in_loop(self.host.set_outputs, bitfield)
 
   def clear_outputs(self, bitfield):
     """Given a 64-bit number, turn OFF the output bit corresponding to every bit equal to '1' in 'bitfield'.
+       Safe to call from any thread - returns a controller.ControllerFuture.
     """
-    # Note that this isn't threadsafe, but I haven't been able to find a way to acquire/release the lock.
-    # The problem is that the call to self.lock.acquire() is by the calling thread (eg, the command line
-    # handler), and the call to release() in the callback will be by the motion control thread in the
-    # interrupt handler (?). That release call fails, because that thread never acquired the lock.
-    # Using a non-reentrant lock instead  breaks the entire driver thread.
-    d = self.host.clear_outputs(bitfield)
-    return d
+    return self.host.call_in_loop(self.host.clear_outputs, bitfield)
 
   def stop(self):
-    """Stop the controller loop, triggering creation of a new Driver and Controller.
+    """Stop the controller loop, triggering creation of a new Driver and Controller. The motion
+       control state is kept, and any motion that was dropped is re-issued (see motion.Mount.RunQueue).
+       Safe to call from any thread - the call is run in the USB thread, between transfers.
     """
-    logger.debug('acq in stop:')
-    self.lock.acquire()
-    logger.debug('acq in stop() success')
-    self.host.stop()
-    self.lock.release()
-    logger.debug('release in stop()')
+    return self.host.call_in_loop(self.host.stop)
 
   def shutdown(self):
-    """Do a clean shutdown, acquiring the lock first to make sure there's no transfer happening.
+    """Do a clean shutdown. Safe to call from any thread - the call is run in the USB thread, between transfers.
     """
-    logger.debug('acq in shutdown:')
-    self.lock.acquire()
-    logger.debug('acq in shutdown() success')
-    self.host.shutdown()
-    self.lock.release()
-    logger.debug('release in shutdown()')
+    return self.host.call_in_loop(self.host.shutdown)
 
   def run(self):
     """Enter the polling loop. The default poller (returned by select.poll) can
@@ -600,7 +1383,7 @@ class Driver(controller.Driver):
        unrecoverable error that means the main program must exit, and that exception is raised
        by the run() method. If stop() had no arguments, the run() method returns normally.
     """
-    controller.run(driver=self)
+    controller.run(driver=self, device=self.device, backend=self.backend)
 
 
 
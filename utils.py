@@ -14,7 +14,10 @@ elif SITE == 'NZ':
   from nzdome import dome
 import correct
 import detevent
+import dither as dithering     # 'dither' is the command line function below
 import motion
+import ordering
+import scan as scanning       # 'scan' is the command line function below
 import sqlint
 import pyephem
 
@@ -207,6 +210,69 @@ def jump(*args, **kws):
 Jump = jump
 
 
+def slewtime(*args, **kws):
+  """Print an estimate of how long a jump to a new object would take, without moving the telescope. Takes the
+     same arguments as jump().
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  ob = Pos(*args, **kws)
+  if ob is None:
+    print "Can't parse those arguments to get a valid position"
+    return
+  t = detevent.SlewTime(ob)
+  print "Slew to %s: RA %4.1f sec, DEC %4.1f sec, dome %4.1f sec, settle %3.1f sec, total %4.1f sec" % (ob,
+                                                                                                     t['ra'],
+                                                                                                     t['dec'],
+                                                                                                     t['dome'],
+                                                                                                     t['settle'],
+                                                                                                     t['total'])
+
+
+def order(*names):
+  """Print the order for observing a list of objects (given as object names) with the least total overhead,
+     starting from the current position, and the time it saves compared to the order given.
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  objs = []
+  for name in names:
+    ob = Pos(name)
+    if ob is None:
+      print "Can't parse '%s' to get a valid position" % name
+      return
+    objs.append(ob)
+  plan = ordering.Optimise(objs)
+  for i in plan.indices:
+    print "  %s" % names[i]
+  print "Overhead %d sec, instead of %d sec (%d sec saved)" % (plan.overhead, plan.given, plan.saved)
+
+
+def retarget(*args, **kws):
+  """Send the slew in progress to a new object instead, starting from the current velocity. Takes the same
+     arguments as jump(), and does the same thing as jump() if the telescope isn't moving.
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  ob = Pos(*args, **kws)
+  if ob is None:
+    print "Can't parse those arguments to get a valid position"
+    return
+  if not safety.Active.is_set():
+    logger.error("safety interlock, can't jump the telescope")
+    return
+  print "Retargeting to:", ob
+  if detevent.current.Retarget(ob):
+    print "Retarget failed, see the log for details."
+    return
+  if dome.AutoDome:
+    print "Moving dome."
+    dome.move(az=dome.CalcAzi(ob))
+
+
+Retarget = retarget
+
+
 def reset(*args, **kws):
   """Set the current RA and DEC to the values given. 
      'ra' and 'dec' can be sexagesimal strings (in hours:minutes:seconds for RA and degrees:minutes:seconds
@@ -249,6 +315,54 @@ def offset(ora, odec):
 Offset = offset
 
 
+def dither(kind='spiral', n=9, size=10.0, seed=None):
+  """Set up a new dither pattern, starting at the current position. 'kind' is 'spiral', 'random' or 'grid',
+     'n' is the number of positions and 'size' is the spacing between positions (or the radius, for
+     'random'), in arcseconds. Use dnext() to move to each position in turn, and dreset() to go back to
+     the start.
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  try:
+    p = dithering.Upload(kind=kind, n=n, size=size, seed=seed)
+  except ValueError:
+    logger.error("Unknown dither pattern '%s', must be one of %s" % (kind, dithering.KINDS))
+    return
+  print "New dither pattern: %s" % p
+
+
+def dnext():
+  """Move to the next position in the current dither pattern.
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  i = dithering.Next()
+  if i is not None:
+    print "Moving to dither position %d" % i
+
+
+def dreset():
+  """Move back to the start of the current dither pattern.
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  if dithering.Reset() is not False:
+    print "Moving back to the start of the dither pattern"
+
+
+def scan(width, height, pa=0.0, speed=10.0, spacing=10.0, dx=0.0, dy=0.0):
+  """Start a raster scan of a rectangle 'width' by 'height' arcseconds, centred 'dx' arcseconds east and 'dy'
+     arcseconds north of the current position, at position angle 'pa' degrees. Scan lines are 'spacing'
+     arcseconds apart, scanned at 'speed' arcseconds/second on the sky. The telescope returns to the
+     current position when the scan finishes.
+
+       This function is intended to be called manually, by the user at the command line.
+  """
+  s = scanning.Start(width=width, height=height, pa=pa, speed=speed, spacing=spacing, dx=dx, dy=dy)
+  if s is not None:
+    print "Scan started: %s" % s
+
+
 def freeze(force=False):
   """Freeze the telescope. Stops all sidereal and non-sidereal tracking, but maintain position accuracy.
 